@@ -1,12 +1,19 @@
+from datetime import timedelta
+
 from django.contrib import admin
 from django.template.defaultfilters import truncatechars
+from django.utils import timezone
 from django.utils.html import format_html
 
+from .call_logs import get_latency_stats
 from .models import APIKey
+from .models import DailyUsage
 from .models import GameScenario
 from .models import GameStory
+from .models import LLMCallLog
 from .models import LLMConfig
 from .models import LLMModel
+from .models import PooledSkeleton
 from .models import QuotaConfig
 from .models import StoryProgress
 from .models import StorySkeleton
@@ -21,6 +28,54 @@ class QuotaConfigAdmin(admin.ModelAdmin):
     list_filter = ["model"]
 
 
+@admin.register(DailyUsage)
+class DailyUsageAdmin(admin.ModelAdmin):
+    list_display = ["id", "date", "user", "model_name", "count", "updated_at"]
+    list_filter = ["date", "model_name"]
+    search_fields = ["user__username"]
+
+
+@admin.register(LLMCallLog)
+class LLMCallLogAdmin(admin.ModelAdmin):
+    list_display = [
+        "id",
+        "created_at",
+        "purpose",
+        "model_name",
+        "api_key",
+        "prompt_tokens",
+        "completion_tokens",
+        "cached_tokens",
+        "time_to_first_token",
+        "duration",
+        "outcome",
+    ]
+    list_filter = ["purpose", "model_name", "outcome"]
+    date_hierarchy = "created_at"
+    list_select_related = ["api_key"]
+    # Days of the latency stats when no date is selected
+    latency_stats_days = 7
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def changelist_view(self, request, extra_context=None):
+        response = super().changelist_view(request, extra_context=extra_context)
+        if not hasattr(response, "context_data"):
+            # A redirect (e.g. after an action)
+            return response
+
+        queryset = response.context_data["cl"].queryset
+        if not any(param.startswith("created_at__") for param in request.GET):
+            since = timezone.now() - timedelta(days=self.latency_stats_days)
+            queryset = queryset.filter(created_at__gte=since)
+        response.context_data["latency_stats"] = get_latency_stats(queryset)
+        return response
+
+
 @admin.register(LLMModel)
 class LLMModelAdmin(admin.ModelAdmin):
     list_display = [
@@ -47,6 +102,7 @@ class LLMModelAdmin(admin.ModelAdmin):
                     "display_name",
                     "llm_type",
                     "url",
+                    "failover_model",
                 ),
             },
         ),
@@ -137,6 +193,8 @@ class APIKeyAdmin(admin.ModelAdmin):
         "name",
         "masked_key",
         "order",
+        "weight",
+        "rpm_limit",
         "is_active",
         "created_at",
         "updated_at",
@@ -280,6 +338,20 @@ class StorySkeletonAdmin(admin.ModelAdmin):
         return obj.story.created_by
 
 
+@admin.register(PooledSkeleton)
+class PooledSkeletonAdmin(admin.ModelAdmin):
+    list_display = [
+        "id",
+        "genre",
+        "cefr_level",
+        "scene_set",
+        "prompt_version",
+        "served_at",
+        "created_at",
+    ]
+    list_filter = ["genre", "cefr_level"]
+
+
 @admin.register(StoryProgress)
 class StoryProgressAdmin(admin.ModelAdmin):
     list_display = [
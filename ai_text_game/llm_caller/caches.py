@@ -0,0 +1,243 @@
+import hashlib
+import json
+import random
+import re
+import threading
+import time
+from collections import OrderedDict
+from collections.abc import Callable
+from typing import Any
+
+from django.conf import settings
+from django.core.cache import cache
+
+CONFIG_VERSION_CACHE_KEY = "llm_caller:config_version"
+
+
+def get_config_version():
+    """Get the current version of the LLM configuration (models, configs, keys).
+
+    The version lives in the shared Django cache, so that every web and celery
+    worker sees a change made from any process.
+    """
+    version = cache.get(CONFIG_VERSION_CACHE_KEY)
+    if version is None:
+        cache.add(CONFIG_VERSION_CACHE_KEY, time.time_ns(), timeout=None)
+        version = cache.get(CONFIG_VERSION_CACHE_KEY)
+    return version
+
+
+def bump_config_version():
+    """Invalidate everything cached against the current config version."""
+    # A fresh timestamp (rather than an increment) never collides with a version
+    # seen before, even if the cache entry was evicted in the meantime.
+    cache.set(CONFIG_VERSION_CACHE_KEY, time.time_ns(), timeout=None)
+
+
+class VersionedCache:
+    """A bounded per-process cache that is dropped whenever the config version
+    changes.
+    """
+
+    def __init__(self, maxsize: int = 128):
+        self.maxsize = maxsize
+        self._data: OrderedDict = OrderedDict()
+        self._version = None
+        self._lock = threading.Lock()
+
+    def get_or_set(self, key, default: Callable[[], Any], version=None):
+        """Get the cached value for key, or compute and store it with default().
+
+        None is a valid value and will be cached as well.
+        """
+        if version is None:
+            version = get_config_version()
+
+        with self._lock:
+            if self._version != version:
+                self._data.clear()
+                self._version = version
+            if key in self._data:
+                self._data.move_to_end(key)
+                return self._data[key]
+
+        value = default()
+
+        with self._lock:
+            # Do not store values computed against an outdated version
+            if self._version == version:
+                self._data[key] = value
+                while len(self._data) > self.maxsize:
+                    self._data.popitem(last=False)
+        return value
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+
+class CacheStats:
+    """Hit and miss counters of a cache, shared by all processes."""
+
+    def __init__(self, name: str):
+        self.name = name
+
+    def _key(self, counter: str) -> str:
+        return f"llm_caller:cache_stats:{self.name}:{counter}"
+
+    def incr(self, counter: str, delta: int = 1):
+        key = self._key(counter)
+        cache.add(key, 0, timeout=None)
+        try:
+            cache.incr(key, delta)
+        except ValueError:
+            # The counter was evicted in between
+            cache.add(key, delta, timeout=None)
+
+    async def aincr(self, counter: str, delta: int = 1):
+        key = self._key(counter)
+        await cache.aadd(key, 0, timeout=None)
+        try:
+            await cache.aincr(key, delta)
+        except ValueError:
+            # The counter was evicted in between
+            await cache.aadd(key, delta, timeout=None)
+
+    def get(self, counters: list[str]) -> dict[str, int]:
+        values = cache.get_many([self._key(counter) for counter in counters])
+        return {counter: values.get(self._key(counter), 0) for counter in counters}
+
+    def get_hit_rate(self) -> dict:
+        stats = self.get(["hits", "misses"])
+        total = stats["hits"] + stats["misses"]
+        stats["hit_rate"] = stats["hits"] / total if total else 0.0
+        return stats
+
+
+class SceneSetCache:
+    """Generated scene sets, keyed by genre, details and prompt version.
+
+    Up to SCENE_CACHE_VARIANTS sets are kept per key. A request is served from
+    the cache only once all variants have been generated, and then gets a
+    random one, so that players still see varied scenes.
+    """
+
+    def __init__(self):
+        self.stats = CacheStats("scenes")
+
+    @staticmethod
+    def make_key(genre: str, details: str, prompt_version: str) -> str:
+        digest = hashlib.sha256(
+            json.dumps([genre.strip().lower(), details.strip()]).encode(),
+        ).hexdigest()
+        return f"llm_caller:scenes:{prompt_version}:{digest}"
+
+    def get(self, key: str) -> dict | None:
+        """Get a random variant, if all variants of the key have been generated."""
+        if settings.SCENE_CACHE_VARIANTS <= 0:
+            return None
+        scene_set = self._pick(cache.get(key))
+        self.stats.incr("misses" if scene_set is None else "hits")
+        return scene_set
+
+    async def aget(self, key: str) -> dict | None:
+        if settings.SCENE_CACHE_VARIANTS <= 0:
+            return None
+        scene_set = self._pick(await cache.aget(key))
+        await self.stats.aincr("misses" if scene_set is None else "hits")
+        return scene_set
+
+    def _pick(self, variants: list | None) -> dict | None:
+        if variants and len(variants) >= settings.SCENE_CACHE_VARIANTS:
+            return random.choice(variants)  # noqa: S311
+        return None
+
+    def add(self, key: str, scene_set: dict):
+        """Store a newly generated variant."""
+        if settings.SCENE_CACHE_VARIANTS <= 0:
+            return
+        variants = cache.get(key) or []
+        cache.set(key, self._added(variants, scene_set), settings.SCENE_CACHE_TIMEOUT)
+
+    async def aadd(self, key: str, scene_set: dict):
+        if settings.SCENE_CACHE_VARIANTS <= 0:
+            return
+        variants = await cache.aget(key) or []
+        await cache.aset(
+            key,
+            self._added(variants, scene_set),
+            settings.SCENE_CACHE_TIMEOUT,
+        )
+
+    @staticmethod
+    def _added(variants: list, scene_set: dict) -> list:
+        return [*variants, scene_set][-settings.SCENE_CACHE_VARIANTS :]
+
+
+scene_set_cache = SceneSetCache()
+
+
+class ExplanationCache:
+    """Text explanations shared by all users, keyed by the normalised selected
+    text and context, the model and the prompt version.
+    """
+
+    # Rough number of characters per token, to estimate the saved tokens
+    CHARS_PER_TOKEN = 4
+
+    def __init__(self):
+        self.stats = CacheStats("explanations")
+
+    @staticmethod
+    def normalize(text: str) -> str:
+        return re.sub(r"\s+", " ", text).strip()
+
+    def make_key(
+        self,
+        selected_text: str,
+        context_text: str,
+        model_name: str,
+        prompt_version: str,
+    ) -> str:
+        digest = hashlib.sha256(
+            json.dumps(
+                [
+                    self.normalize(selected_text),
+                    self.normalize(context_text),
+                    model_name,
+                    prompt_version,
+                ],
+            ).encode(),
+        ).hexdigest()
+        return f"llm_caller:explanations:{digest}"
+
+    async def aget(self, key: str) -> str | None:
+        """Get the cached explanation, counting the hit and the saved tokens."""
+        if settings.EXPLANATION_CACHE_TIMEOUT <= 0:
+            return None
+        entry = await cache.aget(key)
+        if entry is None:
+            await self.stats.aincr("misses")
+            return None
+        await self.stats.aincr("hits")
+        await self.stats.aincr("saved_tokens", entry["tokens"])
+        return entry["explanation"]
+
+    async def aset(self, key: str, explanation: str, prompt: str):
+        """Store an explanation generated for the prompt."""
+        if settings.EXPLANATION_CACHE_TIMEOUT <= 0:
+            return
+        tokens = (len(prompt) + len(explanation)) // self.CHARS_PER_TOKEN
+        await cache.aset(
+            key,
+            {"explanation": explanation, "tokens": tokens},
+            settings.EXPLANATION_CACHE_TIMEOUT,
+        )
+
+    def get_stats(self) -> dict:
+        stats = self.stats.get_hit_rate()
+        stats.update(self.stats.get(["saved_tokens"]))
+        return stats
+
+
+explanation_cache = ExplanationCache()
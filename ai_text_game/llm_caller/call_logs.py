@@ -0,0 +1,262 @@
+import asyncio
+import atexit
+import logging
+import math
+import threading
+import time
+from collections import defaultdict
+from uuid import UUID
+
+from django.conf import settings
+from django.db import close_old_connections
+from django.db import connections
+from django.db.models import Aggregate
+from django.db.models import Count
+from django.db.models import FloatField
+from django.db.models import Q
+from django.db.models import QuerySet
+from django.db.models import Sum
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.outputs import LLMResult
+
+from .key_scheduler import HTTP_TOO_MANY_REQUESTS
+from .prompt_caching import get_token_usage
+
+logger = logging.getLogger(__name__)
+
+
+class LLMCallLogWriter:
+    """Writes LLMCallLog rows in batches.
+
+    Rows are written by a background thread every flush_interval seconds, or
+    as soon as batch_size rows are waiting, so that LLM calls never wait for
+    the database. With a flush_interval of 0, rows are only written when
+    batch_size rows are waiting (or on flush()), by the caller.
+    """
+
+    def __init__(self, batch_size: int = 100, flush_interval: float = 5):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.rows: list[dict] = []
+        self._lock = threading.Lock()
+        self._wake_up = threading.Event()
+        self._thread: threading.Thread | None = None
+
+    def add(self, row: dict):
+        with self._lock:
+            self.rows.append(row)
+            is_full = len(self.rows) >= self.batch_size
+            if self.flush_interval > 0 and self._thread is None:
+                self._thread = threading.Thread(
+                    target=self._run,
+                    name="llm-call-log-writer",
+                    daemon=True,
+                )
+                self._thread.start()
+
+        if is_full:
+            if self._thread is not None:
+                self._wake_up.set()
+            else:
+                self.flush()
+
+    def flush(self):
+        """Write the waiting rows now."""
+        from .models import LLMCallLog
+
+        with self._lock:
+            rows, self.rows = self.rows, []
+        if not rows:
+            return
+        try:
+            LLMCallLog.objects.bulk_create([LLMCallLog(**row) for row in rows])
+        except Exception:
+            logger.exception("Error writing %d LLM call logs", len(rows))
+
+    def _run(self):
+        while True:
+            self._wake_up.wait(self.flush_interval)
+            self._wake_up.clear()
+            close_old_connections()
+            self.flush()
+
+
+call_log_writer = LLMCallLogWriter(
+    batch_size=settings.LLM_CALL_LOG_BATCH_SIZE,
+    flush_interval=settings.LLM_CALL_LOG_FLUSH_INTERVAL,
+)
+atexit.register(call_log_writer.flush)
+
+
+def get_outcome(error: BaseException) -> str:
+    if isinstance(error, asyncio.CancelledError | GeneratorExit):
+        # e.g. a hedged call that lost, or a closed WebSocket
+        return "cancelled"
+    response = getattr(error, "response", None)
+    if getattr(response, "status_code", None) == HTTP_TOO_MANY_REQUESTS:
+        return "rate_limited"
+    return "error"
+
+
+class LLMCallLogHandler(BaseCallbackHandler):
+    """Logs the tokens and latency of the calls of an LLM to LLMCallLog.
+
+    The purpose of a call is taken from the "purpose" metadata of its run (see
+    get_config_llm_model).
+    """
+
+    # Run in the event loop of async calls instead of in an executor thread:
+    # the callbacks only record timestamps and hand the row to the writer
+    run_inline = True
+
+    def __init__(
+        self,
+        model_name: str,
+        api_key_id: int | None,
+        writer: LLMCallLogWriter = call_log_writer,
+    ):
+        self.model_name = model_name
+        self.api_key_id = api_key_id
+        self.writer = writer
+        # Started runs as {run ID: [purpose, start time, first token time]}
+        self.runs: dict[UUID, list] = {}
+
+    def on_chat_model_start(
+        self,
+        serialized,
+        messages,
+        *,
+        run_id: UUID,
+        metadata: dict | None = None,
+        **kwargs,
+    ) -> None:
+        purpose = (metadata or {}).get("purpose", "")
+        self.runs[run_id] = [purpose, time.monotonic(), None]
+
+    def on_llm_new_token(self, token: str, *, run_id: UUID, **kwargs) -> None:
+        run = self.runs.get(run_id)
+        if run is not None and run[2] is None:
+            run[2] = time.monotonic()
+
+    def on_llm_end(self, response: LLMResult, *, run_id: UUID, **kwargs) -> None:
+        self._log(run_id, "success", get_token_usage(response))
+
+    def on_llm_error(self, error: BaseException, *, run_id: UUID, **kwargs) -> None:
+        self._log(run_id, get_outcome(error), {})
+
+    def _log(self, run_id: UUID, outcome: str, usage: dict):
+        run = self.runs.pop(run_id, None)
+        if run is None or not settings.LLM_CALL_LOG_ENABLED:
+            return
+        purpose, started_at, first_token_at = run
+        self.writer.add(
+            {
+                "purpose": purpose,
+                "model_name": self.model_name,
+                "api_key_id": self.api_key_id,
+                "prompt_tokens": usage.get("input_tokens", 0),
+                "completion_tokens": usage.get("output_tokens", 0),
+                "cached_tokens": usage.get("cache_read_tokens", 0),
+                "time_to_first_token": (
+                    None if first_token_at is None else first_token_at - started_at
+                ),
+                "duration": time.monotonic() - started_at,
+                "outcome": outcome,
+                "created_at": timezone.now(),
+            },
+        )
+
+
+# Latency percentiles of the stats (see get_latency_stats)
+LATENCY_PERCENTILES = (50, 95)
+
+
+class PercentileDisc(Aggregate):
+    """The percentile_disc() aggregate of PostgreSQL (a nearest-rank percentile)."""
+
+    function = "PERCENTILE_DISC"
+    template = "%(function)s(%(fraction)s) WITHIN GROUP (ORDER BY %(expressions)s)"
+    output_field = FloatField()
+
+    def __init__(self, expression, percentile: float, **extra):
+        super().__init__(expression, fraction=float(percentile) / 100, **extra)
+
+
+def get_percentile(values: list[float], percentile: float) -> float | None:
+    """Get the percentile of the values (nearest rank, like percentile_disc()),
+    or None if empty."""
+    if not values:
+        return None
+    values = sorted(values)
+    index = max(math.ceil(len(values) * percentile / 100) - 1, 0)
+    return values[index]
+
+
+def get_latency_stats(queryset: QuerySet) -> list[dict]:
+    """Get the latency percentiles of the calls per day, purpose and model.
+
+    The calls are aggregated by the database; only on databases other than
+    PostgreSQL are the latencies of the successful calls fetched to compute
+    the percentiles.
+
+    Returns:
+        A row per (day, purpose, model name), latest day first
+    """
+    succeeded = Q(outcome="success")
+    aggregates = {
+        "calls": Count("id"),
+        "failures": Count("id", filter=Q(outcome__in=["error", "rate_limited"])),
+        "prompt_tokens": Sum("prompt_tokens", filter=succeeded),
+        "cached_tokens": Sum("cached_tokens", filter=succeeded),
+    }
+    has_percentiles = connections[queryset.db].vendor == "postgresql"
+    if has_percentiles:
+        for percentile in LATENCY_PERCENTILES:
+            aggregates[f"duration_p{percentile}"] = PercentileDisc(
+                "duration",
+                percentile,
+                filter=succeeded,
+            )
+            aggregates[f"ttft_p{percentile}"] = PercentileDisc(
+                "time_to_first_token",
+                percentile,
+                filter=succeeded,
+            )
+
+    stats = list(
+        queryset.annotate(day=TruncDate("created_at"))
+        .values("day", "purpose", "model_name")
+        .annotate(**aggregates)
+        .order_by("-day", "purpose", "model_name"),
+    )
+    if not has_percentiles:
+        add_latency_percentiles(queryset, stats)
+    for row in stats:
+        prompt_tokens = row.pop("prompt_tokens") or 0
+        cached_tokens = row.pop("cached_tokens") or 0
+        row["cached_ratio"] = cached_tokens / prompt_tokens if prompt_tokens else 0
+    return stats
+
+
+def add_latency_percentiles(queryset: QuerySet, stats: list[dict]):
+    """Add the latency percentiles of the successful calls to the stats rows."""
+    latencies = defaultdict(lambda: ([], []))
+    calls = (
+        queryset.filter(outcome="success")
+        .annotate(day=TruncDate("created_at"))
+        .values_list("day", "purpose", "model_name", "duration", "time_to_first_token")
+        .order_by()
+    )
+    for day, purpose, model_name, duration, ttft in calls.iterator():
+        durations, ttfts = latencies[(day, purpose, model_name)]
+        durations.append(duration)
+        if ttft is not None:
+            ttfts.append(ttft)
+
+    for row in stats:
+        durations, ttfts = latencies[(row["day"], row["purpose"], row["model_name"])]
+        for percentile in LATENCY_PERCENTILES:
+            row[f"duration_p{percentile}"] = get_percentile(durations, percentile)
+            row[f"ttft_p{percentile}"] = get_percentile(ttfts, percentile)
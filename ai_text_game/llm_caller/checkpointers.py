@@ -0,0 +1,98 @@
+import threading
+from collections import OrderedDict
+from collections import defaultdict
+
+from django.conf import settings
+from langchain_core.runnables import RunnableConfig
+from langgraph.checkpoint.base import BaseCheckpointSaver
+from langgraph.checkpoint.base import ChannelVersions
+from langgraph.checkpoint.base import Checkpoint
+from langgraph.checkpoint.base import CheckpointMetadata
+from langgraph.checkpoint.memory import InMemorySaver
+
+
+class PrunedInMemorySaver(InMemorySaver):
+    """An InMemorySaver keeping only the latest checkpoints of the latest threads.
+
+    InMemorySaver keeps every checkpoint of every thread (story) for the life of
+    the process. Here each thread keeps its max_checkpoints latest checkpoints
+    (with their writes and channel values), and the least recently used threads
+    are dropped beyond max_threads, so memory stays flat however long the
+    stories are played.
+    """
+
+    def __init__(self, max_checkpoints: int = 1, max_threads: int = 1024, **kwargs):
+        super().__init__(**kwargs)
+        self.max_checkpoints = max_checkpoints
+        self.max_threads = max_threads
+        # Threads by last use, and the channel value keys of each thread
+        self.threads: OrderedDict[str, None] = OrderedDict()
+        self.blob_keys: defaultdict[tuple[str, str], set] = defaultdict(set)
+        self._lock = threading.Lock()
+
+    def put(
+        self,
+        config: RunnableConfig,
+        checkpoint: Checkpoint,
+        metadata: CheckpointMetadata,
+        new_versions: ChannelVersions,
+    ) -> RunnableConfig:
+        next_config = super().put(config, checkpoint, metadata, new_versions)
+        thread_id = config["configurable"]["thread_id"]
+        checkpoint_ns = config["configurable"]["checkpoint_ns"]
+
+        with self._lock:
+            self.blob_keys[(thread_id, checkpoint_ns)].update(
+                (thread_id, checkpoint_ns, channel, version)
+                for channel, version in new_versions.items()
+            )
+            self._prune_checkpoints(thread_id, checkpoint_ns)
+
+            self.threads[thread_id] = None
+            self.threads.move_to_end(thread_id)
+            while len(self.threads) > self.max_threads:
+                old_thread_id, _ = self.threads.popitem(last=False)
+                self._delete_thread(old_thread_id)
+        return next_config
+
+    def delete_thread(self, thread_id: str) -> None:
+        with self._lock:
+            self.threads.pop(thread_id, None)
+            self._delete_thread(thread_id)
+
+    def _prune_checkpoints(self, thread_id: str, checkpoint_ns: str):
+        checkpoints = self.storage[thread_id][checkpoint_ns]
+        # Checkpoints are stored in creation order
+        for checkpoint_id in list(checkpoints)[: -self.max_checkpoints]:
+            del checkpoints[checkpoint_id]
+            self.writes.pop((thread_id, checkpoint_ns, checkpoint_id), None)
+
+        # Drop the channel values no kept checkpoint refers to
+        used_keys = {
+            (thread_id, checkpoint_ns, channel, version)
+            for saved_checkpoint, _, _ in checkpoints.values()
+            for channel, version in self.serde.loads_typed(saved_checkpoint)[
+                "channel_versions"
+            ].items()
+        }
+        blob_keys = self.blob_keys[(thread_id, checkpoint_ns)]
+        for key in blob_keys - used_keys:
+            self.blobs.pop(key, None)
+        blob_keys &= used_keys
+
+    def _delete_thread(self, thread_id: str):
+        for checkpoint_ns, checkpoints in self.storage.pop(thread_id, {}).items():
+            for checkpoint_id in checkpoints:
+                self.writes.pop((thread_id, checkpoint_ns, checkpoint_id), None)
+            for key in self.blob_keys.pop((thread_id, checkpoint_ns), ()):
+                self.blobs.pop(key, None)
+
+
+def create_story_graph_checkpointer() -> BaseCheckpointSaver | None:
+    """Create the checkpointer of the story graph (see STORY_GRAPH_CHECKPOINTER)."""
+    if settings.STORY_GRAPH_CHECKPOINTER == "memory":
+        return PrunedInMemorySaver(
+            max_checkpoints=settings.STORY_GRAPH_MAX_CHECKPOINTS,
+            max_threads=settings.STORY_GRAPH_MAX_THREADS,
+        )
+    return None
@@ -1,35 +1,60 @@
+import asyncio
 import json
 import logging
 
 from anthropic import AnthropicError
-from channels.db import database_sync_to_async
 from channels.generic.websocket import AsyncWebsocketConsumer
 from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
 from groq import GroqError
 from langchain_core.output_parsers.string import StrOutputParser
-from langchain_core.prompts import ChatPromptTemplate
 from openai import OpenAIError
 
-from .models import APIKey
+from .caches import VersionedCache
+from .caches import explanation_cache
+from .checkpointers import create_story_graph_checkpointer
+from .llm_router import get_config_llm_model
+from .metrics import database_sync_to_async
+from .metrics import span
+from .metrics import timed_handler
 from .models import GameStory
 from .models import LLMConfig
+from .models import PooledSkeleton
 from .models import StoryOption
 from .models import StoryProgress
 from .models import TextExplanation
+from .quotas import record_usage
+from .skeleton_worker import SKELETON_GENERATION_CHANNEL
+from .speculation import SpeculativeContinuations
+from .story_graph import SkeletonIndex
 from .story_graph import StoryGraph
+from .streaming import StreamBuffer
+from .streaming import replay_text
 from .tasks import generate_story_skeleton
-from .utils import get_llm_model
+from .tasks import summarize_story_progress
 
 logger = logging.getLogger(__name__)
 
+# Compiled story graphs shared by all connections, keyed by is_demo
+story_graph_cache = VersionedCache(maxsize=2)
+
 
 class GameConsumer(AsyncWebsocketConsumer):
-    START_GAME_SINCE_MILESTONE = 2
+    START_GAME_SINCE_MILESTONE = 1
 
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
         self.story_graph = None
+        self.speculation = None
         self.story_thread = {"configurable": {"thread_id": "1"}}
+        # Keep references to background tasks so they are not garbage collected
+        self.background_tasks = set()
+        # Story messages are handled one at a time, in order, by a worker task,
+        # while explanations run concurrently with the story and each other
+        self.story_queue = asyncio.Queue()
+        self.story_worker = None
+        self.explanation_tasks = []
 
     async def connect(self):
         logger.debug("WebSocket connect attempt with scope: %s", self.scope)
@@ -58,6 +83,12 @@ class GameConsumer(AsyncWebsocketConsumer):
 
     async def disconnect(self, close_code):
         logger.debug("WebSocket disconnected with code: %s", close_code)
+        if self.speculation:
+            self.speculation.cancel()
+        if self.story_worker:
+            self.story_worker.cancel()
+        for task in self.explanation_tasks:
+            task.cancel()
         # Leave room group
         await self.channel_layer.group_discard(
             self.room_group_name,
@@ -68,20 +99,59 @@ class GameConsumer(AsyncWebsocketConsumer):
         data = json.loads(text_data)
         message_type = data.get("type")
 
+        if message_type == "start_story":
+            self.enqueue_story_task(self.handle_start_story)
+        elif message_type == "interact":
+            self.enqueue_story_task(self.handle_interaction, data)
+        elif message_type == "explain_text":
+            self.start_explanation(data)
+
+    def enqueue_story_task(self, handler, *args):
+        """Queue a story message; story messages are handled in order."""
+        if self.story_worker is None:
+            self.story_worker = asyncio.create_task(self.run_story_worker())
+        self.story_queue.put_nowait((handler, args))
+
+    async def run_story_worker(self):
+        while True:
+            handler, args = await self.story_queue.get()
+            try:
+                await self.run_message_handler(handler, *args)
+            except Exception:
+                logger.exception("Error handling story message")
+
+    def start_explanation(self, data):
+        """Run an explanation concurrently with the story.
+
+        At most MAX_EXPLANATIONS_PER_CONNECTION explanations run at once; the
+        oldest ones are cancelled to make room for new ones.
+        """
+        self.explanation_tasks = [
+            task for task in self.explanation_tasks if not task.done()
+        ]
+        n_stale = (
+            len(self.explanation_tasks) - settings.MAX_EXPLANATIONS_PER_CONNECTION + 1
+        )
+        for task in self.explanation_tasks[: max(n_stale, 0)]:
+            task.cancel()
+
+        task = self.run_in_background(
+            self.run_message_handler(self.handle_text_explanation, data),
+        )
+        self.explanation_tasks.append(task)
+
+    async def run_message_handler(self, handler, *args):
         try:
-            if message_type == "start_story":
-                await self.handle_start_story()
-            elif message_type == "interact":
-                await self.handle_interaction(data)
-            elif message_type == "explain_text":
-                await self.handle_text_explanation(data)
+            await handler(*args)
         except (AnthropicError, OpenAIError, GroqError) as e:
             await self.send_error(str(e))
             raise
 
+    @timed_handler("start_story")
     async def handle_start_story(self):
         try:
-            story = await self.get_story(self.story_id)
+            with span("get_story"):
+                story = await self.get_story(self.story_id)
 
             if story.status != "INIT":
                 await self.send_error("Story already started.")
@@ -99,13 +169,19 @@ class GameConsumer(AsyncWebsocketConsumer):
                 )
 
             # If skeleton exists, use it
-            story_skeleton = await self.try_get_skeleton(story)
+            with span("get_skeleton"):
+                story_skeleton = await self.try_get_skeleton(story)
             if not story_skeleton or story_skeleton.status == "FAILED":
+                # Use a pre-generated skeleton for the scene, if there is one
+                with span("claim_pooled_skeleton"):
+                    is_claimed = await self.claim_pooled_skeleton(story)
+                if is_claimed:
+                    await self.update_story_progress(story)
+                    return
+
                 # Start background skeleton generation
-                await database_sync_to_async(generate_story_skeleton.delay)(
-                    story.id,
-                    initial_state,
-                )
+                with span("start_skeleton_generation"):
+                    await self.start_skeleton_generation(story, initial_state)
 
                 # Send status update to client
                 await self.send(
@@ -129,38 +205,48 @@ class GameConsumer(AsyncWebsocketConsumer):
             await self.send_error(str(e))
             raise
 
+    @timed_handler("interaction")
     async def handle_interaction(self, data):
         try:
-            story = await self.get_story(self.story_id)
+            with span("get_story"):
+                story = await self.get_story(self.story_id)
             option_id = data.get("option_id")
 
             if not option_id:
                 await self.send_error("option_id is required")
                 return
 
-            option_text = await database_sync_to_async(story.get_option_text)(option_id)
+            with span("get_option_text"):
+                option_text = await database_sync_to_async(story.get_option_text)(
+                    option_id,
+                )
             if not option_text:
                 await self.send_error(f"Invalid option_id: {option_id}")
                 return
 
-            is_valid_option = await database_sync_to_async(
-                story.is_option_id_in_current_decision_point,
-            )(option_id)
+            with span("check_option"):
+                is_valid_option = await database_sync_to_async(
+                    story.is_option_id_in_current_decision_point,
+                )(option_id)
             if not is_valid_option:
                 await self.send_error(f"Decision already made: {option_id}")
                 return
 
-            if not await self.can_proceed(story):
+            with span("can_proceed"):
+                can_proceed = await self.can_proceed(story)
+            if not can_proceed:
                 await self.send_error(
                     "Skeleton is still generating, please retry later.",
                 )
                 return
 
             # Update the story progress with chosen option
-            await self.handle_user_selection(story, option_id, option_text)
+            with span("save_selection"):
+                await self.handle_user_selection(story, option_id, option_text)
 
             # Summarize the segment and decision
-            await self.summarize_latest_progress(story)
+            with span("summary"):
+                await self.schedule_progress_summary(story)
 
             await self.update_story_progress(story)
 
@@ -172,9 +258,11 @@ class GameConsumer(AsyncWebsocketConsumer):
     def can_proceed(self, story):
         return story.can_proceed
 
+    @timed_handler("explanation")
     async def handle_text_explanation(self, data):
         try:
-            story = await self.get_story(self.story_id)
+            with span("get_story"):
+                story = await self.get_story(self.story_id)
             selected_text = data.get("selected_text")
             context_text = data.get("context_text")
             client_explanation_id = data.get("explanation_id")
@@ -184,11 +272,12 @@ class GameConsumer(AsyncWebsocketConsumer):
                 return
 
             # Create explanation
-            explanation = await self.create_text_explanation(
-                story,
-                selected_text,
-                context_text,
-            )
+            with span("create_explanation"):
+                explanation = await self.create_text_explanation(
+                    story,
+                    selected_text,
+                    context_text,
+                )
 
             # Send creation confirmation
             await self.send(
@@ -202,11 +291,61 @@ class GameConsumer(AsyncWebsocketConsumer):
             )
 
             # Process the explanation
-            await self.process_explanation(story, explanation)
+            try:
+                await self.process_explanation(story, explanation)
+            except asyncio.CancelledError:
+                await asyncio.shield(self.cancel_explanation(explanation))
+                raise
 
         except (ValueError, TextExplanation.DoesNotExist) as e:
             await self.send_error(str(e))
 
+    async def cancel_explanation(self, explanation):
+        """Mark an explanation superseded by newer ones as failed."""
+        explanation.status = "failed"
+        explanation.error = "Cancelled"
+        await database_sync_to_async(explanation.save)()
+        await self.send(
+            text_data=json.dumps(
+                {
+                    "type": "explanation_status",
+                    "explanation_id": explanation.id,
+                    "status": "failed",
+                },
+            ),
+        )
+
+    async def start_skeleton_generation(self, story, initial_state):
+        """Start generating the skeleton in the configured backend."""
+        if settings.SKELETON_GENERATION_BACKEND == "worker":
+            await self.channel_layer.send(
+                SKELETON_GENERATION_CHANNEL,
+                {
+                    "type": "generate_skeleton",
+                    "story_id": story.id,
+                    "initial_state": initial_state,
+                },
+            )
+        else:
+            await database_sync_to_async(generate_story_skeleton.delay)(
+                story.id,
+                initial_state,
+            )
+
+    @database_sync_to_async
+    def claim_pooled_skeleton(self, story):
+        """Claim the pre-generated skeleton for the scene of the story.
+
+        Stories with details are always generated on demand.
+        """
+        if settings.SKELETON_POOL_SIZE <= 0 or story.details:
+            return None
+        prompt_version = PooledSkeleton.get_prompt_version(is_demo=story.is_demo)
+        skeleton = PooledSkeleton.claim(story, prompt_version)
+        if skeleton is not None:
+            story.skeleton = skeleton
+        return skeleton
+
     @database_sync_to_async
     def try_get_skeleton(self, story):
         # Using hasattr checks if the related object exists
@@ -216,7 +355,7 @@ class GameConsumer(AsyncWebsocketConsumer):
 
     @database_sync_to_async
     def get_story(self, story_id):
-        return GameStory.objects.get(id=story_id)
+        return GameStory.get_for_play(story_id)
 
     @database_sync_to_async
     def get_config_model_name(self, config):
@@ -226,6 +365,10 @@ class GameConsumer(AsyncWebsocketConsumer):
             "system_prompt": config.system_prompt,
         }
 
+    async def send(self, text_data=None, bytes_data=None, close=False):  # noqa: FBT002
+        with span("websocket_send"):
+            await super().send(text_data=text_data, bytes_data=bytes_data, close=close)
+
     async def send_error(self, error_message):
         await self.send(
             text_data=json.dumps(
@@ -238,14 +381,9 @@ class GameConsumer(AsyncWebsocketConsumer):
 
     @database_sync_to_async
     def create_text_explanation(self, story, selected_text, context_text):
-        # Check if user is demo account
-        is_demo = False
-        if story.created_by and hasattr(story.created_by, "userprofile"):
-            is_demo = story.created_by.userprofile.is_demo_account
-
         active_config = LLMConfig.get_active_config_with_demo_fallback(
             purpose="text_explanation",
-            is_demo=is_demo,
+            is_demo=story.is_demo,
         )
 
         return TextExplanation.objects.create(
@@ -265,47 +403,50 @@ class GameConsumer(AsyncWebsocketConsumer):
 
     async def process_explanation(self, story, explanation):
         try:
-            # Check if user is demo account
-            is_demo = False
-            if story.created_by and hasattr(story.created_by, "userprofile"):
-                is_demo = story.created_by.userprofile.is_demo_account
-
-            active_config = await database_sync_to_async(
-                LLMConfig.get_active_config_with_demo_fallback,
-            )(purpose="text_explanation", is_demo=is_demo)
-
-            config_data = await self.get_config_model_name(active_config)
+            with span("get_config"):
+                active_config = await database_sync_to_async(
+                    LLMConfig.get_active_config_with_demo_fallback,
+                )(purpose="text_explanation", is_demo=story.is_demo)
+                config_data = await self.get_config_model_name(active_config)
             model_name = config_data["model_name"]
-            temperature = config_data["temperature"]
             system_prompt = config_data["system_prompt"]
 
-            key = await database_sync_to_async(
-                APIKey.get_available_key,
-            )(model_name)
-            prompt = ChatPromptTemplate.from_template(system_prompt)
-            string_parser = StrOutputParser()
-            llm = get_llm_model(
-                {
-                    "model_name": model_name,
-                    "llm_type": active_config.model.llm_type,
-                    "url": active_config.model.url,
-                    "temperature": temperature,
-                    "key": key,
-                },
-                fake=settings.FAKE_LLM_REQUEST,
-                name="text_explanation",
-            )
-            chain = prompt | llm | string_parser
-            stream = chain.astream(
-                {
-                    "selected_text": explanation.selected_text,
-                    "context_text": explanation.context_text,
-                },
+            # Replay the explanation if the same text was explained before
+            cache_key = explanation_cache.make_key(
+                explanation.selected_text,
+                explanation.context_text,
+                model_name,
+                active_config.prompt_version,
             )
+            with span("cache_lookup"):
+                cached_text = await explanation_cache.aget(cache_key)
+            if cached_text is not None:
+                stream = replay_text(cached_text)
+            else:
+                with span("create_llm"):
+                    llm = await database_sync_to_async(get_config_llm_model)(
+                        active_config,
+                        name="text_explanation",
+                    )
+                with span("record_usage"):
+                    await database_sync_to_async(record_usage)(
+                        self.scope["user"].id,
+                        model_name,
+                    )
+                prompt = active_config.get_prompt_template()
+                string_parser = StrOutputParser()
+                chain = prompt | llm | string_parser
+                stream = chain.astream(
+                    {
+                        "selected_text": explanation.selected_text,
+                        "context_text": explanation.context_text,
+                    },
+                )
 
             # Update status to streaming when starting to process
             explanation.status = "streaming"
-            await database_sync_to_async(explanation.save)()
+            with span("save_explanation"):
+                await database_sync_to_async(explanation.save)()
 
             # Send status update
             await self.send(
@@ -318,24 +459,40 @@ class GameConsumer(AsyncWebsocketConsumer):
                 ),
             )
 
+            async def send_content(content):
+                await self.send(
+                    text_data=json.dumps(
+                        {
+                            "type": "explanation_stream",
+                            "explanation_id": explanation.id,
+                            "content": content,
+                        },
+                    ),
+                )
+
             explanation_text = ""
-            async for chunk in stream:
-                if chunk:
-                    explanation_text += chunk
-                    await self.send(
-                        text_data=json.dumps(
-                            {
-                                "type": "explanation_stream",
-                                "explanation_id": explanation.id,
-                                "content": chunk,
-                            },
-                        ),
+            with span("llm"):
+                async with StreamBuffer(send_content) as buffer:
+                    async for chunk in stream:
+                        if chunk:
+                            explanation_text += chunk
+                            await buffer.add(chunk)
+
+            if cached_text is None and explanation_text:
+                with span("cache_store"):
+                    await explanation_cache.aset(
+                        cache_key,
+                        explanation_text,
+                        prompt=system_prompt
+                        + explanation.selected_text
+                        + explanation.context_text,
                     )
 
             # Update explanation with final content
             explanation.explanation = explanation_text
             explanation.status = "completed"
-            await database_sync_to_async(explanation.save)()
+            with span("save_explanation"):
+                await database_sync_to_async(explanation.save)()
 
             # Send completion message
             await self.send(
@@ -355,21 +512,36 @@ class GameConsumer(AsyncWebsocketConsumer):
 
     async def initialize_story_graph(self, story):
         """Initialize the story graph with the current story state"""
+        self.story_graph = await self.get_story_graph(is_demo=story.is_demo)
+        if settings.STORY_SPECULATIVE_GENERATION:
+            self.speculation = SpeculativeContinuations(self.story_graph)
 
-        # Create LLM models dictionary
-        llm_models = await self.create_story_graph_llms()
+    @database_sync_to_async
+    def get_story_graph(self, is_demo):
+        """Get the compiled story graph shared by all connections.
 
-        # Create story graph
-        self.story_graph = StoryGraph(llm_models)
+        The graph is rebuilt only when an LLM model, config or API key changes.
+        """
+        return story_graph_cache.get_or_set(
+            is_demo,
+            lambda: StoryGraph(
+                *self.create_story_graph_llms(is_demo),
+                checkpointer=create_story_graph_checkpointer(),
+            ),
+        )
 
-    @database_sync_to_async
-    def create_story_graph_llms(self):
+    def create_story_graph_llms(self, is_demo):
         """Create LLM models for story graph nodes.
 
+        Args:
+            is_demo: Whether to use the demo configs (if any)
+
         Returns:
-            Dictionary mapping node types to configured LLM models
+            Dictionaries mapping node types to configured LLM models and to
+            model names
         """
         llms = {}
+        model_names = {}
 
         # Get configs for each purpose
         name_to_purpose = {
@@ -379,75 +551,54 @@ class GameConsumer(AsyncWebsocketConsumer):
             "summary": "story_summary",
         }
 
-        # Check if user is demo account
-        is_demo = False
-        if hasattr(self, "story_id"):
-            try:
-                story = GameStory.objects.get(id=self.story_id)
-                if story.created_by and hasattr(story.created_by, "userprofile"):
-                    is_demo = story.created_by.userprofile.is_demo_account
-            except (GameStory.DoesNotExist, AttributeError):
-                pass
-
         for name, purpose in name_to_purpose.items():
             config = LLMConfig.get_active_config_with_demo_fallback(
                 purpose=purpose,
                 is_demo=is_demo,
             )
-            prompt = ChatPromptTemplate.from_template(config.system_prompt)
-            model_name = config.model.name
-            key = APIKey.get_available_key(model_name)
+            prompt = config.get_prompt_template()
+            model_names[name] = config.model.name
+            llms[name] = prompt | get_config_llm_model(config, name=name)
 
-            llms[name] = prompt | get_llm_model(
-                {
-                    "model_name": model_name,
-                    "llm_type": config.model.llm_type,
-                    "url": config.model.url,
-                    "temperature": config.temperature,
-                    "key": key,
-                },
-                fake=settings.FAKE_LLM_REQUEST,
-                name=name,
-            )
+        return llms, model_names
 
-        return llms
-
-    async def save_story_progress(self, story, state):
+    @database_sync_to_async
+    def save_story_progress(self, story, state):
         """Save story progress to database"""
         if story_text := state.get("story_text"):
-            # Create the progress entry
-            progress = await database_sync_to_async(StoryProgress.objects.create)(
-                story=story,
-                content=story_text,
-                decision_point_id=state.get("current_decision_point"),
-            )
+            with transaction.atomic():
+                # Create the progress entry
+                progress = StoryProgress.objects.create(
+                    story=story,
+                    content=story_text,
+                    decision_point_id=state.get("current_decision_point"),
+                )
 
-            options = self.get_options(state)
-            if options:
                 # Create option objects
-                for option in options:
-                    await database_sync_to_async(StoryOption.objects.create)(
-                        progress=progress,
-                        option_id=option["option_id"],
-                        option_name=option["option_name"],
-                    )
+                StoryOption.objects.bulk_create(
+                    [
+                        StoryOption(
+                            progress=progress,
+                            option_id=option["option_id"],
+                            option_name=option["option_name"],
+                        )
+                        for option in self.get_options(state)
+                    ],
+                )
 
-            story.status = state["status"]
-            await database_sync_to_async(story.save)()
+                story.status = state["status"]
+                story.updated_at = timezone.now()
+                GameStory.objects.filter(id=story.id).update(
+                    status=story.status,
+                    updated_at=story.updated_at,
+                )
 
     def get_options(self, state):
-        options = []
         current_decision_point_id = state.get("current_decision_point")
-        if current_decision_point_id:
-            skeleton = state["story_skeleton"]
-            options = []
-
-            # Find the current decision point and its options
-            for milestone in skeleton["milestones"]:
-                for decision_point in milestone.get("decision_points", []):
-                    if decision_point["decision_point_id"] == current_decision_point_id:
-                        return decision_point["options"]
-        return options
+        if not current_decision_point_id:
+            return []
+        skeleton_index = SkeletonIndex.for_skeleton(state["story_skeleton"])
+        return skeleton_index.get_options(current_decision_point_id)
 
     async def send_decision_point(self, state):
         """Send decision point to client"""
@@ -464,34 +615,75 @@ class GameConsumer(AsyncWebsocketConsumer):
             ),
         )
 
+    async def send_decision_point_options(self, state):
+        """Send the options of the decision point the next segment leads to,
+        before the segment is generated.
+
+        send_decision_point still follows once the segment is complete.
+        """
+        options = self.get_options(state)
+        if not options:
+            return
+
+        await self.send(
+            text_data=json.dumps(
+                {
+                    "type": "decision_point_options",
+                    "current_decision": state.get("current_decision_point"),
+                    "options": options,
+                },
+            ),
+        )
+
     @database_sync_to_async
     def handle_user_selection(self, story, option_id, option_text):
         """Update the story progress with the chosen option"""
-        from .models import StoryProgress
-
         # Get the latest progress
-        latest_progress = (
-            StoryProgress.objects.filter(
-                story=story,
-            )
-            .order_by("-created_at")
-            .first()
-        )
+        latest_progress = story.get_latest_progress()
 
         if latest_progress:
             # Update with chosen option
             latest_progress.set_chosen_option(option_id, option_text)
 
+    def run_in_background(self, coro):
+        """Run a coroutine as a task that outlives the current message."""
+        task = asyncio.create_task(coro)
+        self.background_tasks.add(task)
+        task.add_done_callback(self._on_background_task_done)
+        return task
+
+    def _on_background_task_done(self, task):
+        self.background_tasks.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            logger.error("Background task failed", exc_info=task.exception())
+
+    async def schedule_progress_summary(self, story):
+        """Summarize the latest progress entry according to STORY_SUMMARY_MODE.
+
+        - "sync": summarize before generating the next segment
+        - "concurrent": summarize while the next segment is being generated
+        - "celery": summarize in a celery worker
+
+        The summary is only needed as context for later turns; until it is
+        stored, the prompt falls back to the full content of the entry.
+        """
+        if settings.STORY_SUMMARY_MODE == "concurrent":
+            self.run_in_background(self.summarize_latest_progress(story))
+        elif settings.STORY_SUMMARY_MODE == "celery":
+            latest_progress = await database_sync_to_async(
+                story.get_latest_progress,
+            )()
+            if latest_progress and latest_progress.chosen_option_text:
+                await database_sync_to_async(summarize_story_progress.delay)(
+                    latest_progress.id,
+                )
+        else:
+            await self.summarize_latest_progress(story)
+
     async def summarize_latest_progress(self, story):
         """Generate and store summary of the latest progress entry."""
-        from .models import StoryProgress
-
         # Get the latest progress entry
-        latest_progress = await database_sync_to_async(
-            lambda: StoryProgress.objects.filter(story=story)
-            .order_by("-created_at")
-            .first(),
-        )()
+        latest_progress = await database_sync_to_async(story.get_latest_progress)()
 
         if not latest_progress or not latest_progress.chosen_option_text:
             return
@@ -504,6 +696,7 @@ class GameConsumer(AsyncWebsocketConsumer):
         )
 
         # Store the summary
+        latest_progress.summary = summary
         await database_sync_to_async(
             lambda: StoryProgress.objects.filter(id=latest_progress.id).update(
                 summary=summary,
@@ -514,69 +707,98 @@ class GameConsumer(AsyncWebsocketConsumer):
         """Create the next progress entry."""
         try:
             # Get current story state
-            state = await database_sync_to_async(lambda: story.story_state)()
-
-            # Add chosen decisions if they exist
-            if hasattr(story, "progress_entries"):
-                chosen_decisions = await database_sync_to_async(
-                    lambda: [
-                        entry.chosen_option_id
-                        for entry in story.progress_entries.all()
-                        if entry.chosen_option_id
-                    ],
-                )()
-                if chosen_decisions:
-                    state["chosen_decisions"] = chosen_decisions
+            with span("story_state"):
+                state = await database_sync_to_async(lambda: story.story_state)()
 
-            # Run the graph
-            new_state = None
+            # The options only depend on the skeleton: send them right away
+            await self.send_decision_point_options(state)
 
-            async for mode, chunk in self.story_graph.astream(
-                state,
-                self.story_thread,
-                stream_mode=["messages", "values"],
-            ):
-                if mode == "messages":
-                    msg, metadata = chunk
-                    await self.send(
-                        text_data=json.dumps(
-                            {"type": "story_update", "content": msg.content},
-                        ),
-                    )
-                elif mode == "values":
-                    new_state = chunk
+            # Use the continuation pre-generated for this choice, if any
+            new_state = None
+            if self.speculation:
+                with span("speculation"):
+                    new_state = await self.speculation.take(state)
+            if new_state is not None:
+                await self.send_story_update(new_state["story_text"])
+            else:
+                with span("llm"):
+                    new_state = await self.run_story_graph(state)
 
             if new_state is None:
                 msg = "Failed to generate story content, please try again later"
                 raise ValueError(msg)  # noqa: TRY301
 
+            node = "ending" if new_state["status"] == "COMPLETED" else "continuation"
+            with span("record_usage"):
+                await database_sync_to_async(record_usage)(
+                    self.scope["user"].id,
+                    self.story_graph.model_names[node],
+                )
+
             # Save progress
-            await self.save_story_progress(story, new_state)
+            with span("save_progress"):
+                await self.save_story_progress(story, new_state)
 
             # Send response to client
             await self.send_decision_point(new_state)
 
+            # Pre-generate the continuations while the player is reading
+            if self.speculation and new_state["status"] == "IN_PROGRESS":
+                self.speculation.start(
+                    new_state,
+                    self.get_options(new_state),
+                    skeleton_status=story.skeleton.status,
+                )
+
+        except asyncio.CancelledError:
+            # e.g. the player disconnected during the turn, so that they can
+            # choose again when they reconnect
+            await asyncio.shield(self.revert_user_choice(story))
+            raise
         except Exception as e:
             await self.revert_user_choice(story)
             logger.exception("Error in update_story_progress")
             await self.send_error(
-                "Failed to generate story content, please try again later: %s",
-                e,
+                f"Failed to generate story content, please try again later: {e}",
             )
 
+    async def run_story_graph(self, state):
+        """Run the story graph, streaming the generated text to the client.
+
+        Returns:
+            The new state, or None if the graph produced no state
+        """
+        new_state = None
+        async with StreamBuffer(self.send_story_update) as buffer:
+            if settings.STORY_DIRECT_STREAMING:
+                return await self.story_graph.arun_turn(
+                    state,
+                    self.story_thread,
+                    on_text=buffer.add,
+                )
+
+            async for mode, chunk in self.story_graph.astream(
+                state,
+                self.story_thread,
+                stream_mode=["messages", "values"],
+            ):
+                if mode == "messages":
+                    msg, metadata = chunk
+                    await buffer.add(msg.content)
+                elif mode == "values":
+                    new_state = chunk
+        return new_state
+
+    async def send_story_update(self, content):
+        await self.send(
+            text_data=json.dumps({"type": "story_update", "content": content}),
+        )
+
     @database_sync_to_async
     def revert_user_choice(self, story):
         """Revert the user's choice when story generation fails"""
-        from .models import StoryProgress
-
         # Get the latest progress
-        latest_progress = (
-            StoryProgress.objects.filter(
-                story=story,
-            )
-            .order_by("-created_at")
-            .first()
-        )
+        latest_progress = story.get_latest_progress()
 
         if latest_progress:
             # Clear the chosen option
@@ -587,11 +809,11 @@ class GameConsumer(AsyncWebsocketConsumer):
     async def skeleton_generation_progress(self, event):
         """Handle skeleton generation progress."""
         story_id = event["story_id"]
-        story = await self.get_story(story_id)
         if event["n_milestones"] == self.START_GAME_SINCE_MILESTONE:
             # Start generating story when first milestone is generated
             logger.debug("Start generating the first story progress")
-            await self.update_story_progress(story)
+            story = await self.get_story(story_id)
+            self.enqueue_story_task(self.update_story_progress, story)
 
     async def skeleton_generation_completed(self, event):
         """Handle skeleton generation completion."""
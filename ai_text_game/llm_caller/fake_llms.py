@@ -36,7 +36,7 @@ class MyFakeListChatModel(FakeListChatModel):
             yield chunk
 
 
-def get_fake_llm_model(name):
+def get_fake_llm_model(name):  # noqa: PLR0911
     if name == "skeleton":
         return MyFakeListChatModel(responses=[json.dumps(skeleton_json)])
     if name == "continuation":
@@ -44,6 +44,8 @@ def get_fake_llm_model(name):
         return MyFakeListChatModel(responses=["This is a continuation of the story"])
     if name == "ending":
         return MyFakeListChatModel(responses=["This is the ending of the story."])
+    if name == "summary":
+        return MyFakeListChatModel(responses=["This is a summary of the story."])
     if name == "text_explanation":
         return MyFakeListChatModel(responses=["This is the explanation of the text."])
     if name == "scene_generation":
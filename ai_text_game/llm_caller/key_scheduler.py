@@ -0,0 +1,143 @@
+import logging
+import threading
+import time
+from collections.abc import Callable
+from dataclasses import dataclass
+
+from django.conf import settings
+from django.core.cache import cache
+from langchain_core.callbacks import BaseCallbackHandler
+
+logger = logging.getLogger(__name__)
+
+HTTP_TOO_MANY_REQUESTS = 429
+
+
+@dataclass
+class KeyState:
+    """Scheduling state of an API key in this process."""
+
+    tokens: float
+    updated_at: float
+    current_weight: int = 0
+
+
+class KeyScheduler:
+    """Spreads requests over the API keys of a model.
+
+    Keys are picked by smooth weighted round-robin (as in nginx), so that each
+    key gets a share of the requests proportional to its weight, interleaved
+    rather than in bursts. A key with an rpm_limit has a token bucket refilled
+    at that rate and is skipped while it is empty. A key the provider answered
+    with 429 is put into a cooldown shared by all processes.
+
+    The token buckets are per process: with several workers, set rpm_limit to
+    the key's limit divided by the number of processes calling the provider.
+    """
+
+    def __init__(self, clock: Callable[[], float] = time.monotonic):
+        self.clock = clock
+        self.states: dict[int, KeyState] = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def get_cooldown_key(key_id: int) -> str:
+        return f"llm_caller:key_cooldown:{key_id}"
+
+    def acquire(self, keys: list):
+        """Pick the key for the next request.
+
+        Args:
+            keys: The active APIKey rows of the model
+
+        Returns:
+            The key, or None if there are no keys
+        """
+        if len(keys) <= 1:
+            return keys[0] if keys else None
+
+        cooling = cache.get_many([self.get_cooldown_key(key.id) for key in keys])
+        ready = [key for key in keys if self.get_cooldown_key(key.id) not in cooling]
+        # Better a key that may be rate limited than no key at all
+        candidates = ready or keys
+
+        with self._lock:
+            now = self.clock()
+            for key in candidates:
+                self._refill(key, now)
+            available = [
+                key
+                for key in candidates
+                if not key.rpm_limit or self.states[key.id].tokens >= 1
+            ]
+            if not available:
+                # Every bucket is empty: use the key that refills first
+                available = [
+                    max(candidates, key=lambda key: self.states[key.id].tokens),
+                ]
+
+            total_weight = 0
+            for key in available:
+                self.states[key.id].current_weight += key.weight
+                total_weight += key.weight
+            chosen = max(available, key=lambda key: self.states[key.id].current_weight)
+            state = self.states[chosen.id]
+            state.current_weight -= total_weight
+            if chosen.rpm_limit:
+                state.tokens = max(state.tokens - 1, 0)
+        return chosen
+
+    def _refill(self, key, now: float):
+        state = self.states.get(key.id)
+        if state is None:
+            state = self.states[key.id] = KeyState(
+                tokens=key.rpm_limit,
+                updated_at=now,
+            )
+        elif key.rpm_limit:
+            elapsed = now - state.updated_at
+            state.tokens = min(
+                state.tokens + elapsed * key.rpm_limit / 60,
+                key.rpm_limit,
+            )
+            state.updated_at = now
+
+    def cool_down(self, key_id: int, seconds: float | None = None):
+        """Skip the key for a while (e.g. after a 429 response)."""
+        if seconds is None:
+            seconds = settings.API_KEY_COOLDOWN_SECONDS
+        cache.set(self.get_cooldown_key(key_id), 1, timeout=seconds)
+        logger.warning("API key %s rate limited, cooling down for %ss", key_id, seconds)
+
+    def clear(self):
+        with self._lock:
+            self.states.clear()
+
+
+key_scheduler = KeyScheduler()
+
+
+class RateLimitCallbackHandler(BaseCallbackHandler):
+    """Puts the API key of an LLM client into cooldown when a call of the
+    client fails with 429 Too Many Requests.
+    """
+
+    run_inline = True
+
+    def __init__(self, key_id: int):
+        self.key_id = key_id
+
+    def on_llm_error(self, error: BaseException, **kwargs):
+        if getattr(error, "status_code", None) != HTTP_TOO_MANY_REQUESTS:
+            return
+        key_scheduler.cool_down(self.key_id, get_retry_after(error))
+
+
+def get_retry_after(error: BaseException) -> float | None:
+    """Get the Retry-After header (in seconds) of a provider API error."""
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None) or {}
+    try:
+        return float(headers.get("retry-after"))
+    except (TypeError, ValueError):
+        return None
@@ -0,0 +1,338 @@
+import asyncio
+import logging
+import threading
+from collections import deque
+from collections.abc import AsyncIterator
+from collections.abc import Iterator
+from functools import partial
+
+from django.conf import settings
+from langchain_core.callbacks import AsyncCallbackManagerForLLMRun
+from langchain_core.callbacks import CallbackManagerForLLMRun
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.language_models.chat_models import agenerate_from_stream
+from langchain_core.language_models.chat_models import generate_from_stream
+from langchain_core.messages import AIMessageChunk
+from langchain_core.messages import BaseMessage
+from langchain_core.messages import BaseMessageChunk
+from langchain_core.outputs import ChatGenerationChunk
+from langchain_core.outputs import ChatResult
+from langchain_core.runnables import Runnable
+from langchain_core.runnables import RunnableConfig
+
+from .fake_llms import get_fake_llm_model
+from .models import APIKey
+from .models import LLMConfig
+from .utils import get_keyed_llm_model
+
+logger = logging.getLogger(__name__)
+
+
+def get_inner_call_config(
+    run_manager: CallbackManagerForLLMRun | AsyncCallbackManagerForLLMRun | None,
+) -> RunnableConfig:
+    """Get the config of the calls of the routed LLMs.
+
+    The routed LLMs do not inherit the callbacks of the caller, so that the
+    tokens of losing or failed LLMs are not streamed, but they do inherit its
+    metadata (e.g. the purpose of the call logs).
+    """
+    metadata = run_manager.inheritable_metadata if run_manager is not None else {}
+    return {"callbacks": [], "metadata": metadata}
+
+
+class FirstTokenLatencies:
+    """Recent time-to-first-token samples per model, in this process."""
+
+    def __init__(self, maxlen: int = 200):
+        self.maxlen = maxlen
+        self.samples: dict[str, deque] = {}
+        self._lock = threading.Lock()
+
+    def add(self, model_name: str, seconds: float):
+        with self._lock:
+            self.samples.setdefault(model_name, deque(maxlen=self.maxlen)).append(
+                seconds,
+            )
+
+    def get_percentile(self, model_name: str, percentile: float) -> float | None:
+        """Get the percentile of the samples, or None if there are too few."""
+        with self._lock:
+            samples = sorted(self.samples.get(model_name, []))
+        if len(samples) < settings.LLM_HEDGE_MIN_SAMPLES:
+            return None
+        index = min(int(len(samples) * percentile / 100), len(samples) - 1)
+        return samples[index]
+
+    def clear(self):
+        with self._lock:
+            self.samples.clear()
+
+
+first_token_latencies = FirstTokenLatencies()
+
+
+class FailoverChatModel(BaseChatModel):
+    """Calls the first of several LLMs that answers.
+
+    The LLMs are tried in order: an LLM that fails, or sends no token within
+    first_token_timeout seconds, is replaced by the next one. With hedging, the
+    second LLM is also started once the first has been waiting longer than
+    usual (the hedge_percentile of its recent first-token latencies); the one
+    that streams first is used and the other is cancelled.
+
+    Once a token has been streamed there is no failover any more, as the text
+    may already have been sent to the player. Only the tokens of the LLM in use
+    reach the callbacks (e.g. LangGraph's "messages" stream mode).
+
+    Stop words and call options are not supported (the chains of the app use
+    none).
+    """
+
+    llms: list[Runnable]
+    model_names: list[str]
+    first_token_timeout: float = 30
+    hedging: bool = False
+    hedge_percentile: float = 95
+
+    @property
+    def _llm_type(self) -> str:
+        return "failover"
+
+    def _generate(
+        self,
+        messages: list[BaseMessage],
+        stop: list[str] | None = None,
+        run_manager: CallbackManagerForLLMRun | None = None,
+        **kwargs,
+    ) -> ChatResult:
+        return generate_from_stream(
+            self._stream(messages, run_manager=run_manager),
+        )
+
+    async def _agenerate(
+        self,
+        messages: list[BaseMessage],
+        stop: list[str] | None = None,
+        run_manager: AsyncCallbackManagerForLLMRun | None = None,
+        **kwargs,
+    ) -> ChatResult:
+        return await agenerate_from_stream(
+            self._astream(messages, run_manager=run_manager),
+        )
+
+    def _stream(
+        self,
+        messages: list[BaseMessage],
+        stop: list[str] | None = None,
+        run_manager: CallbackManagerForLLMRun | None = None,
+        **kwargs,
+    ) -> Iterator[ChatGenerationChunk]:
+        # Without an event loop, LLMs are only replaced when they fail
+        error = None
+        config = get_inner_call_config(run_manager)
+        for llm, model_name in zip(self.llms, self.model_names, strict=True):
+            stream = llm.stream(messages, config=config)
+            try:
+                first_chunk = next(stream, None)
+            except Exception as e:  # noqa: BLE001
+                logger.warning("LLM %s failed: %s", model_name, e)
+                error = e
+                continue
+            if first_chunk is not None:
+                yield self._to_generation_chunk(first_chunk)
+                for chunk in stream:
+                    yield self._to_generation_chunk(chunk)
+            return
+        raise error
+
+    async def _astream(
+        self,
+        messages: list[BaseMessage],
+        stop: list[str] | None = None,
+        run_manager: AsyncCallbackManagerForLLMRun | None = None,
+        **kwargs,
+    ) -> AsyncIterator[ChatGenerationChunk]:
+        first_chunk, stream = await self._race_first_chunk(
+            partial(self._start_stream, messages, get_inner_call_config(run_manager)),
+        )
+        if first_chunk is not None:
+            yield self._to_generation_chunk(first_chunk)
+            async for chunk in stream:
+                yield self._to_generation_chunk(chunk)
+
+    @staticmethod
+    def _to_generation_chunk(message: BaseMessage) -> ChatGenerationChunk:
+        if not isinstance(message, BaseMessageChunk):
+            # The whole message of an LLM that does not stream
+            message = AIMessageChunk(
+                content=message.content,
+                response_metadata=message.response_metadata,
+                usage_metadata=getattr(message, "usage_metadata", None),
+                id=message.id,
+            )
+        return ChatGenerationChunk(message=message)
+
+    def _start_stream(self, messages, config: RunnableConfig, index: int):
+        """Start streaming from an LLM, timing its first chunk."""
+        stream = self.llms[index].astream(messages, config=config)
+        loop = asyncio.get_running_loop()
+        started_at = loop.time()
+
+        async def get_first_chunk():
+            try:
+                chunk = await anext(stream)
+            except StopAsyncIteration:
+                return None
+            first_token_latencies.add(
+                self.model_names[index],
+                loop.time() - started_at,
+            )
+            return chunk
+
+        task = asyncio.create_task(get_first_chunk())
+        return task, stream, started_at + self.first_token_timeout
+
+    def _get_hedge_delay(self) -> float | None:
+        if not self.hedging or len(self.llms) < 2:  # noqa: PLR2004
+            return None
+        return first_token_latencies.get_percentile(
+            self.model_names[0],
+            self.hedge_percentile,
+        )
+
+    async def _race_first_chunk(self, start_stream):  # noqa: C901
+        """Wait for the first LLM to send a chunk (see the class docstring).
+
+        Returns:
+            The first chunk (None for an empty stream) and the rest of the
+            stream of the winner
+        """
+        loop = asyncio.get_running_loop()
+        hedge_delay = self._get_hedge_delay()
+        hedge_at = None if hedge_delay is None else loop.time() + hedge_delay
+        # Started streams as {task getting the first chunk: (stream, deadline,
+        # model name)}
+        pending = {}
+        next_index = 0
+        error = None
+
+        def start_next():
+            nonlocal next_index
+            task, stream, deadline = start_stream(next_index)
+            pending[task] = (stream, deadline, self.model_names[next_index])
+            next_index += 1
+
+        start_next()
+        try:
+            while True:
+                wake_at = min(deadline for _, deadline, _ in pending.values())
+                if hedge_at is not None:
+                    wake_at = min(wake_at, hedge_at)
+                done, _ = await asyncio.wait(
+                    pending,
+                    timeout=max(wake_at - loop.time(), 0),
+                    return_when=asyncio.FIRST_COMPLETED,
+                )
+                for task in done:
+                    stream, _, model_name = pending.pop(task)
+                    if task.exception() is None:
+                        # The losers are cancelled (see finally)
+                        for _, deadline, loser_name in pending.values():
+                            self._add_censored_latency(loser_name, deadline)
+                        return task.result(), stream
+                    error = task.exception()
+                    logger.warning("LLM %s failed: %s", model_name, error)
+                    await stream.aclose()
+
+                error = await self._drop_late_streams(pending, loop.time()) or error
+
+                if hedge_at is not None and loop.time() >= hedge_at:
+                    hedge_at = None
+                    if next_index < len(self.llms):
+                        logger.info("Hedging LLM %s", self.model_names[0])
+                        start_next()
+
+                if not pending:
+                    if next_index >= len(self.llms):
+                        raise error
+                    start_next()
+        finally:
+            # Cancel the losers (and everything, if we are cancelled)
+            for task, (stream, _, _) in pending.items():
+                await self._cancel(task, stream)
+
+    async def _drop_late_streams(self, pending: dict, now: float):
+        """Cancel the streams that sent no chunk before their deadline.
+
+        Returns:
+            The timeout error of the last cancelled stream, if any
+        """
+        error = None
+        for task, (stream, deadline, model_name) in list(pending.items()):
+            if now >= deadline:
+                logger.warning("LLM %s sent no token in time", model_name)
+                self._add_censored_latency(model_name, deadline)
+                error = TimeoutError(f"No response from {model_name}")
+                del pending[task]
+                await self._cancel(task, stream)
+        return error
+
+    def _add_censored_latency(self, model_name: str, deadline: float):
+        """Record how long a stream dropped before its first chunk waited.
+
+        A lower bound of its latency, so that the latencies of a slowing model
+        rise (and its hedge delay with them) instead of only the fast calls
+        being sampled.
+        """
+        started_at = deadline - self.first_token_timeout
+        first_token_latencies.add(
+            model_name,
+            asyncio.get_running_loop().time() - started_at,
+        )
+
+    @staticmethod
+    async def _cancel(task: asyncio.Task, stream):
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+        await stream.aclose()
+
+
+def get_config_llm_model(config: LLMConfig, name: str | None = None) -> Runnable:
+    """Get the LLM of a config, failing over to the failover model of its model.
+
+    The API key is picked on every call (see KeyScheduler). The calls are
+    logged with the purpose of the config (see LLMCallLogHandler).
+    """
+    if settings.FAKE_LLM_REQUEST:
+        return get_fake_llm_model(name)
+
+    llm_models = [config.model]
+    failover_model = config.model.failover_model
+    if failover_model is not None and failover_model.is_active:
+        llm_models.append(failover_model)
+
+    llms = [
+        get_keyed_llm_model(
+            {
+                "model_name": llm_model.name,
+                "llm_type": llm_model.llm_type,
+                "url": llm_model.url,
+                "temperature": config.temperature,
+            },
+            partial(APIKey.get_available_keys, llm_model.name),
+        )
+        for llm_model in llm_models
+    ]
+    if len(llms) == 1:
+        llm = llms[0]
+    else:
+        llm = FailoverChatModel(
+            llms=llms,
+            model_names=[llm_model.name for llm_model in llm_models],
+            first_token_timeout=settings.LLM_FIRST_TOKEN_TIMEOUT,
+            hedging=settings.LLM_HEDGING,
+            hedge_percentile=settings.LLM_HEDGE_PERCENTILE,
+            name=name,
+        )
+    return llm.with_config(metadata={"purpose": config.purpose})
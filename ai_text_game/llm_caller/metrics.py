@@ -0,0 +1,333 @@
+import bisect
+import contextvars
+import functools
+import hashlib
+import json
+import logging
+import threading
+import time
+from contextlib import nullcontext
+
+from channels.db import DatabaseSyncToAsync
+from django.conf import settings
+from django.core.cache import cache
+
+logger = logging.getLogger(__name__)
+
+# Upper bounds (in seconds) of the histogram buckets
+DEFAULT_BUCKETS = (
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1,
+    2.5,
+    5,
+    10,
+    30,
+    60,
+)
+
+# Sums are added up in the cache as integers, in microseconds
+SUM_SCALE = 1_000_000
+
+
+class Histogram:
+    """A Prometheus histogram with labels, shared by all processes.
+
+    Each process collects its observations in memory and a background thread
+    adds them to totals in the cache every GAME_METRICS_FLUSH_INTERVAL
+    seconds (see MetricsFlusher), so that any process serves the totals of
+    all of them (e.g. of every gunicorn worker).
+    """
+
+    def __init__(
+        self,
+        name: str,
+        description: str,
+        label_names: tuple[str, ...],
+        buckets: tuple[float, ...] = DEFAULT_BUCKETS,
+    ):
+        self.name = name
+        self.description = description
+        self.label_names = label_names
+        self.buckets = buckets
+        # Observations of this process not yet added to the totals, per label
+        # values, as [count per bucket (the last one is +Inf), sum, count]
+        self.series: dict[tuple[str, ...], list] = {}
+        # Label values this process has added to the totals
+        self.flushed_label_values: set[tuple[str, ...]] = set()
+        self._lock = threading.Lock()
+
+    def observe(self, label_values: tuple[str, ...], value: float):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self.series.get(label_values)
+            if series is None:
+                series = self.series[label_values] = [
+                    [0] * (len(self.buckets) + 1),
+                    0.0,
+                    0,
+                ]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+        metrics_flusher.start()
+
+    def _key(self, label_values: tuple[str, ...], field: int | str) -> str:
+        digest = hashlib.sha256(json.dumps(label_values).encode()).hexdigest()[:16]
+        return f"llm_caller:metrics:{self.name}:{digest}:{field}"
+
+    def _fields(self) -> list[int | str]:
+        return [*range(len(self.buckets) + 1), "sum", "count"]
+
+    @property
+    def _index_key(self) -> str:
+        # The label values of all series in the totals
+        return f"llm_caller:metrics:{self.name}:series"
+
+    def flush(self):
+        """Add the observations of this process to the totals in the cache."""
+        with self._lock:
+            series, self.series = self.series, {}
+        for label_values, (bucket_counts, total, count) in series.items():
+            for index, bucket_count in enumerate(bucket_counts):
+                if bucket_count:
+                    _incr(self._key(label_values, index), bucket_count)
+            _incr(self._key(label_values, "sum"), round(total * SUM_SCALE))
+            _incr(self._key(label_values, "count"), count)
+
+        # Processes may overwrite each other's new series in the index, so the
+        # series of this process are checked again on every flush
+        self.flushed_label_values.update(series)
+        if self.flushed_label_values:
+            indexed = {tuple(values) for values in cache.get(self._index_key, [])}
+            if not self.flushed_label_values <= indexed:
+                cache.set(
+                    self._index_key,
+                    sorted(indexed | self.flushed_label_values),
+                    timeout=None,
+                )
+
+    def collect(self) -> dict[tuple[str, ...], list]:
+        """Get the totals of all processes (after adding the observations of
+        this one), in the format of self.series."""
+        self.flush()
+        all_label_values = [tuple(values) for values in cache.get(self._index_key, [])]
+        values = cache.get_many(
+            [
+                self._key(label_values, field)
+                for label_values in all_label_values
+                for field in self._fields()
+            ],
+        )
+        totals = {}
+        for label_values in all_label_values:
+            bucket_counts, total, count = (
+                [
+                    values.get(self._key(label_values, index), 0)
+                    for index in range(len(self.buckets) + 1)
+                ],
+                values.get(self._key(label_values, "sum"), 0) / SUM_SCALE,
+                values.get(self._key(label_values, "count"), 0),
+            )
+            if count:
+                totals[label_values] = [bucket_counts, total, count]
+        return totals
+
+    def render(self) -> str:
+        """Render the totals of the histogram in the Prometheus text format."""
+        lines = [
+            f"# HELP {self.name} {self.description}",
+            f"# TYPE {self.name} histogram",
+        ]
+        bounds = [str(bound) for bound in self.buckets] + ["+Inf"]
+        for label_values, (bucket_counts, total, count) in sorted(
+            self.collect().items(),
+        ):
+            labels = ",".join(
+                f'{name}="{escape_label_value(value)}"'
+                for name, value in zip(self.label_names, label_values, strict=True)
+            )
+            cumulative_count = 0
+            for bound, bucket_count in zip(bounds, bucket_counts, strict=True):
+                cumulative_count += bucket_count
+                lines.append(
+                    f'{self.name}_bucket{{{labels},le="{bound}"}} {cumulative_count}',
+                )
+            lines.append(f"{self.name}_sum{{{labels}}} {total}")
+            lines.append(f"{self.name}_count{{{labels}}} {count}")
+        return "\n".join(lines) + "\n"
+
+    def clear(self):
+        """Drop the observations of this process and the totals."""
+        with self._lock:
+            self.series.clear()
+        all_label_values = [tuple(values) for values in cache.get(self._index_key, [])]
+        cache.delete_many(
+            [
+                self._key(label_values, field)
+                for label_values in all_label_values
+                for field in self._fields()
+            ]
+            + [self._index_key],
+        )
+        self.flushed_label_values.clear()
+
+
+def _incr(key: str, delta: int):
+    cache.add(key, 0, timeout=None)
+    try:
+        cache.incr(key, delta)
+    except ValueError:
+        # The counter was evicted in between
+        cache.add(key, delta, timeout=None)
+
+
+class MetricsFlusher:
+    """Adds the observations of this process to the totals in the cache every
+    GAME_METRICS_FLUSH_INTERVAL seconds, from a background thread."""
+
+    def __init__(self):
+        self._thread: threading.Thread | None = None
+        self._lock = threading.Lock()
+
+    def start(self):
+        if self._thread is not None or settings.GAME_METRICS_FLUSH_INTERVAL <= 0:
+            return
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(
+                    target=self._run,
+                    name="game-metrics-flusher",
+                    daemon=True,
+                )
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            time.sleep(settings.GAME_METRICS_FLUSH_INTERVAL)
+            for histogram in histograms:
+                try:
+                    histogram.flush()
+                except Exception:
+                    logger.exception("Error flushing the metrics of %s", histogram.name)
+
+
+metrics_flusher = MetricsFlusher()
+
+
+def escape_label_value(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+stage_seconds = Histogram(
+    "game_consumer_stage_seconds",
+    "Duration of the stages of the game WebSocket message handlers.",
+    ("handler", "stage"),
+)
+db_queue_seconds = Histogram(
+    "game_consumer_db_queue_seconds",
+    "Time the database calls of the game WebSocket waited for a sync thread.",
+    ("handler", "stage"),
+)
+histograms = [stage_seconds, db_queue_seconds]
+
+# The handler and stage being timed in the current task
+current_handler = contextvars.ContextVar("metrics_handler", default="")
+current_stage = contextvars.ContextVar("metrics_stage", default="")
+
+
+class Span:
+    """Times a stage of the current handler (see span())."""
+
+    __slots__ = ("handler", "stage", "started_at", "tokens")
+
+    def __init__(self, stage: str, handler: str | None = None):
+        self.stage = stage
+        self.handler = handler
+        self.started_at = 0.0
+        self.tokens = []
+
+    def __enter__(self):
+        if self.handler is not None:
+            self.tokens.append((current_handler, current_handler.set(self.handler)))
+        self.tokens.append((current_stage, current_stage.set(self.stage)))
+        self.started_at = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        stage_seconds.observe(
+            (current_handler.get(), self.stage),
+            time.perf_counter() - self.started_at,
+        )
+        for var, token in reversed(self.tokens):
+            var.reset(token)
+
+
+_null_span = nullcontext()
+
+
+def span(stage: str, handler: str | None = None):
+    """Time a stage of the current handler, or of the given (new) handler.
+
+    Returns a shared no-op context manager when GAME_METRICS_ENABLED is off.
+    """
+    if not settings.GAME_METRICS_ENABLED:
+        return _null_span
+    return Span(stage, handler)
+
+
+def timed_handler(handler: str):
+    """Time a message handler (coroutine function) as its "total" stage."""
+
+    def decorator(func):
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            with span("total", handler=handler):
+                return await func(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+class TimedDatabaseSyncToAsync(DatabaseSyncToAsync):
+    """A DatabaseSyncToAsync that also times how long calls wait for a thread.
+
+    Thread-sensitive calls all run in the same thread, so a slow query delays
+    every other database call of the process.
+    """
+
+    async def __call__(self, *args, **kwargs):
+        if not settings.GAME_METRICS_ENABLED:
+            return await super().__call__(*args, **kwargs)
+
+        submitted_at = time.perf_counter()
+        func = self.func
+
+        def timed_func(*args, **kwargs):
+            # Runs in the context of the caller (see SyncToAsync)
+            db_queue_seconds.observe(
+                (current_handler.get(), current_stage.get()),
+                time.perf_counter() - submitted_at,
+            )
+            return func(*args, **kwargs)
+
+        timed = DatabaseSyncToAsync(
+            timed_func,
+            thread_sensitive=self._thread_sensitive,
+            executor=self._executor,
+            context=self.context,
+        )
+        return await timed(*args, **kwargs)
+
+
+database_sync_to_async = TimedDatabaseSyncToAsync
+
+
+def render_metrics() -> str:
+    return "".join(histogram.render() for histogram in histograms)
@@ -0,0 +1,32 @@
+# Generated by Django 5.0.10 on 2026-10-17 07:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('llm_caller', '0016_storyprogress_summary_alter_llmconfig_purpose'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PooledSkeleton',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('scene_set', models.UUIDField(db_index=True)),
+                ('genre', models.CharField(max_length=100)),
+                ('cefr_level', models.CharField(choices=[('A1', 'A1'), ('A2', 'A2'), ('B1', 'B1'), ('B2', 'B2'), ('C1', 'C1'), ('C2', 'C2')], max_length=10)),
+                ('scene_text', models.TextField()),
+                ('prompt_version', models.CharField(help_text='Version of the scene and skeleton prompts the entry was made with', max_length=64)),
+                ('background', models.TextField(blank=True)),
+                ('raw_data', models.JSONField(blank=True, default=dict)),
+                ('served_at', models.DateTimeField(blank=True, null=True)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['genre', 'cefr_level', 'prompt_version'], name='llm_caller__genre_85757d_idx')],
+            },
+        ),
+    ]
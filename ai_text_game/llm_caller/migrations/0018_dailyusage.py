@@ -0,0 +1,35 @@
+# Generated by Django 5.0.10 on 2026-10-17 07:50
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('llm_caller', '0017_pooledskeleton'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DailyUsage',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('model_name', models.CharField(max_length=200)),
+                ('date', models.DateField()),
+                ('count', models.IntegerField(default=0)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='daily_usages', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['date'], name='llm_caller__date_906d9c_idx')],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='dailyusage',
+            constraint=models.UniqueConstraint(fields=('user', 'model_name', 'date'), name='unique_daily_usage'),
+        ),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 5.0.10 on 2026-10-17 07:52
+
+import django.core.validators
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('llm_caller', '0018_dailyusage'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='apikey',
+            name='rpm_limit',
+            field=models.PositiveIntegerField(default=0, help_text='Maximum number of requests per minute per worker process (0 = unlimited)'),
+        ),
+        migrations.AddField(
+            model_name='apikey',
+            name='weight',
+            field=models.PositiveIntegerField(default=1, help_text='Share of the requests sent with this key, relative to the other keys of the model', validators=[django.core.validators.MinValueValidator(1)]),
+        ),
+        migrations.AlterField(
+            model_name='apikey',
+            name='order',
+            field=models.IntegerField(default=10, help_text='Keys with lower order values are listed first', validators=[django.core.validators.MinValueValidator(0)]),
+        ),
+    ]
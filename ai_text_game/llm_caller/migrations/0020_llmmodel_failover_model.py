@@ -0,0 +1,19 @@
+# Generated by Django 5.0.10 on 2026-10-17 07:55
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('llm_caller', '0019_apikey_weight_rpm_limit'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='llmmodel',
+            name='failover_model',
+            field=models.ForeignKey(blank=True, help_text='A similar model (ideally of another provider) to use when this one fails or does not respond in time', null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='llm_caller.llmmodel'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.0.10 on 2026-10-17 08:02
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('llm_caller', '0020_llmmodel_failover_model'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='llmconfig',
+            name='system_prompt',
+            field=models.TextField(help_text='The system prompt for the LLM. Put <cache_breakpoint/> after its stable part (e.g. before the story progress) to let the provider cache it.'),
+        ),
+    ]
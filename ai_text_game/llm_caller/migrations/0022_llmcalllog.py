@@ -0,0 +1,34 @@
+# Generated by Django 5.0.10 on 2026-10-17 08:05
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('llm_caller', '0021_alter_llmconfig_system_prompt'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LLMCallLog',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('purpose', models.CharField(blank=True, help_text='The purpose of the LLM config of the call', max_length=50)),
+                ('model_name', models.CharField(max_length=200)),
+                ('prompt_tokens', models.IntegerField(default=0)),
+                ('completion_tokens', models.IntegerField(default=0)),
+                ('cached_tokens', models.IntegerField(default=0, help_text="Prompt tokens read from the provider's prompt cache")),
+                ('time_to_first_token', models.FloatField(blank=True, help_text='Seconds (only for streamed calls)', null=True)),
+                ('duration', models.FloatField(help_text='Seconds')),
+                ('outcome', models.CharField(choices=[('success', 'Success'), ('error', 'Error'), ('rate_limited', 'Rate Limited'), ('cancelled', 'Cancelled')], max_length=20)),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('api_key', models.ForeignKey(blank=True, db_constraint=False, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='llm_caller.apikey')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['created_at'], name='llm_caller__created_084c5c_idx')],
+            },
+        ),
+    ]
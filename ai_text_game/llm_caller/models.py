@@ -1,5 +1,7 @@
 # ruff: noqa: PERF401
 
+import hashlib
+import json
 from typing import Literal
 
 from django.contrib.auth import get_user_model
@@ -7,14 +9,32 @@ from django.core.exceptions import ValidationError
 from django.core.validators import MaxValueValidator
 from django.core.validators import MinValueValidator
 from django.core.validators import URLValidator
+from django.db import connection
 from django.db import models
-from langchain_core.prompts import ChatPromptTemplate
+from django.db import transaction
+from django.db.models.signals import post_delete
+from django.db.models.signals import post_save
+from django.dispatch import receiver
+from django.utils import timezone
 
 from ai_text_game.core.models import CreatableBase
 from ai_text_game.core.models import TimestampedBase
 
+from .caches import VersionedCache
+from .caches import bump_config_version
+from .key_scheduler import key_scheduler
+from .prompt_caching import create_prompt_template
+from .story_graph import SkeletonIndex
+from .utils import clear_llm_model_pool
+
 User = get_user_model()
 
+# Active configs and keys only change from the admin, so they are cached per
+# process until the config version is bumped (see invalidate_llm_config_caches).
+# The cached instances are shared and must be treated as read-only.
+active_config_cache = VersionedCache()
+available_key_cache = VersionedCache()
+
 
 LLM_TYPE_CHOICES = [
     ("openai", "OpenAI"),
@@ -73,6 +93,17 @@ class LLMModel(TimestampedBase):
         ),
         validators=[URLValidator()],
     )
+    failover_model = models.ForeignKey(
+        "self",
+        on_delete=models.SET_NULL,
+        related_name="+",
+        blank=True,
+        null=True,
+        help_text=(
+            "A similar model (ideally of another provider) to use when this one "
+            "fails or does not respond in time"
+        ),
+    )
 
     class Meta:
         ordering = ["order"]
@@ -94,12 +125,24 @@ class LLMModel(TimestampedBase):
     def get_active_models(cls):
         return cls.objects.filter(is_active=True)
 
+    def get_used_quota(self, user) -> int:
+        """Number of requests the user made with this model today"""
+        from .quotas import get_used_quota
+
+        if not user or not user.is_authenticated:
+            return 0
+        return get_used_quota(user.id, self.name)
+
     def clean(self):
         super().clean()
         if self.llm_type == "custom" and not self.url:
             raise ValidationError(
                 {"url": "URL is required for custom LLM services"},
             )
+        if self.failover_model_id and self.failover_model_id == self.id:
+            raise ValidationError(
+                {"failover_model": "A model cannot fail over to itself"},
+            )
 
 
 class QuotaConfig(TimestampedBase):
@@ -121,6 +164,85 @@ class QuotaConfig(TimestampedBase):
         return f"QuotaConfig({self.model.display_name}, limit={self.daily_limit})"
 
 
+class DailyUsage(TimestampedBase):
+    """Number of LLM requests a user made with a model on a (local) day.
+
+    The live counts are kept in the cache (see quotas.py); rows are created on
+    the first request of the day and updated periodically from the counters.
+    """
+
+    user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name="daily_usages",
+    )
+    model_name = models.CharField(max_length=200)
+    date = models.DateField()
+    count = models.IntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["user", "model_name", "date"],
+                name="unique_daily_usage",
+            ),
+        ]
+        indexes = [models.Index(fields=["date"])]
+
+    def __str__(self):
+        return f"{self.user} - {self.model_name} ({self.date}): {self.count}"
+
+
+class LLMCallLog(models.Model):
+    """Tokens and latency of an LLM call.
+
+    Rows are written in batches, in the background (see call_logs.py).
+    """
+
+    OUTCOME_CHOICES = [
+        ("success", "Success"),
+        ("error", "Error"),
+        ("rate_limited", "Rate Limited"),
+        ("cancelled", "Cancelled"),
+    ]
+
+    purpose = models.CharField(
+        max_length=50,
+        blank=True,
+        help_text="The purpose of the LLM config of the call",
+    )
+    model_name = models.CharField(max_length=200)
+    api_key = models.ForeignKey(
+        "APIKey",
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        # Logs may refer to keys deleted before they are written
+        db_constraint=False,
+        related_name="+",
+    )
+    prompt_tokens = models.IntegerField(default=0)
+    completion_tokens = models.IntegerField(default=0)
+    cached_tokens = models.IntegerField(
+        default=0,
+        help_text="Prompt tokens read from the provider's prompt cache",
+    )
+    time_to_first_token = models.FloatField(
+        null=True,
+        blank=True,
+        help_text="Seconds (only for streamed calls)",
+    )
+    duration = models.FloatField(help_text="Seconds")
+    outcome = models.CharField(max_length=20, choices=OUTCOME_CHOICES)
+    created_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        indexes = [models.Index(fields=["created_at"])]
+
+    def __str__(self):
+        return f"{self.model_name} ({self.purpose}): {self.outcome}"
+
+
 class LLMConfig(TimestampedBase):
     PURPOSE_CHOICES = [
         ("scene_generation", "Scene Generation"),
@@ -149,7 +271,11 @@ class LLMConfig(TimestampedBase):
         null=True,
     )
     system_prompt = models.TextField(
-        help_text="The system prompt for the LLM.",
+        help_text=(
+            "The system prompt for the LLM. Put <cache_breakpoint/> after its"
+            " stable part (e.g. before the story progress) to let the provider"
+            " cache it."
+        ),
     )
     temperature = models.FloatField(
         default=0.7,
@@ -170,6 +296,13 @@ class LLMConfig(TimestampedBase):
     def __str__(self):
         return f"LLM Config ({self.get_purpose_display()}, Updated: {self.updated_at})"
 
+    @property
+    def prompt_version(self) -> str:
+        """Short hash of what determines the output of this config"""
+        model_name = self.model.name if self.model else ""
+        data = f"{model_name}\n{self.temperature}\n{self.system_prompt}"
+        return hashlib.sha256(data.encode()).hexdigest()[:16]
+
     def save(self, *args, **kwargs):
         if self.is_active:
             # Deactivate other configs with the same purpose
@@ -220,14 +353,14 @@ class LLMConfig(TimestampedBase):
         ],
     ):
         """Get the active config for the given purpose."""
-        try:
-            return cls.objects.get(purpose=purpose, is_active=True)
-        except cls.DoesNotExist:
+        config = cls._get_cached_active_config(purpose)
+        if config is None:
             msg = (
                 f"No active config found for purpose: {purpose}."
                 f"Please create one in the admin panel."
             )
-            raise ValueError(msg) from None
+            raise ValueError(msg)
+        return config
 
     @classmethod
     def get_active_config_with_demo_fallback(
@@ -249,19 +382,32 @@ class LLMConfig(TimestampedBase):
         """
         if is_demo:
             # Try to get demo config first
-            try:
-                demo_purpose = f"{purpose}_demo"
-                return cls.objects.get(purpose=demo_purpose, is_active=True)
-            except cls.DoesNotExist:
-                # Fall back to normal config
-                pass
+            demo_config = cls._get_cached_active_config(f"{purpose}_demo")
+            if demo_config is not None:
+                return demo_config
+            # Fall back to normal config
 
         # Get normal config
         return cls.get_active_config(purpose=purpose)
 
+    @classmethod
+    def _get_cached_active_config(cls, purpose: str):
+        """Get the active config for the given purpose (or None) from the cache."""
+
+        def get_active_config_or_none():
+            try:
+                return cls.objects.select_related("model__failover_model").get(
+                    purpose=purpose,
+                    is_active=True,
+                )
+            except cls.DoesNotExist:
+                return None
+
+        return active_config_cache.get_or_set(purpose, get_active_config_or_none)
+
     def get_prompt_template(self):
-        """Get a ChatPromptTemplate for this config."""
-        return ChatPromptTemplate.from_template(self.system_prompt)
+        """Get a ChatPromptTemplate for this config (see create_prompt_template)."""
+        return create_prompt_template(self.system_prompt)
 
 
 class APIKey(TimestampedBase):
@@ -294,7 +440,22 @@ class APIKey(TimestampedBase):
     order = models.IntegerField(
         default=10,
         validators=[MinValueValidator(0)],
-        help_text="Keys with lower order values will be used first",
+        help_text="Keys with lower order values are listed first",
+    )
+    weight = models.PositiveIntegerField(
+        default=1,
+        validators=[MinValueValidator(1)],
+        help_text=(
+            "Share of the requests sent with this key, relative to the other "
+            "keys of the model"
+        ),
+    )
+    rpm_limit = models.PositiveIntegerField(
+        default=0,
+        help_text=(
+            "Maximum number of requests per minute per worker process "
+            "(0 = unlimited)"
+        ),
     )
 
     class Meta:
@@ -305,14 +466,28 @@ class APIKey(TimestampedBase):
 
     @classmethod
     def get_available_key(cls, model_name: str):
-        """Get the first available active key."""
-        found = (
+        """Get the key for the next request to the model.
+
+        Requests are spread over all active keys of the model (or of its LLM
+        type, if the model has no keys), see KeyScheduler.
+        """
+        return key_scheduler.acquire(cls.get_available_keys(model_name))
+
+    @classmethod
+    def get_available_keys(cls, model_name: str) -> list["APIKey"]:
+        """Get the active keys of the model, by order."""
+        return available_key_cache.get_or_set(
+            model_name,
+            lambda: cls._get_available_keys(model_name),
+        )
+
+    @classmethod
+    def _get_available_keys(cls, model_name: str) -> list["APIKey"]:
+        found = list(
             cls.objects.filter(
                 is_active=True,
                 llm_model__name=model_name,
-            )
-            .order_by("order")
-            .first()
+            ).order_by("order"),
         )
 
         if found:
@@ -324,13 +499,11 @@ class APIKey(TimestampedBase):
             msg = f"LLM model {model_name} does not exist"
             raise ValueError(msg) from None
 
-        return (
+        return list(
             cls.objects.filter(
                 is_active=True,
                 llm_type=llm_model.llm_type,
-            )
-            .order_by("order")
-            .first()
+            ).order_by("order"),
         )
 
     def clean(self):
@@ -380,6 +553,36 @@ class GameScenario(TimestampedBase):
         return f"{self.name} ({'Active' if self.is_active else 'Inactive'})"
 
 
+class JSONBArrayAppend(models.Func):
+    """Append a value to the array at a top-level key of a jsonb column.
+
+    The value is appended in the database, without sending (and rewriting
+    from) the whole document. PostgreSQL only.
+    """
+
+    output_field = models.JSONField()
+
+    def __init__(self, field_name: str, key: str, value):
+        super().__init__(models.F(field_name))
+        self.key = key
+        self.value = value
+
+    def as_sql(self, compiler, connection, **extra_context):
+        field_sql, field_params = compiler.compile(self.get_source_expressions()[0])
+        sql = (
+            f"jsonb_set({field_sql}, %s::text[], "
+            f"COALESCE({field_sql} -> %s, '[]'::jsonb) || %s::jsonb)"
+        )
+        params = (
+            *field_params,
+            f"{{{self.key}}}",
+            *field_params,
+            self.key,
+            json.dumps([self.value]),
+        )
+        return sql, params
+
+
 class StorySkeleton(TimestampedBase):
     story = models.OneToOneField(
         "GameStory",
@@ -399,10 +602,28 @@ class StorySkeleton(TimestampedBase):
         default="INIT",
     )
 
+    @property
+    def index(self) -> SkeletonIndex:
+        """Precomputed decision point and option lookups over raw_data"""
+        return SkeletonIndex.for_skeleton(self.raw_data)
+
     def has_milestones(self) -> bool:
         """Check if the skeleton has milestones"""
         return self.count_milestones() > 0
 
+    def append_milestone(self, milestone: dict):
+        """Append a milestone to raw_data without rewriting the stored JSON"""
+        if connection.vendor == "postgresql":
+            StorySkeleton.objects.filter(id=self.id).update(
+                raw_data=JSONBArrayAppend("raw_data", "milestones", milestone),
+            )
+        else:
+            with transaction.atomic():
+                skeleton = StorySkeleton.objects.select_for_update().get(id=self.id)
+                skeleton.raw_data.setdefault("milestones", []).append(milestone)
+                skeleton.save(update_fields=["raw_data"])
+        self.raw_data.setdefault("milestones", []).append(milestone)
+
     @staticmethod
     def count_milestones(raw_data: dict) -> int:
         """Count the number of milestones in the raw data"""
@@ -520,21 +741,68 @@ class GameStory(CreatableBase, TimestampedBase):
             for interaction in self.interactions.all().order_by("created_at")
         ]
 
+    @classmethod
+    def get_for_play(cls, story_id):
+        """Get a story with everything needed to play it.
+
+        The skeleton, the creator's profile and all progress entries are loaded
+        in two queries, so that story_state and the decision point helpers
+        below do not hit the database again.
+        """
+        return (
+            cls.objects.select_related("skeleton", "created_by__userprofile")
+            .prefetch_related(
+                models.Prefetch(
+                    "progress_entries",
+                    queryset=StoryProgress.objects.order_by("created_at", "id"),
+                ),
+            )
+            .get(id=story_id)
+        )
+
+    def get_progress_entries(self) -> list["StoryProgress"]:
+        """Get the progress entries in creation order.
+
+        The entries are loaded once and then served from the prefetch cache.
+        """
+        if "progress_entries" not in getattr(self, "_prefetched_objects_cache", {}):
+            models.prefetch_related_objects(
+                [self],
+                models.Prefetch(
+                    "progress_entries",
+                    queryset=StoryProgress.objects.order_by("created_at", "id"),
+                ),
+            )
+        return list(self.progress_entries.all())
+
+    def get_latest_progress(self) -> "StoryProgress | None":
+        """Get the latest progress entry (or None if the story has not started)"""
+        progress_entries = self.get_progress_entries()
+        return progress_entries[-1] if progress_entries else None
+
+    @property
+    def is_demo(self) -> bool:
+        """Check if the story belongs to a demo account"""
+        return bool(
+            self.created_by
+            and hasattr(self.created_by, "userprofile")
+            and self.created_by.userprofile.is_demo_account,
+        )
+
     def get_option_text(self, option_id: str) -> str | None:
         """Get the text for the option ID"""
         if not hasattr(self, "skeleton"):
             return None
-        skeleton = self.skeleton.raw_data
-        for milestone in skeleton.get("milestones", []):
-            for decision_point in milestone.get("decision_points", []):
-                if (
-                    decision_point["decision_point_id"]
-                    == self.get_current_decision_point()
-                ):
-                    for option in decision_point.get("options", []):
-                        if option["option_id"] == option_id:
-                            return option["option_name"]
-        return None
+        skeleton_index = self.skeleton.index
+        decision_point_id = skeleton_index.decision_point_id_by_option_id.get(
+            option_id,
+        )
+        if (
+            decision_point_id is None
+            or decision_point_id != self.get_current_decision_point()
+        ):
+            return None
+        return skeleton_index.option_by_id[option_id]["option_name"]
 
     def is_option_id_in_current_decision_point(self, option_id: str) -> bool:
         """Check if the option ID is in the current decision point
@@ -554,44 +822,22 @@ class GameStory(CreatableBase, TimestampedBase):
             return bool(self._get_next_decision_point())
         if self.skeleton.status == "COMPLETED":
             # We can proceed as long as the last decision point is not fulfilled
-            latest_progress = self.progress_entries.last()
-            return not latest_progress.is_fulfilled
+            latest_progress = self.get_latest_progress()
+            return not (latest_progress and latest_progress.is_fulfilled)
         return False
 
     def _get_next_decision_point(self):
         # TODO: if the user clicks very quickly,  after the last decision point,
         # the next decision may not be available yet, since the skeleton is still
         # being generated. We need to wait in this case.
-
-        # Flatten the story skeleton into a single list of decision points
-        decision_points = []
-        for milestone in self.skeleton.raw_data.get("milestones", []):
-            for decision_point in milestone.get("decision_points", []):
-                decision_points.append(
-                    (
-                        decision_point["decision_point_id"],
-                        milestone["milestone_id"],
-                    ),
-                )
-
-        # Sort decision points by decision id
-        decision_points.sort(key=lambda x: x[0])
-
-        # Find the next decision point
-        current_decision_point = self._get_last_decision_point()
-        next_decision_point = next(
-            (dp for dp in decision_points if dp[0] > current_decision_point),
-            None,
+        return self.skeleton.index.get_next_decision_point(
+            self._get_last_decision_point(),
         )
 
-        if next_decision_point:
-            return next_decision_point[0]
-        return ""
-
     @property
     def story_state(self) -> dict:
         """Get the current story state for the graph"""
-        progress_entries = self.progress_entries.all()
+        progress_entries = self.get_progress_entries()
         return {
             "story_skeleton": self.skeleton.raw_data
             if hasattr(self, "skeleton")
@@ -616,9 +862,9 @@ class GameStory(CreatableBase, TimestampedBase):
         If the last progress entry is fulfilled, get the next decision point
         Otherwise, return the last progress entry's decision point ID
         """
-        if self.progress_entries.count() == 0:
+        latest_progress = self.get_latest_progress()
+        if latest_progress is None:
             return "M1.D1"
-        latest_progress = self.progress_entries.last()
         if latest_progress.is_fulfilled:
             # Get the next decision point
             return self._get_next_decision_point()
@@ -626,12 +872,113 @@ class GameStory(CreatableBase, TimestampedBase):
 
     def _get_last_decision_point(self):
         """Get the last decision point ID"""
-        if self.progress_entries.count() == 0:
+        latest_progress = self.get_latest_progress()
+        if latest_progress is None:
             return "M1.D1"
-        latest_progress = self.progress_entries.last()
         return latest_progress.decision_point_id
 
 
+class PooledSkeleton(TimestampedBase):
+    """A skeleton generated in advance for a pre-generated scene.
+
+    Scenes are pre-generated in sets (one scene per CEFR level), as they are
+    for a player. A set is served to one player instead of generating new
+    scenes, and starting a story with one of its scenes claims the skeleton
+    generated for that scene.
+    """
+
+    scene_set = models.UUIDField(db_index=True)
+    genre = models.CharField(max_length=100)
+    cefr_level = models.CharField(max_length=10, choices=GameStory.CEFR_CHOICES)
+    scene_text = models.TextField()
+    prompt_version = models.CharField(
+        max_length=64,
+        help_text="Version of the scene and skeleton prompts the entry was made with",
+    )
+    background = models.TextField(blank=True)
+    raw_data = models.JSONField(blank=True, default=dict)
+    served_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [models.Index(fields=["genre", "cefr_level", "prompt_version"])]
+
+    def __str__(self):
+        return f"{self.genre} ({self.cefr_level}): {self.scene_text[:50]}"
+
+    @staticmethod
+    def get_prompt_version(is_demo: bool = False) -> str:  # noqa: FBT001, FBT002
+        """Get the version of the current scene and skeleton prompts"""
+        versions = [
+            LLMConfig.get_active_config_with_demo_fallback(
+                purpose=purpose,
+                is_demo=is_demo,
+            ).prompt_version
+            for purpose in ["scene_generation", "story_skeleton_generation"]
+        ]
+        return hashlib.sha256(":".join(versions).encode()).hexdigest()[:16]
+
+    @classmethod
+    def take_scene_set(cls, genre: str, prompt_version: str) -> list[dict] | None:
+        """Serve the oldest unserved scene set of the genre.
+
+        Returns:
+            The scenes (in the format of the scene generation prompt), or None if
+            the pool of the genre is empty
+        """
+        with transaction.atomic():
+            entry = (
+                cls.objects.select_for_update(skip_locked=True)
+                .filter(
+                    genre=genre,
+                    prompt_version=prompt_version,
+                    served_at__isnull=True,
+                )
+                .order_by("created_at")
+                .first()
+            )
+            if entry is None:
+                return None
+            entries = list(
+                cls.objects.filter(scene_set=entry.scene_set).order_by("cefr_level"),
+            )
+            cls.objects.filter(scene_set=entry.scene_set).update(
+                served_at=timezone.now(),
+            )
+        return [{"level": e.cefr_level, "text": e.scene_text} for e in entries]
+
+    @classmethod
+    def claim(cls, story: GameStory, prompt_version: str) -> StorySkeleton | None:
+        """Move the pooled skeleton for the scene of the story to the story.
+
+        Returns:
+            The completed skeleton of the story, or None if there is none in the pool
+        """
+        with transaction.atomic():
+            entry = (
+                cls.objects.select_for_update(skip_locked=True)
+                .filter(
+                    genre=story.genre,
+                    cefr_level=story.cefr_level,
+                    scene_text=story.scene_text,
+                    prompt_version=prompt_version,
+                )
+                .order_by("created_at")
+                .first()
+            )
+            if entry is None:
+                return None
+            skeleton, _ = StorySkeleton.objects.update_or_create(
+                story=story,
+                defaults={
+                    "background": entry.background,
+                    "raw_data": entry.raw_data,
+                    "status": "COMPLETED",
+                },
+            )
+            entry.delete()
+        return skeleton
+
+
 class TextExplanation(CreatableBase, TimestampedBase):
     STATUS_CHOICES = [
         ("pending", "Pending"),
@@ -661,3 +1008,18 @@ class TextExplanation(CreatableBase, TimestampedBase):
 
     def __str__(self):
         return f"Explanation for {self.selected_text[:30]} by {self.created_by}"
+
+
+@receiver(post_save, sender=LLMModel)
+@receiver(post_delete, sender=LLMModel)
+@receiver(post_save, sender=LLMConfig)
+@receiver(post_delete, sender=LLMConfig)
+@receiver(post_save, sender=APIKey)
+@receiver(post_delete, sender=APIKey)
+def invalidate_llm_config_caches(sender, **kwargs):
+    """Evict pooled LLM clients and cached configs when a model, config or
+    API key changes.
+    """
+    clear_llm_model_pool()
+    # Bump after commit so other workers cannot re-cache the old rows
+    transaction.on_commit(bump_config_version)
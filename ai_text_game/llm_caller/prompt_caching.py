@@ -0,0 +1,114 @@
+import logging
+
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.messages import BaseMessage
+from langchain_core.outputs import LLMResult
+from langchain_core.prompt_values import PromptValue
+from langchain_core.prompts import ChatPromptTemplate
+
+logger = logging.getLogger(__name__)
+
+# Marks the end of the stable prefix of a prompt template (e.g. the instructions
+# and the skeleton of a story), which providers can then cache across calls
+CACHE_BREAKPOINT = "<cache_breakpoint/>"
+
+CACHE_CONTROL = {"type": "ephemeral"}
+
+
+def create_prompt_template(template: str) -> ChatPromptTemplate:
+    """Create the prompt template of a system prompt.
+
+    A template with a CACHE_BREAKPOINT gives a message of two text blocks: the
+    prefix, marked with an Anthropic cache_control, and the rest. Other LLMs
+    get the blocks joined back into a single text (see join_text_blocks).
+    """
+    if CACHE_BREAKPOINT not in template:
+        return ChatPromptTemplate.from_template(template)
+
+    prefix, suffix = template.split(CACHE_BREAKPOINT, 1)
+    return ChatPromptTemplate.from_messages(
+        [
+            (
+                "human",
+                [
+                    {"type": "text", "text": prefix, "cache_control": CACHE_CONTROL},
+                    {"type": "text", "text": suffix},
+                ],
+            ),
+        ],
+    )
+
+
+def join_text_blocks(
+    prompt: PromptValue | list[BaseMessage] | str,
+) -> list[BaseMessage] | str:
+    """Join the text blocks of the messages of a prompt into plain texts.
+
+    For the LLMs that do not support cache_control (OpenAI caches the longest
+    prefix of a prompt by itself), so that they get the same prompt as without
+    a cache breakpoint.
+    """
+    if isinstance(prompt, str):
+        return prompt
+    messages = prompt.to_messages() if isinstance(prompt, PromptValue) else prompt
+
+    joined_messages = []
+    for message in messages:
+        content = message.content
+        if isinstance(content, list) and all(
+            isinstance(block, dict) and block.get("type") == "text" for block in content
+        ):
+            message = message.model_copy(  # noqa: PLW2901
+                update={"content": "".join(block["text"] for block in content)},
+            )
+        joined_messages.append(message)
+    return joined_messages
+
+
+def get_token_usage(response: LLMResult) -> dict[str, int]:
+    """Get the token counts of a response (zero if the LLM reports none)."""
+    usage = {
+        "input_tokens": 0,
+        "output_tokens": 0,
+        "cache_read_tokens": 0,
+        "cache_creation_tokens": 0,
+    }
+    for generations in response.generations:
+        for generation in generations:
+            usage_metadata = getattr(
+                getattr(generation, "message", None),
+                "usage_metadata",
+                None,
+            )
+            if not usage_metadata:
+                continue
+            input_token_details = usage_metadata.get("input_token_details") or {}
+            usage["input_tokens"] += usage_metadata.get("input_tokens") or 0
+            usage["output_tokens"] += usage_metadata.get("output_tokens") or 0
+            usage["cache_read_tokens"] += input_token_details.get("cache_read") or 0
+            usage["cache_creation_tokens"] += (
+                input_token_details.get("cache_creation") or 0
+            )
+    return usage
+
+
+class PromptCacheCallbackHandler(BaseCallbackHandler):
+    """Logs how many prompt tokens of the calls of an LLM were cached."""
+
+    # Run in the event loop of async calls instead of in an executor thread
+    run_inline = True
+
+    def __init__(self, model_name: str):
+        self.model_name = model_name
+
+    def on_llm_end(self, response: LLMResult, **kwargs) -> None:
+        usage = get_token_usage(response)
+        if not usage["input_tokens"]:
+            return
+        logger.info(
+            "LLM %s used %d input tokens (%d read from cache, %d written to cache)",
+            self.model_name,
+            usage["input_tokens"],
+            usage["cache_read_tokens"],
+            usage["cache_creation_tokens"],
+        )
@@ -0,0 +1,88 @@
+from datetime import date
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.cache import cache
+from django.utils import timezone
+
+from .models import DailyUsage
+from .utils import get_today_date_range
+
+
+def get_usage_key(user_id: int, model_name: str, day: date) -> str:
+    return f"llm_caller:usage:{day.isoformat()}:{user_id}:{model_name}"
+
+
+def get_used_quota(user_id: int, model_name: str) -> int:
+    """Number of requests the user made with the model today.
+
+    Reads the counter only, so that checking the quota costs a single cache
+    lookup.
+    """
+    key = get_usage_key(user_id, model_name, timezone.localdate())
+    return cache.get(key, 0)
+
+
+def record_usage(user_id: int | None, model_name: str) -> int:
+    """Count an LLM request of the user against the model's daily quota.
+
+    The counter expires shortly after local midnight. The first request of the
+    day also creates the DailyUsage row the counter is reconciled to (and
+    restores a counter lost from the cache from that row).
+
+    Returns:
+        The number of requests made today, including this one
+    """
+    if user_id is None:
+        return 0
+
+    today_start, today_end = get_today_date_range()
+    key = get_usage_key(user_id, model_name, today_start.date())
+    # Keep the counter until the last reconciliation of the day has seen it
+    timeout = (today_end - timezone.now()).total_seconds() + (
+        settings.LLM_USAGE_RECONCILE_INTERVAL
+    )
+
+    if cache.add(key, 0, timeout=timeout):
+        usage, _ = DailyUsage.objects.get_or_create(
+            user_id=user_id,
+            model_name=model_name,
+            date=today_start.date(),
+        )
+        if usage.count:
+            cache.incr(key, usage.count)
+    try:
+        return cache.incr(key)
+    except ValueError:
+        # The counter was evicted in between
+        cache.add(key, 1, timeout=timeout)
+        return 1
+
+
+def reconcile_usage(since: date | None = None) -> int:
+    """Store the cached counters of the DailyUsage rows since the given day
+    (default: yesterday).
+
+    Returns:
+        The number of updated rows
+    """
+    if since is None:
+        since = timezone.localdate() - timedelta(days=1)
+
+    usages = list(DailyUsage.objects.filter(date__gte=since))
+    keys = {
+        usage.id: get_usage_key(usage.user_id, usage.model_name, usage.date)
+        for usage in usages
+    }
+    counts = cache.get_many(keys.values())
+
+    now = timezone.now()
+    updated = []
+    for usage in usages:
+        count = counts.get(keys[usage.id], 0)
+        if count > usage.count:
+            usage.count = count
+            usage.updated_at = now
+            updated.append(usage)
+    DailyUsage.objects.bulk_update(updated, ["count", "updated_at"])
+    return len(updated)
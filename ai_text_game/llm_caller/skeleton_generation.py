@@ -0,0 +1,155 @@
+import json
+import logging
+
+from langchain_core.output_parsers.string import StrOutputParser
+from langchain_core.runnables import Runnable
+
+from .llm_router import get_config_llm_model
+from .models import GameStory
+from .models import LLMConfig
+from .models import StorySkeleton
+from .quotas import record_usage
+from .skeleton_parser import MilestoneStreamParser
+
+logger = logging.getLogger(__name__)
+
+
+class SkeletonGeneration:
+    """Stores a streamed story skeleton and builds the events for the game
+    consumers of the story.
+
+    Shared by the celery task and the async skeleton worker. Every method that
+    accesses the database is sync.
+    """
+
+    def __init__(self, story_id: int):
+        self.story_id = story_id
+        self.group_name = f"game_{story_id}"
+        self.story = None
+        self.skeleton = None
+        self.parser = MilestoneStreamParser()
+
+    def start(self) -> bool:
+        """Mark the skeleton of the story as generating.
+
+        Returns:
+            False if the skeleton must not be generated
+        """
+        story = (
+            GameStory.objects.select_related("skeleton", "created_by__userprofile")
+            .filter(id=self.story_id)
+            .first()
+        )
+        if story is None:
+            logger.warning("Story %s not found, skipping generation", self.story_id)
+            return False
+
+        skeleton = getattr(story, "skeleton", None)
+        if skeleton is not None:
+            if skeleton.status in ["COMPLETED", "GENERATING"]:
+                logger.warning(
+                    "Story %s already has a skeleton, skipping generation",
+                    self.story_id,
+                )
+                return False
+            skeleton.status = "GENERATING"
+            skeleton.save()
+        else:
+            skeleton = StorySkeleton.objects.create(
+                story=story,
+                status="GENERATING",
+            )
+
+        self.story = story
+        self.skeleton = skeleton
+        return True
+
+    def create_chain(self) -> Runnable:
+        """Create the skeleton generation chain (streaming plain text)."""
+        config = LLMConfig.get_active_config_with_demo_fallback(
+            purpose="story_skeleton_generation",
+            is_demo=self.story.is_demo,
+        )
+        llm = get_config_llm_model(config, name="skeleton")
+        record_usage(self.story.created_by_id, config.model.name)
+        return config.get_prompt_template() | llm | StrOutputParser()
+
+    def feed(self, chunk: str) -> list[dict]:
+        """Parse a chunk of the stream.
+
+        Returns:
+            The milestones completed by the chunk
+        """
+        return self.parser.feed(chunk)
+
+    def save_milestone(self, milestone: dict) -> dict:
+        """Save a completed milestone.
+
+        Returns:
+            The progress event
+        """
+        n_milestones = len(self.parser.milestones)
+        skeleton = self.skeleton
+        if n_milestones == 1:
+            skeleton.background = self.parser.data.get("story_background", "")
+            skeleton.raw_data = {**self.parser.data, "milestones": [milestone]}
+            skeleton.save()
+        else:
+            skeleton.append_milestone(milestone)
+
+        return {
+            "type": "skeleton_generation_progress",
+            "n_milestones": n_milestones,
+            "story_id": self.story_id,
+        }
+
+    def complete(self) -> dict | None:
+        """Save the final skeleton.
+
+        Returns:
+            The completion event, or None if nothing was generated
+        """
+        skeleton = self.skeleton
+        skeleton_data = self.parser.data
+        if not skeleton_data:
+            logger.warning(
+                "No skeleton data received, skipping completion notification",
+            )
+            skeleton.status = "FAILED"
+            skeleton.save()
+            return None
+
+        logger.info("Completed skeleton generation for story %s", self.story_id)
+        skeleton.status = "COMPLETED"
+        if skeleton.raw_data.keys() == skeleton_data.keys():
+            # All milestones have been appended already
+            skeleton.save(update_fields=["status", "updated_at"])
+        else:
+            skeleton.background = skeleton_data.get("story_background", "")
+            skeleton.raw_data = skeleton_data
+            skeleton.save()
+
+        return {
+            "type": "skeleton_generation_completed",
+            "skeleton": json.dumps(skeleton_data),
+        }
+
+    def fail(self, error: Exception) -> dict:
+        """Mark the skeleton as failed.
+
+        Returns:
+            The failure event
+        """
+        try:
+            if self.skeleton is not None:
+                self.skeleton.status = "FAILED"
+                self.skeleton.save()
+        except Exception:
+            logger.exception(
+                "Failed to update skeleton status after skeleton generation failure",
+            )
+
+        return {
+            "type": "skeleton_generation_failed",
+            "error": str(error),
+        }
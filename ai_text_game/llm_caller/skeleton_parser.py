@@ -0,0 +1,118 @@
+import json
+
+
+class MilestoneStreamParser:
+    """Incrementally parses a streamed story skeleton JSON object.
+
+    Unlike JsonOutputParser, which re-parses the whole partial JSON on every
+    chunk, every character is scanned only once. Only complete values are
+    decoded: each milestone once its object is closed, and each other top-level
+    field once it is followed by "," or "}".
+
+    Text before the opening "{" (e.g. a markdown code fence) and after the
+    closing "}" is ignored.
+    """
+
+    MILESTONES_KEY = "milestones"
+
+    def __init__(self):
+        self.buffer = ""
+        self.pos = 0
+        # Open containers as [bracket, start position, current key]
+        self.stack: list[list] = []
+        self.in_string = False
+        self.escaped = False
+        self.string_start = 0
+        self.expecting_key = False
+        self.value_start = 0
+        self.done = False
+        self.data: dict = {}
+
+    @property
+    def milestones(self) -> list[dict]:
+        return self.data.get(self.MILESTONES_KEY, [])
+
+    def feed(self, chunk: str) -> list[dict]:
+        """Parse the next chunk of text.
+
+        Returns:
+            The milestones completed by the chunk
+        """
+        self.buffer += chunk
+        milestones = []
+        for i in range(self.pos, len(self.buffer)):
+            if self.done:
+                break
+            milestone = self._parse_char(i, self.buffer[i])
+            if milestone is not None:
+                milestones.append(milestone)
+        self.pos = len(self.buffer)
+        return milestones
+
+    def _parse_char(self, i: int, char: str) -> dict | None:  # noqa: C901, PLR0912
+        if self.in_string:
+            if self.escaped:
+                self.escaped = False
+            elif char == "\\":
+                self.escaped = True
+            elif char == '"':
+                self.in_string = False
+                if self.expecting_key:
+                    self.stack[-1][2] = json.loads(
+                        self.buffer[self.string_start : i + 1],
+                    )
+            return None
+
+        if not self.stack:
+            # Skip anything before the skeleton object
+            if char == "{":
+                self.stack.append(["{", i, None])
+                self.expecting_key = True
+            return None
+
+        if char == '"':
+            self.in_string = True
+            self.string_start = i
+        elif char in "{[":
+            self.stack.append([char, i, None])
+            self.expecting_key = char == "{"
+        elif char in "}]":
+            if len(self.stack) == 1:
+                self._end_field(i)
+                self.stack.pop()
+                self.done = True
+                return None
+            return self._end_container(i)
+        elif char == ":":
+            self.expecting_key = False
+            if len(self.stack) == 1:
+                self.value_start = i + 1
+        elif char == "," and self.stack[-1][0] == "{":
+            self._end_field(i)
+            self.expecting_key = True
+        return None
+
+    def _end_field(self, end: int):
+        """Store a completed top-level field (milestones are stored one by one)."""
+        if len(self.stack) != 1:
+            return
+        key = self.stack[0][2]
+        if key is None or key == self.MILESTONES_KEY:
+            return
+        raw_value = self.buffer[self.value_start : end].strip()
+        if raw_value:
+            self.data[key] = json.loads(raw_value)
+
+    def _end_container(self, end: int) -> dict | None:
+        bracket, start, _ = self.stack.pop()
+        self.expecting_key = False
+        if (
+            bracket == "{"
+            and len(self.stack) == 2  # noqa: PLR2004
+            and self.stack[1][0] == "["
+            and self.stack[0][2] == self.MILESTONES_KEY
+        ):
+            milestone = json.loads(self.buffer[start : end + 1])
+            self.data.setdefault(self.MILESTONES_KEY, []).append(milestone)
+            return milestone
+        return None
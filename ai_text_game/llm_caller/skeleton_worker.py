@@ -0,0 +1,74 @@
+import asyncio
+import logging
+
+from channels.consumer import AsyncConsumer
+from channels.db import database_sync_to_async
+from channels.layers import get_channel_layer
+from django.conf import settings
+
+from .skeleton_generation import SkeletonGeneration
+
+logger = logging.getLogger(__name__)
+
+SKELETON_GENERATION_CHANNEL = "skeleton-generation"
+
+
+async def generate_story_skeleton_async(story_id: int, initial_state: dict) -> None:
+    """Generate story skeleton with the async LLM client and channel layer.
+
+    The asyncio counterpart of tasks.generate_story_skeleton: the process is
+    not blocked while the LLM streams, so one worker can run many generations.
+    """
+    generation = SkeletonGeneration(story_id)
+    channel_layer = get_channel_layer()
+    try:
+        if not await database_sync_to_async(generation.start)():
+            return
+
+        logger.info("Starting skeleton generation for story %s", story_id)
+        chain = await database_sync_to_async(generation.create_chain)()
+
+        # Save and announce every milestone as soon as it is complete
+        async for chunk in chain.astream(initial_state):
+            for milestone in generation.feed(chunk):
+                event = await database_sync_to_async(generation.save_milestone)(
+                    milestone,
+                )
+                await channel_layer.group_send(generation.group_name, event)
+
+        if event := await database_sync_to_async(generation.complete)():
+            await channel_layer.group_send(generation.group_name, event)
+
+    except Exception as e:
+        logger.exception("Error generating story skeleton")
+        # Notify consumer about error
+        event = await database_sync_to_async(generation.fail)(e)
+        await channel_layer.group_send(generation.group_name, event)
+
+
+class SkeletonGenerationConsumer(AsyncConsumer):
+    """Runs skeleton generations sent to the skeleton generation channel.
+
+    Used when SKELETON_GENERATION_BACKEND is "worker". Start the worker with:
+
+        python manage.py runworker skeleton-generation
+
+    Up to SKELETON_WORKER_CONCURRENCY generations run concurrently.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.semaphore = asyncio.Semaphore(settings.SKELETON_WORKER_CONCURRENCY)
+        # Keep references to the running generations
+        self.tasks = set()
+
+    async def generate_skeleton(self, message):
+        task = asyncio.create_task(
+            self.run_generation(message["story_id"], message["initial_state"]),
+        )
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+
+    async def run_generation(self, story_id, initial_state):
+        async with self.semaphore:
+            await generate_story_skeleton_async(story_id, initial_state)
@@ -0,0 +1,166 @@
+import asyncio
+import logging
+
+from django.conf import settings
+from django.core.cache import cache
+from django.utils import timezone
+
+from .story_graph import SkeletonIndex
+from .story_graph import StoryGraph
+from .story_graph import StoryState
+
+logger = logging.getLogger(__name__)
+
+
+def get_speculative_state(
+    state: StoryState,
+    option_id: str,
+    skeleton_status: str,
+) -> StoryState | None:
+    """Build the state the next turn will have if the player picks option_id.
+
+    Args:
+        state: The state the last story segment was generated with
+        option_id: The option the player might choose
+        skeleton_status: The status of the story skeleton
+
+    Returns:
+        The state, or None if the next turn cannot be predicted yet (the next
+        decision point has not been generated)
+    """
+    skeleton_index = SkeletonIndex.for_skeleton(state["story_skeleton"])
+    next_decision_point = skeleton_index.get_next_decision_point(
+        state["current_decision_point"],
+    )
+    if not next_decision_point and skeleton_status != "COMPLETED":
+        return None
+
+    return {
+        **state,
+        "current_decision_point": next_decision_point,
+        "story_progress": [
+            *state["story_progress"],
+            {"content": state["story_text"], "summary": ""},
+        ],
+        "chosen_decisions": [*state["chosen_decisions"], option_id],
+    }
+
+
+def reserve_speculation_budget(model_name: str) -> bool:
+    """Count a speculative generation against the model's daily limit.
+
+    Returns:
+        False if the daily limit of the model has been reached
+    """
+    limit = settings.STORY_SPECULATIVE_DAILY_LIMITS.get(
+        model_name,
+        settings.STORY_SPECULATIVE_DAILY_LIMITS.get("*", 0),
+    )
+    if limit <= 0:
+        return False
+
+    today = timezone.localdate().isoformat()
+    cache_key = f"llm_caller:speculation:{today}:{model_name}"
+    cache.add(cache_key, 0, timeout=60 * 60 * 24)
+    try:
+        used = cache.incr(cache_key)
+    except ValueError:
+        # The counter expired in between
+        cache.add(cache_key, 1, timeout=60 * 60 * 24)
+        used = 1
+    return used <= limit
+
+
+class SpeculativeContinuations:
+    """Pre-generates the next story segment for the options of a decision
+    point while the player is reading.
+
+    Results are keyed by the decision path (all chosen option IDs), so that
+    only a continuation generated for the exact same path is ever served.
+    """
+
+    def __init__(self, story_graph: StoryGraph):
+        self.story_graph = story_graph
+        self.tasks: dict[tuple[str, ...], asyncio.Task] = {}
+
+    def start(self, state: StoryState, options: list[dict], skeleton_status: str):
+        """Start generating the continuations of the (top-k) options.
+
+        Args:
+            state: The state the last story segment was generated with
+            options: The options of the decision point shown to the player
+            skeleton_status: The status of the story skeleton
+        """
+        self.cancel()
+
+        top_k = settings.STORY_SPECULATIVE_TOP_K
+        if top_k > 0:
+            options = options[:top_k]
+
+        for option in options:
+            speculative_state = get_speculative_state(
+                state,
+                option["option_id"],
+                skeleton_status,
+            )
+            if speculative_state is None:
+                return
+
+            node = self.story_graph.decide_continue_or_end(speculative_state)
+            purpose = "continuation" if node == "generate_story_delta" else "ending"
+            model_name = self.story_graph.model_names.get(purpose, "")
+            if not reserve_speculation_budget(model_name):
+                logger.info("Speculative generation limit reached for %s", model_name)
+                return
+
+            path = tuple(speculative_state["chosen_decisions"])
+            # No thread config: the speculative states must not replace the
+            # progress context of the story
+            self.tasks[path] = asyncio.create_task(
+                self.story_graph.arun_turn(speculative_state),
+            )
+
+    async def take(self, state: StoryState) -> StoryState | None:
+        """Get the pre-generated result for the state and discard the others.
+
+        Waits for the generation if it is still running.
+
+        Returns:
+            The new state (as produced by the story graph), or None if there is
+            no (successful) speculative result for the state
+        """
+        task = self.tasks.pop(tuple(state["chosen_decisions"]), None)
+        self.cancel()
+        if task is None:
+            return None
+
+        try:
+            new_state = await task
+        except asyncio.CancelledError:
+            # Only a cancelled speculative generation is a miss: a cancellation
+            # of the caller (e.g. a disconnect) must propagate
+            current_task = asyncio.current_task()
+            if not task.cancelled() or (current_task and current_task.cancelling()):
+                raise
+            return None
+        except Exception:
+            logger.exception("Speculative story generation failed")
+            return None
+
+        if new_state["current_decision_point"] != state["current_decision_point"]:
+            return None
+        return new_state
+
+    def cancel(self):
+        """Cancel all pending speculative generations."""
+        for task in self.tasks.values():
+            task.cancel()
+            task.add_done_callback(_discard_result)
+        self.tasks.clear()
+
+
+def _discard_result(task: asyncio.Task):
+    # Retrieve the error of a discarded generation (that finished before it
+    # was cancelled), so that asyncio does not log it as never retrieved
+    if not task.cancelled() and task.exception() is not None:
+        logger.debug("Discarded speculative generation failed: %r", task.exception())
@@ -1,12 +1,19 @@
 # ruff: noqa: E501, PERF401
+import bisect
 import logging
+import threading
+from collections import OrderedDict
 from collections.abc import AsyncIterator
+from collections.abc import Awaitable
+from collections.abc import Callable
+from functools import cached_property
 from typing import TypedDict
 
 from langchain_core.output_parsers.json import JsonOutputParser
 from langchain_core.output_parsers.string import StrOutputParser
 from langchain_core.runnables import Runnable
-from langgraph.checkpoint.memory import InMemorySaver
+from langchain_core.runnables import RunnableConfig
+from langgraph.checkpoint.base import BaseCheckpointSaver
 from langgraph.graph import END
 from langgraph.graph import START
 from langgraph.graph import StateGraph
@@ -54,16 +61,203 @@ class StoryState(TypedDict):
     status: str
 
 
+class SkeletonIndex:
+    """Precomputed lookups over a story skeleton.
+
+    Use SkeletonIndex.for_skeleton() to get the index, so that it is built only
+    once per skeleton (and rebuilt when milestones are added to it).
+    """
+
+    _cache: OrderedDict = OrderedDict()
+    _cache_lock = threading.Lock()
+    _cache_size = 256
+
+    def __init__(self, skeleton: StorySkeleton):
+        self.skeleton = skeleton
+        self.milestone_by_id: dict[str, Milestone] = {}
+        self.decision_point_by_id: dict[str, DecisionPoint] = {}
+        self.option_by_id: dict[str, DecisionOption] = {}
+        # Option ID -> ID of the decision point the option belongs to
+        self.decision_point_id_by_option_id: dict[str, str] = {}
+
+        for milestone in skeleton.get("milestones", []):
+            if not isinstance(milestone, dict):
+                continue
+            if milestone_id := milestone.get("milestone_id"):
+                self.milestone_by_id[milestone_id] = milestone
+            for decision_point in milestone.get("decision_points") or []:
+                decision_point_id = decision_point.get("decision_point_id")
+                if not decision_point_id:
+                    # An incomplete decision point of an in-progress skeleton
+                    continue
+                self.decision_point_by_id[decision_point_id] = decision_point
+                for option in decision_point.get("options") or []:
+                    if option_id := option.get("option_id"):
+                        self.option_by_id[option_id] = option
+                        self.decision_point_id_by_option_id[option_id] = (
+                            decision_point_id
+                        )
+
+        # Decision point IDs sorted by ID
+        self.decision_points: list[str] = sorted(self.decision_point_by_id)
+
+    @classmethod
+    def for_skeleton(cls, skeleton: StorySkeleton) -> "SkeletonIndex":
+        """Get the (cached) index of the given skeleton."""
+        fingerprint = cls._fingerprint(skeleton)
+        with cls._cache_lock:
+            cached = cls._cache.get(id(skeleton))
+            # Keeping a reference to the skeleton ensures its id is not reused
+            if cached and cached[0] is skeleton and cached[1] == fingerprint:
+                cls._cache.move_to_end(id(skeleton))
+                return cached[2]
+
+        index = cls(skeleton)
+        with cls._cache_lock:
+            cls._cache[id(skeleton)] = (skeleton, fingerprint, index)
+            cls._cache.move_to_end(id(skeleton))
+            while len(cls._cache) > cls._cache_size:
+                cls._cache.popitem(last=False)
+        return index
+
+    @staticmethod
+    def _fingerprint(skeleton: StorySkeleton) -> tuple:
+        """A cheap fingerprint that changes while a skeleton is being generated."""
+        milestones = skeleton.get("milestones") or []
+        if not milestones or not isinstance(milestones[-1], dict):
+            return (len(milestones),)
+        decision_points = milestones[-1].get("decision_points") or []
+        options = decision_points[-1].get("options") or [] if decision_points else []
+        return (len(milestones), len(decision_points), len(options))
+
+    def get_options(self, decision_point_id: str) -> list[DecisionOption]:
+        """Get the options of a decision point (empty if it does not exist)."""
+        decision_point = self.decision_point_by_id.get(decision_point_id)
+        if decision_point is None:
+            return []
+        return decision_point.get("options") or []
+
+    def get_next_decision_point(self, decision_point_id: str) -> str:
+        """Get the ID of the decision point after the given one ("" if none)."""
+        position = bisect.bisect_right(self.decision_points, decision_point_id)
+        if position < len(self.decision_points):
+            return self.decision_points[position]
+        return ""
+
+    @cached_property
+    def formatted_skeleton(self) -> str:
+        """The skeleton formatted for prompt context"""
+        return _format_story_skeleton(self.skeleton)
+
+
+class ProgressContext:
+    """Incrementally formatted story progress for prompt context.
+
+    Keeps the formatted text of every progress entry. A new turn only formats
+    the new entries and appends them to the text; the text is only rebuilt
+    from the first earlier entry whose text (or summary) or decision changed.
+    """
+
+    def __init__(self):
+        self._keys: list[tuple[str, str | None]] = []
+        # Offset of the formatted text of each entry in self._text
+        self._offsets: list[int] = []
+        self._text = ""
+        # Indices of the entries whose summary or decision may still be added.
+        # Entries with both never change, so they are not compared again.
+        self._pending: list[int] = []
+
+    def update(self, state: dict) -> str:
+        """Bring the context up to date with the state and return its text."""
+        story_progress = state["story_progress"]
+        decisions = state["chosen_decisions"]
+
+        def get_key(i: int) -> tuple[str, str | None]:
+            # Use summary if available, otherwise use full content
+            text = story_progress[i].get("summary") or story_progress[i]["content"]
+            decision = decisions[i] if i < len(decisions) else None
+            return text, decision
+
+        n_cached = len(self._keys)
+        first_changed = self._get_first_changed(len(story_progress), get_key)
+        if first_changed == len(story_progress):
+            return self._text
+
+        if first_changed < n_cached:
+            del self._keys[first_changed:]
+            self._text = self._text[: self._offsets[first_changed]]
+            del self._offsets[first_changed:]
+            self._pending = [i for i in self._pending if i < first_changed]
+
+        new_parts = []
+        offset = len(self._text)
+        for i in range(first_changed, len(story_progress)):
+            key = get_key(i)
+            if not story_progress[i].get("summary"):
+                logger.info(
+                    "Using full content for progress entry %s (summary not available)",
+                    i,
+                )
+            part = self._format(state, *key)
+            self._keys.append(key)
+            self._offsets.append(offset)
+            offset += len(part)
+            new_parts.append(part)
+            if not story_progress[i].get("summary") or key[1] is None:
+                self._pending.append(i)
+
+        self._text += "".join(new_parts)
+        return self._text
+
+    def _get_first_changed(self, n_entries: int, get_key) -> int:
+        """Get the index of the first cached entry that changed, or of the
+        first new entry."""
+        n_cached = len(self._keys)
+        if n_entries < n_cached:
+            return 0
+        # The last entry is always compared, as its decision can be reverted
+        candidates = self._pending
+        if n_cached and (not candidates or candidates[-1] != n_cached - 1):
+            candidates = [*candidates, n_cached - 1]
+        for i in candidates:
+            if get_key(i) != self._keys[i]:
+                return i
+        return n_cached
+
+    @staticmethod
+    def _format(state: dict, text: str, decision: str | None) -> str:
+        part = f"{text}\n"
+        if decision is not None:
+            decision_option = get_decision_option(state["story_skeleton"], decision)
+            part += f"\n[Choice made: {decision_option['option_name']}]\n"
+        return part
+
+
 class StoryGraph:
     """Encapsulates story generation graph functionality."""
 
-    def __init__(self, llm_models: dict[str, Runnable]):
+    PROGRESS_CONTEXT_CACHE_SIZE = 1024
+
+    def __init__(
+        self,
+        llm_models: dict[str, Runnable],
+        model_names: dict[str, str] | None = None,
+        checkpointer: BaseCheckpointSaver | None = None,
+    ):
         """Initialize with LLM models for each node type.
 
         Args:
             llm_models: Dictionary mapping node types to LLM models
+            model_names: Dictionary mapping node types to model names
+            checkpointer: Saver of the graph checkpoints. None (no checkpoints)
+                is enough for the game, as every run starts from the state
+                rebuilt from the database.
         """
         self.llm_models = llm_models
+        self.model_names = model_names or {}
+        self.checkpointer = checkpointer
+        # Progress contexts of recently played stories, keyed by thread ID
+        self.progress_contexts: OrderedDict[str, ProgressContext] = OrderedDict()
         self.graph = self._build_graph()
         self.json_parser = JsonOutputParser()
         self.string_parser = StrOutputParser()
@@ -90,44 +284,77 @@ class StoryGraph:
             END,
         )
 
-        return workflow.compile(checkpointer=InMemorySaver())
-
-    async def generate_story_delta(self, state: StoryState) -> StoryState:
+        return workflow.compile(checkpointer=self.checkpointer)
+
+    def get_progress_context(self, config: RunnableConfig | None) -> ProgressContext:
+        """Get the progress context of the story the graph is running for."""
+        thread_id = (config or {}).get("configurable", {}).get("thread_id")
+        if thread_id is None:
+            return ProgressContext()
+        progress_context = self.progress_contexts.pop(thread_id, None)
+        if progress_context is None:
+            progress_context = ProgressContext()
+        self.progress_contexts[thread_id] = progress_context
+        while len(self.progress_contexts) > self.PROGRESS_CONTEXT_CACHE_SIZE:
+            self.progress_contexts.popitem(last=False)
+        return progress_context
+
+    def get_story_delta_params(
+        self,
+        state: StoryState,
+        config: RunnableConfig | None = None,
+    ) -> dict:
+        """Get the input of the continuation prompt."""
+        # Get current milestone info
+        skeleton = state["story_skeleton"]
+        skeleton_index = SkeletonIndex.for_skeleton(skeleton)
+        milestone_id, decision_point_id = get_m_d_id(
+            state["current_decision_point"],
+        )
+        milestone = skeleton_index.milestone_by_id[milestone_id]
+        decision_point = skeleton_index.decision_point_by_id[decision_point_id]
+        formatted_progress = self.get_progress_context(config).update(state)
+        if not formatted_progress:
+            formatted_progress = "(There is no progress yet: please start writing the story from the background)"
+        formatted_skeleton = format_story_skeleton(skeleton)
+        formatted_milestone = format_milestone(milestone)
+        formatted_decision_point = format_decision_point(decision_point)
+
+        return {
+            "skeleton": formatted_skeleton,
+            "background": skeleton["story_background"],
+            "progress": formatted_progress,
+            "milestone": formatted_milestone,
+            "decisions_made": format_decisions_made(state),
+            "cefr_level": state["cefr_level"],
+            "decision_point": formatted_decision_point,
+        }
+
+    def get_story_ending_params(
+        self,
+        state: StoryState,
+        config: RunnableConfig | None = None,
+    ) -> dict:
+        """Get the input of the ending prompt."""
+        return {
+            "decisions_made": format_decisions_made(state),
+            "skeleton": format_story_skeleton(state["story_skeleton"]),
+            "progress": self.get_progress_context(config).update(state),
+            "cefr_level": state["cefr_level"],
+        }
+
+    async def generate_story_delta(
+        self,
+        state: StoryState,
+        config: RunnableConfig | None = None,
+    ) -> StoryState:
         """Generate the next story segment."""
         logger.info(
             "Generating story delta for %s",
             state.get("current_decision_point", ""),
         )
         try:
-            # Get current milestone info
-            skeleton = state["story_skeleton"]
-            milestone_id, decision_point_id = get_m_d_id(
-                state["current_decision_point"],
-            )
-            milestone = next(
-                m for m in skeleton["milestones"] if m["milestone_id"] == milestone_id
-            )
-            decision_point = next(
-                d
-                for d in milestone["decision_points"]
-                if d["decision_point_id"] == decision_point_id
-            )
-            formatted_progress = format_progress_with_decisions(state)
-            if not formatted_progress:
-                formatted_progress = "(There is no progress yet: please start writing the story from the background)"
-            formatted_skeleton = format_story_skeleton(skeleton)
-            formatted_milestone = format_milestone(milestone)
-            formatted_decision_point = format_decision_point(decision_point)
-
-            params = {
-                "skeleton": formatted_skeleton,
-                "background": skeleton["story_background"],
-                "progress": formatted_progress,
-                "milestone": formatted_milestone,
-                "decisions_made": format_decisions_made(state),
-                "cefr_level": state["cefr_level"],
-                "decision_point": formatted_decision_point,
-            }
+            params = self.get_story_delta_params(state, config)
 
             # Generate continuation
             chain = self.llm_models["continuation"] | self.string_parser
@@ -142,7 +369,11 @@ class StoryGraph:
                 "status": "IN_PROGRESS",
             }
 
-    async def generate_story_ending(self, state: StoryState) -> StoryState:
+    async def generate_story_ending(
+        self,
+        state: StoryState,
+        config: RunnableConfig | None = None,
+    ) -> StoryState:
         """Generate the story ending."""
         logger.info(
             "Generating story ending for %s",
@@ -151,12 +382,7 @@ class StoryGraph:
 
         try:
             # Format variables
-            variables = {
-                "decisions_made": format_decisions_made(state),
-                "skeleton": format_story_skeleton(state["story_skeleton"]),
-                "progress": format_progress_with_decisions(state),
-                "cefr_level": state["cefr_level"],
-            }
+            variables = self.get_story_ending_params(state, config)
 
             # Generate ending
             chain = self.llm_models["ending"] | self.string_parser
@@ -171,6 +397,47 @@ class StoryGraph:
                 "status": "COMPLETED",
             }
 
+    async def arun_turn(
+        self,
+        state: StoryState,
+        config: RunnableConfig | None = None,
+        on_text: Callable[[str], Awaitable[None]] | None = None,
+    ) -> StoryState:
+        """Generate the next story segment (or the ending) without the graph.
+
+        The graph has a single branch per state (see decide_continue_or_end),
+        so its chain can be streamed directly, without the overhead of running
+        the graph and of its "messages" and "values" stream modes.
+
+        Args:
+            state: The story state
+            config: The config of the run (the thread ID of the story)
+            on_text: Coroutine function called with every chunk of the text
+
+        Returns:
+            The new state, as returned by the graph
+        """
+        if self.decide_continue_or_end(state) == "generate_story_delta":
+            logger.info(
+                "Generating story delta for %s",
+                state["current_decision_point"],
+            )
+            chain = self.llm_models["continuation"] | self.string_parser
+            params = self.get_story_delta_params(state, config)
+            status = "IN_PROGRESS"
+        else:
+            logger.info("Generating story ending")
+            chain = self.llm_models["ending"] | self.string_parser
+            params = self.get_story_ending_params(state, config)
+            status = "COMPLETED"
+
+        parts = []
+        async for chunk in chain.astream(params):
+            parts.append(chunk)
+            if on_text is not None:
+                await on_text(chunk)
+        return {**state, "story_text": "".join(parts), "status": status}
+
     async def summarize_segment(
         self,
         story_segment: str,
@@ -236,21 +503,20 @@ def get_decision_point(
     decision_point_id: str,
 ) -> DecisionPoint:
     """Get a decision point from the story skeleton."""
-    for milestone in skeleton["milestones"]:
-        for decision_point in milestone["decision_points"]:
-            if decision_point["decision_point_id"] == decision_point_id:
-                return decision_point
+    decision_point = SkeletonIndex.for_skeleton(skeleton).decision_point_by_id.get(
+        decision_point_id,
+    )
+    if decision_point is not None:
+        return decision_point
     msg = f"Decision point {decision_point_id} not found"
     raise ValueError(msg)
 
 
 def get_decision_option(skeleton: StorySkeleton, option_id: str) -> DecisionOption:
     """Get a decision option from the story skeleton."""
-    for milestone in skeleton["milestones"]:
-        for decision_point in milestone["decision_points"]:
-            for option in decision_point["options"]:
-                if option["option_id"] == option_id:
-                    return option
+    option = SkeletonIndex.for_skeleton(skeleton).option_by_id.get(option_id)
+    if option is not None:
+        return option
     msg = f"Decision option {option_id} not found"
     raise ValueError(msg)
 
@@ -267,30 +533,7 @@ def format_progress_with_decisions(state: dict) -> str:
 
     Uses summaries if available, otherwise falls back to full content.
     """
-    story_progress = state["story_progress"]
-    if len(story_progress) <= 0:
-        return ""
-
-    decisions = state["chosen_decisions"]
-    formatted_progress = ""
-    for i, progress in enumerate(story_progress):
-        # Use summary if available, otherwise use full content
-        if progress.get("summary"):
-            text = progress["summary"]
-        else:
-            text = progress["content"]
-            logger.info(
-                "Using full content for progress entry %s (summary not available)",
-                i,
-            )
-
-        formatted_progress += f"{text}\n"
-
-        if i < len(decisions):
-            decision = decisions[i]
-            decision_option = get_decision_option(state["story_skeleton"], decision)
-            formatted_progress += f"\n[Choice made: {decision_option['option_name']}]\n"
-    return formatted_progress
+    return ProgressContext().update(state)
 
 
 def format_decisions_made(state: dict) -> str:
@@ -321,8 +564,14 @@ def format_decision_point(decision_point: DecisionPoint) -> str:
 
 
 def format_story_skeleton(skeleton: StorySkeleton) -> str:
-    """Format the story skeleton for prompt context."""
+    """Format the story skeleton for prompt context.
+
+    The formatted text is cached along with the skeleton index.
+    """
+    return SkeletonIndex.for_skeleton(skeleton).formatted_skeleton
+
 
+def _format_story_skeleton(skeleton: StorySkeleton) -> str:
     def is_milestone_broken(milestone: Milestone) -> bool:
         """Return true if a milestone is broken."""
         return (
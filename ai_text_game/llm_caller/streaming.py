@@ -0,0 +1,93 @@
+import asyncio
+from collections.abc import Awaitable
+from collections.abc import Callable
+
+from django.conf import settings
+
+
+class StreamBuffer:
+    """Coalesces streamed text chunks into fewer WebSocket frames.
+
+    The buffered text is sent when it reaches flush_chars characters, when
+    flush_interval_ms milliseconds have passed since the first buffered chunk,
+    or when the stream ends (on leaving the ``async with`` block).
+
+    Usage:
+        async with StreamBuffer(send_content) as buffer:
+            async for chunk in stream:
+                await buffer.add(chunk)
+    """
+
+    def __init__(
+        self,
+        send_content: Callable[[str], Awaitable[None]],
+        flush_chars: int | None = None,
+        flush_interval_ms: int | None = None,
+    ):
+        """
+        Args:
+            send_content: Coroutine function sending one frame with the content
+            flush_chars: Number of characters to flush at (0 = every chunk)
+            flush_interval_ms: Maximum time to hold back buffered text
+        """
+        self.send_content = send_content
+        self.flush_chars = (
+            settings.WEBSOCKET_STREAM_FLUSH_CHARS
+            if flush_chars is None
+            else flush_chars
+        )
+        self.flush_interval = (
+            settings.WEBSOCKET_STREAM_FLUSH_INTERVAL_MS
+            if flush_interval_ms is None
+            else flush_interval_ms
+        ) / 1000
+        self.parts: list[str] = []
+        self.size = 0
+        self.timer: asyncio.Task | None = None
+        # Keeps the frames in order when the timer and the stream flush at once
+        self.lock = asyncio.Lock()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        self._cancel_timer()
+        if exc_type is None:
+            await self.flush()
+
+    async def add(self, content: str):
+        """Add a chunk, sending the buffer if it is full."""
+        if not content:
+            return
+        self.parts.append(content)
+        self.size += len(content)
+        if self.size >= self.flush_chars:
+            self._cancel_timer()
+            await self.flush()
+        elif self.timer is None and self.flush_interval > 0:
+            self.timer = asyncio.create_task(self._flush_later())
+
+    async def flush(self):
+        """Send the buffered text (if any) as one frame."""
+        async with self.lock:
+            if not self.parts:
+                return
+            content = "".join(self.parts)
+            self.parts = []
+            self.size = 0
+            await self.send_content(content)
+
+    async def _flush_later(self):
+        await asyncio.sleep(self.flush_interval)
+        self.timer = None
+        await self.flush()
+
+    def _cancel_timer(self):
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+
+
+async def replay_text(text: str):
+    """Stream an already generated text like an LLM stream."""
+    yield text
@@ -1,146 +1,234 @@
-import json
 import logging
+import uuid
+from datetime import timedelta
 
 from asgiref.sync import async_to_sync
 from celery import shared_task
 from channels.layers import get_channel_layer
 from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Q
+from django.utils import timezone
 from langchain_core.output_parsers.json import JsonOutputParser
+from langchain_core.output_parsers.string import StrOutputParser
+from langchain_core.runnables import Runnable
 
-from .models import APIKey
+from .llm_router import get_config_llm_model
+from .models import GameScenario
 from .models import GameStory
 from .models import LLMConfig
-from .models import StorySkeleton
-from .utils import get_llm_model
+from .models import PooledSkeleton
+from .models import StoryProgress
+from .quotas import reconcile_usage
+from .skeleton_generation import SkeletonGeneration
 
 logger = logging.getLogger(__name__)
 
 
 @shared_task(bind=True)
-def generate_story_skeleton(self, story_id: int, initial_state: dict) -> None:  # noqa: C901, PLR0915
+def generate_story_skeleton(self, story_id: int, initial_state: dict) -> None:
     """Generate story skeleton in background."""
-    skeleton = None
+    generation = SkeletonGeneration(story_id)
+    channel_layer = get_channel_layer()
     try:
-        # Get story
-        story = GameStory.objects.filter(id=story_id).first()
-
-        if story is None:
-            logger.warning("Story %s not found, skipping generation", story_id)
+        if not generation.start():
             return
 
-        skeleton = getattr(story, "skeleton", None)
-        if skeleton is not None:
-            if skeleton.status in ["COMPLETED", "GENERATING"]:
-                logger.warning(
-                    "Story %s already has a skeleton, skipping generation",
-                    story_id,
-                )
-                return
-            skeleton.status = "GENERATING"
-            skeleton.save()
-        else:
-            skeleton = StorySkeleton.objects.create(
-                story=story,
-                status="GENERATING",
-            )
+        logger.info("Starting skeleton generation for story %s", story_id)
+        chain = generation.create_chain()
 
-        # Check if user is demo account
-        is_demo = False
-        if story.created_by and hasattr(story.created_by, "userprofile"):
-            is_demo = story.created_by.userprofile.is_demo_account
+        # Save and announce every milestone as soon as it is complete
+        for chunk in chain.stream(initial_state):
+            for milestone in generation.feed(chunk):
+                event = generation.save_milestone(milestone)
+                async_to_sync(channel_layer.group_send)(generation.group_name, event)
 
-        # Get LLM config and model
-        config = LLMConfig.get_active_config_with_demo_fallback(
-            purpose="story_skeleton_generation",
-            is_demo=is_demo,
-        )
-        key = APIKey.get_available_key(model_name=config.model.name)
+        if event := generation.complete():
+            async_to_sync(channel_layer.group_send)(generation.group_name, event)
 
-        # Create chain
-        llm = get_llm_model(
-            {
-                "model_name": config.model.name,
-                "llm_type": config.model.llm_type,
-                "url": config.model.url,
-                "temperature": config.temperature,
-                "key": key,
-            },
-            fake=settings.FAKE_LLM_REQUEST,
-            name="skeleton",
+    except Exception as e:
+        logger.exception("Error generating story skeleton")
+        # Notify consumer about error
+        async_to_sync(channel_layer.group_send)(
+            generation.group_name,
+            generation.fail(e),
         )
-        json_parser = JsonOutputParser()
-        chain = config.get_prompt_template() | llm | json_parser
+        raise
 
-        channel_layer = get_channel_layer()
 
-        # Add at the beginning of the task
-        logger.info("Starting skeleton generation for story %s", story_id)
-        prev_milestones = 0
-
-        # Generate skeleton
-        skeleton_data = None
-        stream = chain.stream(initial_state)
-        for chunk in stream:
-            skeleton_data = chunk
-            # Save skeleton on receiving every milestone
-            n_milestones = StorySkeleton.count_milestones(skeleton_data)
-            if n_milestones > prev_milestones:
-                skeleton.background = skeleton_data["story_background"]
-                skeleton.raw_data = skeleton_data
-                skeleton.save()
-
-                async_to_sync(channel_layer.group_send)(
-                    f"game_{story_id}",
-                    {
-                        "type": "skeleton_generation_progress",
-                        "n_milestones": n_milestones,
-                        "story_id": story_id,
-                    },
-                )
-                prev_milestones = n_milestones
-
-        # Save the final skeleton to database
-        if skeleton_data:
-            logger.info("Completed skeleton generation for story %s", story_id)
-            skeleton.background = skeleton_data["story_background"]
-            skeleton.raw_data = skeleton_data
-            skeleton.status = "COMPLETED"
-            skeleton.save()
-
-            # Send completion notification
-            async_to_sync(channel_layer.group_send)(
-                f"game_{story_id}",
-                {
-                    "type": "skeleton_generation_completed",
-                    "skeleton": json.dumps(skeleton_data),
-                },
+@shared_task()
+def summarize_story_progress(progress_id: int) -> None:
+    """Summarize a story segment and the chosen option in background."""
+    progress = (
+        StoryProgress.objects.select_related("story__created_by__userprofile")
+        .filter(id=progress_id)
+        .first()
+    )
+    if progress is None or not progress.chosen_option_text:
+        logger.warning("Progress %s has no decision, skipping summary", progress_id)
+        return
+
+    config = LLMConfig.get_active_config_with_demo_fallback(
+        purpose="story_summary",
+        is_demo=progress.story.is_demo,
+    )
+    llm = get_config_llm_model(config, name="summary")
+    chain = config.get_prompt_template() | llm | StrOutputParser()
+    summary = chain.invoke(
+        {
+            "story_segment": progress.content,
+            "player_decision": progress.chosen_option_text,
+            "cefr_level": progress.story.cefr_level,
+        },
+    )
+    StoryProgress.objects.filter(id=progress_id).update(summary=summary)
+
+
+def create_chain(
+    purpose: str,
+    name: str,
+    output_parser: Runnable,
+    *,
+    is_demo: bool = False,
+) -> Runnable:
+    """Create a chain with the active config of the purpose.
+
+    With is_demo, the demo config of the purpose is used if there is one.
+    """
+    config = LLMConfig.get_active_config_with_demo_fallback(
+        purpose=purpose,
+        is_demo=is_demo,
+    )
+    llm = get_config_llm_model(config, name=name)
+    return config.get_prompt_template() | llm | output_parser
+
+
+def get_pool_prompt_versions() -> dict[str, bool]:
+    """Get the prompt versions the skeleton pool is filled for.
+
+    Returns:
+        Whether each version is made with the demo configs. The demo version is
+        left out when there are no demo configs (it is the same version).
+    """
+    versions = {PooledSkeleton.get_prompt_version(is_demo=True): True}
+    versions[PooledSkeleton.get_prompt_version()] = False
+    return versions
+
+
+@shared_task()
+def refill_skeleton_pool() -> None:
+    """Top up the pre-generated skeletons of every active scenario.
+
+    Runs periodically (see CELERY_BEAT_SCHEDULE). The pool of each genre is
+    filled for the current prompts of both the regular and the demo configs,
+    by a task per genre and prompt version, so they are refilled in parallel.
+    """
+    if settings.SKELETON_POOL_SIZE <= 0:
+        return
+
+    # Drop entries made with old prompts and served sets nobody started
+    versions = get_pool_prompt_versions()
+    served_before = timezone.now() - timedelta(
+        seconds=settings.SKELETON_POOL_SERVED_TTL,
+    )
+    PooledSkeleton.objects.filter(
+        ~Q(prompt_version__in=versions) | Q(served_at__lt=served_before),
+    ).delete()
+
+    for genre in GameScenario.objects.filter(is_active=True).values_list(
+        "name",
+        flat=True,
+    ):
+        for is_demo in versions.values():
+            refill_genre_skeleton_pool.delay(genre, is_demo=is_demo)
+
+
+@shared_task()
+def refill_genre_skeleton_pool(genre: str, *, is_demo: bool = False) -> None:
+    """Generate scene sets (and their skeletons) until the genre pool is full."""
+    lock_key = f"llm_caller:skeleton_pool:{genre}:{'demo' if is_demo else 'main'}"
+    if not cache.add(lock_key, 1, timeout=settings.CELERY_TASK_TIME_LIMIT):
+        logger.info("Skeleton pool of %s is already being refilled", genre)
+        return
+
+    try:
+        prompt_version = PooledSkeleton.get_prompt_version(is_demo=is_demo)
+        n_scene_sets = (
+            PooledSkeleton.objects.filter(
+                genre=genre,
+                prompt_version=prompt_version,
+                served_at__isnull=True,
             )
-        else:
-            logger.warning(
-                "No skeleton data received, skipping completion notification",
+            .values("scene_set")
+            .distinct()
+            .count()
+        )
+        for _ in range(settings.SKELETON_POOL_SIZE - n_scene_sets):
+            generate_pooled_scene_set(genre, prompt_version, is_demo=is_demo)
+    finally:
+        cache.delete(lock_key)
+
+
+def generate_pooled_scene_set(
+    genre: str,
+    prompt_version: str,
+    *,
+    is_demo: bool = False,
+) -> None:
+    """Generate a scene set and a skeleton for each of its scenes."""
+    scene_chain = create_chain(
+        "scene_generation",
+        "scene_generation",
+        JsonOutputParser(),
+        is_demo=is_demo,
+    )
+    scenes = scene_chain.invoke({"genre": genre, "details_prompt": ""})["scenes"]
+    scenes = [
+        scene for scene in scenes if scene["level"] in dict(GameStory.CEFR_CHOICES)
+    ]
+
+    # The same input as for a story without details (see handle_start_story)
+    skeleton_chain = create_chain(
+        "story_skeleton_generation",
+        "skeleton",
+        JsonOutputParser(),
+        is_demo=is_demo,
+    )
+    skeletons = skeleton_chain.batch(
+        [
+            {
+                "theme": genre,
+                "cefr_level": scene["level"],
+                "scene_text": scene["text"],
+                "details_prompt": "",
+            }
+            for scene in scenes
+        ],
+    )
+
+    scene_set = uuid.uuid4()
+    PooledSkeleton.objects.bulk_create(
+        [
+            PooledSkeleton(
+                scene_set=scene_set,
+                genre=genre,
+                cefr_level=scene["level"],
+                scene_text=scene["text"],
+                prompt_version=prompt_version,
+                background=skeleton.get("story_background", ""),
+                raw_data=skeleton,
             )
-            skeleton.status = "FAILED"
-            skeleton.save()
+            for scene, skeleton in zip(scenes, skeletons, strict=True)
+        ],
+    )
+    logger.info("Added a scene set of %s to the skeleton pool", genre)
 
-    except Exception as e:
-        logger.exception("Error generating story skeleton")
-        # Update story status to indicate failure
-        try:
-            if skeleton is not None:
-                skeleton.status = "FAILED"
-                skeleton.save()
-        except Exception:
-            logger.exception(
-                "Failed to update skeleton status after skeleton generation failure",
-            )
 
-        # Notify consumer about error
-        channel_layer = get_channel_layer()
-        async_to_sync(channel_layer.group_send)(
-            f"game_{story_id}",
-            {
-                "type": "skeleton_generation_failed",
-                "error": str(e),
-            },
-        )
-        raise
+@shared_task()
+def reconcile_llm_usage() -> None:
+    """Store the daily LLM usage counters to the database.
+
+    Runs periodically (see CELERY_BEAT_SCHEDULE).
+    """
+    n_updated = reconcile_usage()
+    logger.info("Reconciled %s daily usage counters", n_updated)
@@ -1,9 +1,16 @@
 import pytest
 from rest_framework.test import APIClient
 
+from ai_text_game.llm_caller.caches import bump_config_version
 from ai_text_game.users.tests.factories import UserFactory
 
 
+@pytest.fixture(autouse=True)
+def _fresh_config_version():
+    # Config rows are rolled back between tests without firing any signal
+    bump_config_version()
+
+
 @pytest.fixture
 def user():
     return UserFactory()
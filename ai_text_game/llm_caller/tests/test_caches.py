@@ -0,0 +1,147 @@
+import asyncio
+
+import pytest
+from django.core.cache import cache
+
+from ai_text_game.llm_caller.caches import CacheStats
+from ai_text_game.llm_caller.caches import VersionedCache
+from ai_text_game.llm_caller.caches import bump_config_version
+from ai_text_game.llm_caller.caches import explanation_cache
+from ai_text_game.llm_caller.models import APIKey
+from ai_text_game.llm_caller.models import LLMConfig
+from ai_text_game.llm_caller.models import LLMModel
+
+pytestmark = pytest.mark.django_db
+
+
+class TestVersionedCache:
+    def test_caches_until_version_changes(self):
+        versioned_cache = VersionedCache()
+        calls = []
+
+        def compute():
+            calls.append(1)
+            return len(calls)
+
+        assert versioned_cache.get_or_set("key", compute) == 1
+        assert versioned_cache.get_or_set("key", compute) == 1
+
+        bump_config_version()
+        assert versioned_cache.get_or_set("key", compute) == 2  # noqa: PLR2004
+
+    def test_caches_none(self):
+        versioned_cache = VersionedCache()
+        calls = []
+        versioned_cache.get_or_set("key", lambda: calls.append(1))
+        versioned_cache.get_or_set("key", lambda: calls.append(1))
+        assert len(calls) == 1
+
+
+@pytest.fixture
+def llm_model():
+    return LLMModel.objects.create(name="gpt-4o", display_name="GPT-4o")
+
+
+class TestActiveConfigCache:
+    def test_active_config_is_cached(self, llm_model, django_assert_num_queries):
+        LLMConfig.objects.create(
+            purpose="story_continuation",
+            model=llm_model,
+            system_prompt="{progress}",
+            is_active=True,
+        )
+        bump_config_version()  # on_commit callbacks do not run in tests
+
+        with django_assert_num_queries(1):
+            LLMConfig.get_active_config("story_continuation")
+            config = LLMConfig.get_active_config_with_demo_fallback(
+                "story_continuation",
+            )
+            assert config.model == llm_model
+
+    def test_missing_demo_config_is_cached(
+        self,
+        llm_model,
+        django_assert_num_queries,
+    ):
+        LLMConfig.objects.create(
+            purpose="text_explanation",
+            model=llm_model,
+            system_prompt="{selected_text} {context_text}",
+            is_active=True,
+        )
+        bump_config_version()
+
+        LLMConfig.get_active_config_with_demo_fallback(
+            "text_explanation",
+            is_demo=True,
+        )
+        with django_assert_num_queries(0):
+            LLMConfig.get_active_config_with_demo_fallback(
+                "text_explanation",
+                is_demo=True,
+            )
+
+    def test_missing_config_raises(self):
+        with pytest.raises(ValueError, match="No active config"):
+            LLMConfig.get_active_config("story_ending")
+
+    def test_available_key_is_cached(self, llm_model, django_assert_num_queries):
+        key = APIKey.objects.create(key="sk-test", name="Key", llm_model=llm_model)
+        bump_config_version()
+
+        assert APIKey.get_available_key("gpt-4o") == key
+        with django_assert_num_queries(0):
+            assert APIKey.get_available_key("gpt-4o") == key
+
+
+def test_cache_stats_aincr():
+    cache.clear()
+    stats = CacheStats("test")
+
+    async def run():
+        await stats.aincr("hits")
+        await stats.aincr("hits", 2)
+
+    asyncio.run(run())
+    assert stats.get(["hits", "misses"]) == {"hits": 3, "misses": 0}
+
+
+class TestExplanationCache:
+    def test_key_normalises_whitespace(self):
+        key = explanation_cache.make_key("the  docks", "At the docks.", "gpt-4o", "v1")
+        assert key == explanation_cache.make_key(
+            " the docks\n",
+            "At the\tdocks.",
+            "gpt-4o",
+            "v1",
+        )
+        assert key != explanation_cache.make_key(
+            "docks",
+            "At the docks.",
+            "gpt-4o",
+            "v1",
+        )
+        assert key != explanation_cache.make_key(
+            "the docks",
+            "At the docks.",
+            "gpt-4o-mini",
+            "v1",
+        )
+
+    def test_hit_counts_saved_tokens(self):
+        cache.clear()
+        key = explanation_cache.make_key("docks", "At the docks.", "gpt-4o", "v1")
+
+        async def run():
+            assert await explanation_cache.aget(key) is None
+            await explanation_cache.aset(key, "A place for ships.", prompt="x" * 22)
+            return await explanation_cache.aget(key)
+
+        assert asyncio.run(run()) == "A place for ships."
+        assert explanation_cache.get_stats() == {
+            "hits": 1,
+            "misses": 1,
+            "hit_rate": 0.5,
+            "saved_tokens": 10,
+        }
@@ -0,0 +1,123 @@
+import asyncio
+from datetime import timedelta
+
+import httpx
+import openai
+import pytest
+from django.urls import reverse
+from django.utils import timezone
+
+from ai_text_game.llm_caller.call_logs import LLMCallLogHandler
+from ai_text_game.llm_caller.call_logs import LLMCallLogWriter
+from ai_text_game.llm_caller.call_logs import get_latency_stats
+from ai_text_game.llm_caller.call_logs import get_outcome
+from ai_text_game.llm_caller.models import LLMCallLog
+from ai_text_game.llm_caller.tests.test_llm_router import FakeChatModel
+
+pytestmark = pytest.mark.django_db
+
+
+def make_llm(writer, **kwargs):
+    return FakeChatModel(**kwargs).with_config(
+        callbacks=[LLMCallLogHandler("gpt-4o", None, writer=writer)],
+        metadata={"purpose": "story_continuation"},
+    )
+
+
+async def collect(llm):
+    return [chunk.content async for chunk in llm.astream("Hello")]
+
+
+def make_log(day_offset=0, **kwargs):
+    log = {
+        "purpose": "story_continuation",
+        "model_name": "gpt-4o",
+        "duration": 1.0,
+        "outcome": "success",
+        "created_at": timezone.now() - timedelta(days=day_offset),
+    }
+    log.update(kwargs)
+    return LLMCallLog(**log)
+
+
+class TestLLMCallLogHandler:
+    def test_logs_streamed_call(self):
+        writer = LLMCallLogWriter(flush_interval=0)
+
+        asyncio.run(collect(make_llm(writer, text="a b")))
+        writer.flush()
+
+        log = LLMCallLog.objects.get()
+        assert log.purpose == "story_continuation"
+        assert log.model_name == "gpt-4o"
+        assert log.outcome == "success"
+        assert log.time_to_first_token is not None
+        assert log.duration >= log.time_to_first_token
+
+    def test_logs_failed_call(self):
+        writer = LLMCallLogWriter(flush_interval=0)
+
+        with pytest.raises(ValueError, match="LLM error"):
+            asyncio.run(collect(make_llm(writer, fail=True)))
+        writer.flush()
+
+        log = LLMCallLog.objects.get()
+        assert log.outcome == "error"
+        assert log.time_to_first_token is None
+
+    def test_writes_full_batches(self):
+        writer = LLMCallLogWriter(batch_size=2, flush_interval=0)
+        llm = make_llm(writer, text="a")
+
+        llm.invoke("Hello")
+        assert LLMCallLog.objects.count() == 0
+
+        llm.invoke("Hello")
+        assert LLMCallLog.objects.count() == 2  # noqa: PLR2004
+
+    def test_disabled(self, settings):
+        settings.LLM_CALL_LOG_ENABLED = False
+        writer = LLMCallLogWriter(flush_interval=0)
+
+        asyncio.run(collect(make_llm(writer, text="a")))
+
+        assert writer.rows == []
+
+
+def test_get_outcome():
+    request = httpx.Request("POST", "https://api.openai.com/v1/chat/completions")
+    response = httpx.Response(429, request=request)
+    error = openai.RateLimitError("error", response=response, body=None)
+
+    assert get_outcome(error) == "rate_limited"
+    assert get_outcome(asyncio.CancelledError()) == "cancelled"
+    assert get_outcome(ValueError("error")) == "error"
+
+
+def test_get_latency_stats():
+    LLMCallLog.objects.bulk_create(
+        [
+            *[make_log(duration=i, time_to_first_token=i / 10) for i in range(1, 21)],
+            make_log(outcome="error", duration=0.1),
+            make_log(day_offset=1, prompt_tokens=100, cached_tokens=80),
+        ],
+    )
+
+    today, yesterday = get_latency_stats(LLMCallLog.objects.all())
+
+    assert today["calls"] == 21  # noqa: PLR2004
+    assert today["failures"] == 1
+    assert today["duration_p50"] == 10  # noqa: PLR2004
+    assert today["duration_p95"] == 19  # noqa: PLR2004
+    assert today["ttft_p50"] == pytest.approx(1.0)
+    assert yesterday["calls"] == 1
+    assert yesterday["cached_ratio"] == pytest.approx(0.8)
+
+
+def test_admin_shows_latency_stats(admin_client):
+    make_log().save()
+
+    response = admin_client.get(reverse("admin:llm_caller_llmcalllog_changelist"))
+
+    assert response.status_code == 200  # noqa: PLR2004
+    assert len(response.context["latency_stats"]) == 1
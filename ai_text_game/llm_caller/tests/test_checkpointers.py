@@ -0,0 +1,78 @@
+from typing import TypedDict
+
+from langgraph.graph import END
+from langgraph.graph import START
+from langgraph.graph import StateGraph
+
+from ai_text_game.llm_caller.checkpointers import PrunedInMemorySaver
+from ai_text_game.llm_caller.checkpointers import create_story_graph_checkpointer
+
+
+class CounterState(TypedDict):
+    count: int
+    text: str
+
+
+def make_graph(checkpointer):
+    workflow = StateGraph(state_schema=CounterState)
+    workflow.add_node(
+        "increment",
+        lambda state: {"count": state["count"] + 1, "text": state["text"] * 2},
+    )
+    workflow.add_edge(START, "increment")
+    workflow.add_edge("increment", END)
+    return workflow.compile(checkpointer=checkpointer)
+
+
+def run_turns(graph, thread_id, n_turns):
+    config = {"configurable": {"thread_id": thread_id}}
+    for i in range(n_turns):
+        state = graph.invoke({"count": i, "text": "a"}, config)
+    return state
+
+
+class TestPrunedInMemorySaver:
+    def test_keeps_latest_checkpoints(self):
+        saver = PrunedInMemorySaver(max_checkpoints=1)
+        graph = make_graph(saver)
+
+        run_turns(graph, "1", 1)
+        n_blobs = len(saver.blobs)
+        state = run_turns(graph, "1", 10)
+
+        assert state == {"count": 10, "text": "aa"}
+        assert len(saver.storage["1"][""]) == 1
+        assert len(saver.blobs) <= n_blobs
+        assert len(saver.writes) <= 1
+        # The latest checkpoint is still complete
+        snapshot = graph.get_state({"configurable": {"thread_id": "1"}})
+        assert snapshot.values == {"count": 10, "text": "aa"}
+
+    def test_drops_least_recently_used_threads(self):
+        saver = PrunedInMemorySaver(max_threads=2)
+        graph = make_graph(saver)
+
+        for thread_id in ["1", "2", "1", "3"]:
+            run_turns(graph, thread_id, 1)
+
+        assert set(saver.storage) == {"1", "3"}
+        assert {key[0] for key in saver.blobs} == {"1", "3"}
+
+    def test_delete_thread(self):
+        saver = PrunedInMemorySaver()
+        graph = make_graph(saver)
+        run_turns(graph, "1", 2)
+
+        saver.delete_thread("1")
+
+        assert not saver.storage
+        assert not saver.blobs
+        assert not saver.threads
+
+
+def test_create_story_graph_checkpointer(settings):
+    settings.STORY_GRAPH_CHECKPOINTER = "none"
+    assert create_story_graph_checkpointer() is None
+
+    settings.STORY_GRAPH_CHECKPOINTER = "memory"
+    assert isinstance(create_story_graph_checkpointer(), PrunedInMemorySaver)
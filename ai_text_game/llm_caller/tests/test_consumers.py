@@ -0,0 +1,182 @@
+import asyncio
+import json
+from types import SimpleNamespace
+from unittest import mock
+
+import pytest
+
+from ai_text_game.llm_caller.consumers import GameConsumer
+from ai_text_game.llm_caller.fake_llms import skeleton_json
+from ai_text_game.llm_caller.models import GameStory
+from ai_text_game.llm_caller.models import StoryOption
+from ai_text_game.llm_caller.models import StoryProgress
+
+
+class TestMessageScheduling:
+    def test_story_messages_run_in_order(self):
+        consumer = GameConsumer()
+        handled = []
+
+        async def handle(name, delay):
+            await asyncio.sleep(delay)
+            handled.append(name)
+
+        async def run():
+            consumer.enqueue_story_task(handle, "first", 0.02)
+            consumer.enqueue_story_task(handle, "second", 0)
+            await asyncio.sleep(0.05)
+            consumer.story_worker.cancel()
+
+        asyncio.run(run())
+        assert handled == ["first", "second"]
+
+    def test_explanations_do_not_wait_for_story(self, settings):
+        settings.MAX_EXPLANATIONS_PER_CONNECTION = 2
+        consumer = GameConsumer()
+        handled = []
+
+        async def handle_story():
+            await asyncio.sleep(1)
+
+        async def handle_text_explanation(data):
+            await asyncio.sleep(0.01)
+            handled.append(data["explanation_id"])
+
+        consumer.handle_text_explanation = handle_text_explanation
+
+        async def run():
+            consumer.enqueue_story_task(handle_story)
+            for explanation_id in range(3):
+                consumer.start_explanation({"explanation_id": explanation_id})
+            await asyncio.sleep(0.05)
+            consumer.story_worker.cancel()
+            return [task.cancelled() for task in consumer.explanation_tasks]
+
+        cancelled = asyncio.run(run())
+        # The oldest explanation was cancelled to stay within the limit
+        assert cancelled == [True, False, False]
+        assert handled == [1, 2]
+
+
+class TestStoryStreaming:
+    def test_sends_options_before_generation(self):
+        consumer = GameConsumer()
+        sent = []
+
+        async def send(text_data):
+            sent.append(json.loads(text_data))
+
+        consumer.send = send
+        state = {
+            "story_skeleton": skeleton_json,
+            "current_decision_point": "M1.D1",
+        }
+
+        asyncio.run(consumer.send_decision_point_options(state))
+        assert sent[0]["type"] == "decision_point_options"
+        assert sent[0]["current_decision"] == "M1.D1"
+        assert sent[0]["options"]
+
+        # No options for the ending
+        asyncio.run(
+            consumer.send_decision_point_options(
+                {**state, "current_decision_point": ""},
+            ),
+        )
+        assert len(sent) == 1
+
+
+class TestStoryTurnCancellation:
+    # The story state is read through database_sync_to_async
+    @pytest.mark.django_db
+    def test_cancel_reverts_choice(self):
+        consumer = GameConsumer()
+        consumer.send = mock.AsyncMock()
+        reverted = []
+        generating = asyncio.Event()
+
+        async def revert_user_choice(story):
+            reverted.append(story)
+
+        async def run_story_graph(state):
+            generating.set()
+            await asyncio.sleep(10)
+
+        consumer.revert_user_choice = revert_user_choice
+        consumer.run_story_graph = run_story_graph
+        story = SimpleNamespace(
+            story_state={"story_skeleton": skeleton_json, "current_decision_point": ""},
+        )
+
+        async def run():
+            task = asyncio.create_task(consumer.update_story_progress(story))
+            await asyncio.wait_for(generating.wait(), timeout=5)
+            # e.g. the player disconnected
+            task.cancel()
+            with pytest.raises(asyncio.CancelledError):
+                await task
+
+        asyncio.run(run())
+        assert reverted == [story]
+
+
+@pytest.mark.django_db
+class TestSaveStoryProgress:
+    @pytest.fixture
+    def story(self, user):
+        return GameStory.objects.create(
+            genre="Mystery",
+            created_by=user,
+            status="IN_PROGRESS",
+        )
+
+    def save_story_progress(self, story, state):
+        # Call the sync function directly, so that the queries run (and are
+        # counted) in the test thread
+        GameConsumer.save_story_progress.__wrapped__(GameConsumer(), story, state)
+
+    def make_state(self, **kwargs):
+        state = {
+            "story_skeleton": skeleton_json,
+            "current_decision_point": "M1.D1",
+            "story_text": "Joe is missing.",
+            "status": "IN_PROGRESS",
+        }
+        state.update(kwargs)
+        return state
+
+    def test_saves_progress_options_and_status(
+        self,
+        story,
+        django_assert_num_queries,
+    ):
+        # Savepoint, progress, options, story status, savepoint release
+        with django_assert_num_queries(5):
+            self.save_story_progress(story, self.make_state(status="COMPLETED"))
+
+        progress = StoryProgress.objects.get(story=story)
+        assert progress.content == "Joe is missing."
+        assert progress.decision_point_id == "M1.D1"
+        assert list(
+            StoryOption.objects.filter(progress=progress).values_list(
+                "option_id",
+                flat=True,
+            ),
+        ) == ["M1.D1.O1", "M1.D1.O2"]
+        story.refresh_from_db()
+        assert story.status == "COMPLETED"
+
+    def test_failure_rolls_back(self, story):
+        with (
+            mock.patch.object(
+                StoryOption.objects,
+                "bulk_create",
+                side_effect=RuntimeError("DB error"),
+            ),
+            pytest.raises(RuntimeError, match="DB error"),
+        ):
+            self.save_story_progress(story, self.make_state(status="COMPLETED"))
+
+        assert not StoryProgress.objects.filter(story=story).exists()
+        story.refresh_from_db()
+        assert story.status == "IN_PROGRESS"
@@ -0,0 +1,73 @@
+import pytest
+
+from ai_text_game.llm_caller.fake_llms import skeleton_json
+from ai_text_game.llm_caller.models import GameStory
+from ai_text_game.llm_caller.models import StoryProgress
+from ai_text_game.llm_caller.models import StorySkeleton
+
+pytestmark = pytest.mark.django_db
+
+
+@pytest.fixture
+def story(user):
+    story = GameStory.objects.create(
+        genre="Mystery",
+        title="A Mystery Story",
+        created_by=user,
+        status="IN_PROGRESS",
+    )
+    StorySkeleton.objects.create(
+        story=story,
+        background=skeleton_json["story_background"],
+        raw_data=skeleton_json,
+        status="COMPLETED",
+    )
+    return story
+
+
+class TestStoryState:
+    def test_state_without_progress(self, story):
+        state = GameStory.get_for_play(story.id).story_state
+        assert state["current_decision_point"] == "M1.D1"
+        assert state["story_progress"] == []
+        assert state["chosen_decisions"] == []
+
+    def test_state_runs_no_extra_queries(self, story, django_assert_num_queries):
+        for decision_point_id, option_id in [("M1.D1", "M1.D1.O2"), ("M2.D1", "")]:
+            StoryProgress.objects.create(
+                story=story,
+                content=f"Segment {decision_point_id}",
+                decision_point_id=decision_point_id,
+                chosen_option_id=option_id,
+            )
+
+        story = GameStory.get_for_play(story.id)
+        with django_assert_num_queries(0):
+            state = story.story_state
+            assert story.can_proceed
+            assert story.is_option_id_in_current_decision_point("M2.D1.O1")
+
+        assert state["current_decision_point"] == "M2.D1"
+        assert state["chosen_decisions"] == ["M1.D1.O2"]
+        assert [p["content"] for p in state["story_progress"]] == [
+            "Segment M1.D1",
+            "Segment M2.D1",
+        ]
+
+    def test_next_decision_point_after_choice(self, story):
+        StoryProgress.objects.create(
+            story=story,
+            content="Segment",
+            decision_point_id="M1.D1",
+            chosen_option_id="M1.D1.O1",
+        )
+        assert GameStory.get_for_play(story.id).get_current_decision_point() == "M2.D1"
+
+
+class TestOptionText:
+    def test_option_in_current_decision_point(self, story):
+        assert story.get_option_text("M1.D1.O2") == "No, talk to the townsfolk first."
+
+    def test_option_in_other_decision_point(self, story):
+        assert story.get_option_text("M2.D1.O1") is None
+        assert story.get_option_text("M9.D9.O9") is None
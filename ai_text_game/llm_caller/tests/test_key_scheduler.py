@@ -0,0 +1,128 @@
+from collections import Counter
+
+import httpx
+import openai
+import pytest
+from django.core.cache import cache
+
+from ai_text_game.llm_caller.caches import bump_config_version
+from ai_text_game.llm_caller.key_scheduler import KeyScheduler
+from ai_text_game.llm_caller.key_scheduler import RateLimitCallbackHandler
+from ai_text_game.llm_caller.key_scheduler import key_scheduler
+from ai_text_game.llm_caller.models import APIKey
+from ai_text_game.llm_caller.models import LLMModel
+
+
+@pytest.fixture(autouse=True)
+def _clear_cooldowns():
+    cache.clear()
+    key_scheduler.clear()
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def make_key(key_id, weight=1, rpm_limit=0):
+    return APIKey(
+        id=key_id,
+        key=f"sk-{key_id}",
+        name=f"Key {key_id}",
+        weight=weight,
+        rpm_limit=rpm_limit,
+    )
+
+
+class TestKeyScheduler:
+    def test_spreads_by_weight(self):
+        scheduler = KeyScheduler()
+        keys = [make_key(1, weight=2), make_key(2)]
+
+        picked = [scheduler.acquire(keys).id for _ in range(6)]
+
+        assert Counter(picked) == {1: 4, 2: 2}
+        # Interleaved rather than in bursts
+        assert picked[:3] == [1, 2, 1]
+
+    def test_single_or_no_key(self):
+        scheduler = KeyScheduler()
+        key = make_key(1)
+        assert scheduler.acquire([key]) is key
+        assert scheduler.acquire([]) is None
+
+    def test_skips_empty_bucket(self):
+        clock = FakeClock()
+        scheduler = KeyScheduler(clock=clock)
+        keys = [make_key(1, rpm_limit=2), make_key(2, rpm_limit=60)]
+
+        picked = [scheduler.acquire(keys).id for _ in range(6)]
+        assert Counter(picked) == {1: 2, 2: 4}
+
+        # A token of key 1 is back after 30 seconds
+        clock.now = 30
+        picked = [scheduler.acquire(keys).id for _ in range(4)]
+        assert picked.count(1) == 1
+
+    def test_skips_key_in_cooldown(self):
+        scheduler = KeyScheduler()
+        keys = [make_key(1), make_key(2)]
+
+        scheduler.cool_down(1, 60)
+
+        assert {scheduler.acquire(keys).id for _ in range(4)} == {2}
+
+    def test_uses_cooling_keys_if_all_are(self):
+        scheduler = KeyScheduler()
+        keys = [make_key(1), make_key(2)]
+
+        scheduler.cool_down(1, 60)
+        scheduler.cool_down(2, 60)
+
+        assert scheduler.acquire(keys) is not None
+
+
+class TestRateLimitCallbackHandler:
+    def make_error(self, status_code, headers=None):
+        request = httpx.Request("POST", "https://api.openai.com/v1/chat/completions")
+        response = httpx.Response(status_code, headers=headers, request=request)
+        error_class = (
+            openai.RateLimitError if status_code == 429 else openai.APIStatusError  # noqa: PLR2004
+        )
+        return error_class("error", response=response, body=None)
+
+    def test_cools_down_rate_limited_key(self):
+        handler = RateLimitCallbackHandler(key_id=1)
+        handler.on_llm_error(self.make_error(429, {"retry-after": "20"}))
+
+        assert cache.get(KeyScheduler.get_cooldown_key(1)) is not None
+
+    def test_ignores_other_errors(self):
+        handler = RateLimitCallbackHandler(key_id=1)
+        handler.on_llm_error(self.make_error(500))
+        handler.on_llm_error(ValueError("error"))
+
+        assert cache.get(KeyScheduler.get_cooldown_key(1)) is None
+
+
+@pytest.mark.django_db
+def test_available_key_spreads_over_model_keys():
+    llm_model = LLMModel.objects.create(name="gpt-4o", display_name="GPT-4o")
+    keys = [
+        APIKey.objects.create(key=f"sk-{i}", name=f"Key {i}", llm_model=llm_model)
+        for i in range(3)
+    ]
+    APIKey.objects.create(
+        key="sk-inactive",
+        name="Inactive",
+        llm_model=llm_model,
+        is_active=False,
+    )
+    bump_config_version()
+
+    picked = {APIKey.get_available_key("gpt-4o") for _ in range(3)}
+
+    assert picked == set(keys)
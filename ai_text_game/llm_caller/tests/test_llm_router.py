@@ -0,0 +1,191 @@
+import asyncio
+
+import pytest
+from langchain_core.callbacks import AsyncCallbackHandler
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage
+from langchain_core.messages import AIMessageChunk
+from langchain_core.outputs import ChatGeneration
+from langchain_core.outputs import ChatGenerationChunk
+from langchain_core.outputs import ChatResult
+
+from ai_text_game.llm_caller.llm_router import FailoverChatModel
+from ai_text_game.llm_caller.llm_router import first_token_latencies
+from ai_text_game.llm_caller.llm_router import get_config_llm_model
+from ai_text_game.llm_caller.models import LLMConfig
+from ai_text_game.llm_caller.models import LLMModel
+
+
+class FakeChatModel(BaseChatModel):
+    text: str = ""
+    delay: float = 0
+    fail: bool = False
+    streamed: list = []
+
+    @property
+    def _llm_type(self) -> str:
+        return "fake"
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs):
+        if self.fail:
+            msg = "LLM error"
+            raise ValueError(msg)
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(self.text))])
+
+    async def _astream(self, messages, stop=None, run_manager=None, **kwargs):
+        await asyncio.sleep(self.delay)
+        if self.fail:
+            msg = "LLM error"
+            raise ValueError(msg)
+        for word in self.text.split():
+            self.streamed.append(word)
+            yield ChatGenerationChunk(message=AIMessageChunk(content=word))
+
+
+@pytest.fixture(autouse=True)
+def _clear_latencies():
+    first_token_latencies.clear()
+
+
+def make_router(*llms, **kwargs):
+    return FailoverChatModel(
+        llms=list(llms),
+        model_names=[f"model-{i}" for i in range(len(llms))],
+        **kwargs,
+    )
+
+
+async def collect(llm):
+    return [chunk.content async for chunk in llm.astream("Hello")]
+
+
+class TestFailoverChatModel:
+    def test_uses_first_llm(self):
+        router = make_router(FakeChatModel(text="a b"), FakeChatModel(text="c"))
+        assert asyncio.run(collect(router)) == ["a", "b"]
+
+    def test_fails_over_on_error(self):
+        router = make_router(FakeChatModel(fail=True), FakeChatModel(text="c d"))
+        assert asyncio.run(collect(router)) == ["c", "d"]
+
+    def test_fails_over_on_timeout(self):
+        router = make_router(
+            FakeChatModel(text="a", delay=1),
+            FakeChatModel(text="c"),
+            first_token_timeout=0.05,
+        )
+        assert asyncio.run(collect(router)) == ["c"]
+
+    def test_raises_last_error(self):
+        router = make_router(FakeChatModel(fail=True), FakeChatModel(fail=True))
+        with pytest.raises(ValueError, match="LLM error"):
+            asyncio.run(collect(router))
+
+    def test_hedges_slow_llm(self, settings):
+        settings.LLM_HEDGE_MIN_SAMPLES = 3
+        for _ in range(3):
+            first_token_latencies.add("model-0", 0.01)
+        slow = FakeChatModel(text="a b", delay=0.3, streamed=[])
+        router = make_router(slow, FakeChatModel(text="c"), hedging=True)
+
+        assert asyncio.run(collect(router)) == ["c"]
+        # The slow LLM was cancelled
+        assert slow.streamed == []
+
+    def test_hedge_delay_rises_with_slow_llm(self, settings):
+        settings.LLM_HEDGE_MIN_SAMPLES = 3
+        for _ in range(3):
+            first_token_latencies.add("model-0", 0.01)
+        router = make_router(
+            FakeChatModel(text="a", delay=1),
+            FakeChatModel(text="c", delay=0.05),
+            hedging=True,
+        )
+
+        for _ in range(3):
+            assert asyncio.run(collect(router)) == ["c"]
+
+        # The slow LLM lost every hedge: the waits of its dropped streams are
+        # sampled, so it is no longer hedged after the fast latencies
+        assert router._get_hedge_delay() >= 0.05  # noqa: PLR2004, SLF001
+
+    def test_timed_out_llm_is_sampled(self):
+        router = make_router(
+            FakeChatModel(text="a", delay=1),
+            FakeChatModel(text="c"),
+            first_token_timeout=0.05,
+        )
+        asyncio.run(collect(router))
+        assert list(first_token_latencies.samples["model-0"]) == [
+            pytest.approx(0.05, abs=0.03),
+        ]
+
+    def test_no_hedging_without_samples(self):
+        router = make_router(
+            FakeChatModel(text="a", delay=0.05),
+            FakeChatModel(text="c"),
+            hedging=True,
+        )
+        assert asyncio.run(collect(router)) == ["a"]
+
+    def test_streams_tokens_of_used_llm_once(self):
+        tokens = []
+
+        class TokenHandler(AsyncCallbackHandler):
+            async def on_llm_new_token(self, token, **kwargs):
+                tokens.append(token)
+
+        router = make_router(FakeChatModel(fail=True), FakeChatModel(text="c d"))
+
+        async def run():
+            async for _ in router.astream(
+                "Hello",
+                config={"callbacks": [TokenHandler()]},
+            ):
+                pass
+
+        asyncio.run(run())
+        assert tokens == ["c", "d"]
+
+    def test_invoke_fails_over(self):
+        router = make_router(FakeChatModel(fail=True), FakeChatModel(text="c"))
+        assert router.invoke("Hello").content == "c"
+        assert asyncio.run(router.ainvoke("Hello")).content == "c"
+
+
+@pytest.mark.django_db
+class TestGetConfigLLMModel:
+    def make_config(self, llm_model):
+        return LLMConfig.objects.create(
+            purpose="story_continuation",
+            model=llm_model,
+            system_prompt="{progress}",
+            is_active=True,
+        )
+
+    def test_without_failover_model(self, settings):
+        settings.FAKE_LLM_REQUEST = False
+        llm_model = LLMModel.objects.create(name="gpt-4o", display_name="GPT-4o")
+
+        llm = get_config_llm_model(self.make_config(llm_model))
+
+        assert not isinstance(llm.bound, FailoverChatModel)
+
+    def test_with_failover_model(self, settings):
+        settings.FAKE_LLM_REQUEST = False
+        failover_model = LLMModel.objects.create(
+            name="claude-sonnet-4-5",
+            display_name="Claude",
+            llm_type="anthropic",
+        )
+        llm_model = LLMModel.objects.create(
+            name="gpt-4o",
+            display_name="GPT-4o",
+            failover_model=failover_model,
+        )
+
+        llm = get_config_llm_model(self.make_config(llm_model))
+
+        assert isinstance(llm.bound, FailoverChatModel)
+        assert llm.bound.model_names == ["gpt-4o", "claude-sonnet-4-5"]
+        assert llm.config["metadata"] == {"purpose": "story_continuation"}
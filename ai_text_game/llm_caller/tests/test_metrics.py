@@ -0,0 +1,123 @@
+import asyncio
+
+import pytest
+from django.urls import reverse
+
+from ai_text_game.llm_caller.metrics import Histogram
+from ai_text_game.llm_caller.metrics import database_sync_to_async
+from ai_text_game.llm_caller.metrics import db_queue_seconds
+from ai_text_game.llm_caller.metrics import span
+from ai_text_game.llm_caller.metrics import stage_seconds
+from ai_text_game.llm_caller.metrics import timed_handler
+
+
+@pytest.fixture(autouse=True)
+def _clear_histograms():
+    stage_seconds.clear()
+    db_queue_seconds.clear()
+
+
+@pytest.fixture
+def _metrics_enabled(settings):
+    settings.GAME_METRICS_ENABLED = True
+
+
+def get_count(histogram, label_values):
+    return histogram.collect()[label_values][2]
+
+
+@pytest.fixture
+def histogram():
+    histogram = Histogram("test_seconds", "Test.", ("stage",), buckets=(0.1, 1))
+    histogram.clear()
+    yield histogram
+    histogram.clear()
+
+
+def test_histogram_render(histogram):
+    histogram.observe(("llm",), 0.05)
+    histogram.observe(("llm",), 0.5)
+    histogram.observe(("llm",), 5)
+
+    assert histogram.render().splitlines() == [
+        "# HELP test_seconds Test.",
+        "# TYPE test_seconds histogram",
+        'test_seconds_bucket{stage="llm",le="0.1"} 1',
+        'test_seconds_bucket{stage="llm",le="1"} 2',
+        'test_seconds_bucket{stage="llm",le="+Inf"} 3',
+        'test_seconds_sum{stage="llm"} 5.55',
+        'test_seconds_count{stage="llm"} 3',
+    ]
+
+
+def test_histogram_totals_of_all_processes(histogram):
+    # The same histogram in another process
+    other_histogram = Histogram("test_seconds", "Test.", ("stage",), buckets=(0.1, 1))
+    histogram.observe(("llm",), 0.05)
+    other_histogram.observe(("llm",), 0.5)
+    other_histogram.observe(("save",), 0.5)
+    other_histogram.flush()
+
+    totals = histogram.collect()
+
+    assert totals[("llm",)] == [[1, 1, 0], pytest.approx(0.55), 2]
+    assert totals[("save",)][2] == 1
+    # Rendering again does not count the observations twice
+    assert histogram.collect() == totals
+
+
+def test_span_disabled(settings):
+    settings.GAME_METRICS_ENABLED = False
+
+    with span("get_story", handler="interaction"):
+        pass
+
+    assert not stage_seconds.series
+
+
+@pytest.mark.usefixtures("_metrics_enabled")
+class TestSpans:
+    def test_stages_are_labelled_with_handler(self):
+        @timed_handler("interaction")
+        async def handle():
+            with span("get_story"):
+                await asyncio.sleep(0)
+
+        asyncio.run(handle())
+
+        assert get_count(stage_seconds, ("interaction", "total")) == 1
+        assert get_count(stage_seconds, ("interaction", "get_story")) == 1
+
+    @pytest.mark.django_db
+    def test_times_database_queue(self):
+        @database_sync_to_async
+        def get_story():
+            return "story"
+
+        async def handle():
+            with span("get_story", handler="start_story"):
+                return await get_story()
+
+        assert asyncio.run(handle()) == "story"
+        assert get_count(db_queue_seconds, ("start_story", "get_story")) == 1
+
+
+@pytest.mark.django_db
+class TestMetricsView:
+    def test_staff_only(self, auth_client):
+        response = auth_client.get(reverse("metrics"))
+        assert response.status_code == 403  # noqa: PLR2004
+
+    @pytest.mark.usefixtures("_metrics_enabled")
+    def test_renders_histograms(self, admin_client):
+        with span("get_story", handler="start_story"):
+            pass
+
+        response = admin_client.get(reverse("metrics"))
+
+        assert response.status_code == 200  # noqa: PLR2004
+        assert response["Content-Type"].startswith("text/plain")
+        assert (
+            "game_consumer_stage_seconds_count"
+            '{handler="start_story",stage="get_story"} 1'
+        ) in response.content.decode()
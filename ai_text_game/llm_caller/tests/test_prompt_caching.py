@@ -0,0 +1,116 @@
+import logging
+
+from langchain_anthropic import ChatAnthropic
+from langchain_core.messages import AIMessage
+from langchain_core.outputs import ChatGeneration
+from langchain_core.outputs import LLMResult
+from langchain_core.prompts import ChatPromptTemplate
+
+from ai_text_game.llm_caller.prompt_caching import CACHE_BREAKPOINT
+from ai_text_game.llm_caller.prompt_caching import CACHE_CONTROL
+from ai_text_game.llm_caller.prompt_caching import PromptCacheCallbackHandler
+from ai_text_game.llm_caller.prompt_caching import create_prompt_template
+from ai_text_game.llm_caller.prompt_caching import get_token_usage
+from ai_text_game.llm_caller.prompt_caching import join_text_blocks
+from ai_text_game.llm_caller.utils import read_prompt_template
+
+PARAMS = {
+    "skeleton": "The skeleton",
+    "progress": "The progress",
+    "milestone": "The milestone",
+    "decision_point": "The decision point",
+    "decisions_made": "(NONE YET)",
+    "cefr_level": "B1",
+}
+
+
+def make_result(**usage_metadata):
+    message = AIMessage(
+        "Hello",
+        usage_metadata={
+            "input_tokens": 0,
+            "output_tokens": 0,
+            "total_tokens": 0,
+            **usage_metadata,
+        },
+    )
+    return LLMResult(generations=[[ChatGeneration(message=message)]])
+
+
+class TestCreatePromptTemplate:
+    def test_without_breakpoint(self):
+        prompt = create_prompt_template("Write about {skeleton}")
+        messages = prompt.invoke(PARAMS).to_messages()
+        assert messages[0].content == "Write about The skeleton"
+
+    def test_marks_prefix_for_caching(self):
+        prompt = create_prompt_template(
+            f"Write about {{skeleton}}\n{CACHE_BREAKPOINT}\nafter {{progress}}",
+        )
+        messages = prompt.invoke(PARAMS).to_messages()
+
+        assert messages[0].content == [
+            {
+                "type": "text",
+                "text": "Write about The skeleton\n",
+                "cache_control": CACHE_CONTROL,
+            },
+            {"type": "text", "text": "\nafter The progress"},
+        ]
+
+    def test_cache_control_reaches_anthropic_request(self):
+        prompt = create_prompt_template(
+            f"Write about {{skeleton}}\n{CACHE_BREAKPOINT}\nafter {{progress}}",
+        )
+        llm = ChatAnthropic(model="claude-sonnet-4-5", api_key="sk-test")
+
+        payload = llm._get_request_payload(prompt.invoke(PARAMS))  # noqa: SLF001
+
+        assert payload["messages"][0]["content"][0]["cache_control"] == CACHE_CONTROL
+
+    def test_joined_blocks_match_prompt_without_breakpoint(self):
+        for template_filename in [
+            "story_continuation_prompt.txt",
+            "story_ending_prompt.txt",
+        ]:
+            template = read_prompt_template(template_filename)
+            assert CACHE_BREAKPOINT in template
+
+            prompt_value = create_prompt_template(template).invoke(PARAMS)
+            expected = ChatPromptTemplate.from_template(
+                template.replace(CACHE_BREAKPOINT, ""),
+            ).invoke(PARAMS)
+
+            assert join_text_blocks(prompt_value) == expected.to_messages()
+
+
+class TestTokenUsage:
+    def test_get_token_usage(self):
+        result = make_result(
+            input_tokens=1200,
+            output_tokens=200,
+            input_token_details={"cache_read": 1024, "cache_creation": 0},
+        )
+
+        assert get_token_usage(result) == {
+            "input_tokens": 1200,
+            "output_tokens": 200,
+            "cache_read_tokens": 1024,
+            "cache_creation_tokens": 0,
+        }
+
+    def test_without_usage(self):
+        result = LLMResult(generations=[[ChatGeneration(message=AIMessage("Hi"))]])
+        assert get_token_usage(result)["input_tokens"] == 0
+
+    def test_handler_logs_cached_tokens(self, caplog):
+        handler = PromptCacheCallbackHandler("claude-sonnet-4-5")
+        with caplog.at_level(logging.INFO):
+            handler.on_llm_end(
+                make_result(
+                    input_tokens=1200,
+                    input_token_details={"cache_read": 1024},
+                ),
+            )
+
+        assert "1024 read from cache" in caplog.text
@@ -0,0 +1,84 @@
+import pytest
+from django.core.cache import cache
+from django.utils import timezone
+
+from ai_text_game.llm_caller.models import DailyUsage
+from ai_text_game.llm_caller.models import LLMModel
+from ai_text_game.llm_caller.quotas import get_usage_key
+from ai_text_game.llm_caller.quotas import get_used_quota
+from ai_text_game.llm_caller.quotas import reconcile_usage
+from ai_text_game.llm_caller.quotas import record_usage
+
+pytestmark = pytest.mark.django_db
+
+
+@pytest.fixture(autouse=True)
+def _clear_cache():
+    cache.clear()
+
+
+class TestRecordUsage:
+    def test_counts_per_user_and_model(self, user):
+        assert record_usage(user.id, "gpt-4o") == 1
+        assert record_usage(user.id, "gpt-4o") == 2  # noqa: PLR2004
+        record_usage(user.id, "gpt-4o-mini")
+
+        assert get_used_quota(user.id, "gpt-4o") == 2  # noqa: PLR2004
+        assert get_used_quota(user.id, "gpt-4o-mini") == 1
+        assert get_used_quota(user.id + 1, "gpt-4o") == 0
+
+    def test_creates_row_on_first_request(self, user):
+        record_usage(user.id, "gpt-4o")
+        record_usage(user.id, "gpt-4o")
+
+        usage = DailyUsage.objects.get(user=user)
+        assert usage.model_name == "gpt-4o"
+        assert usage.date == timezone.localdate()
+        # The count is stored by the reconciliation
+        assert usage.count == 0
+
+    def test_restores_lost_counter(self, user):
+        DailyUsage.objects.create(
+            user=user,
+            model_name="gpt-4o",
+            date=timezone.localdate(),
+            count=5,
+        )
+
+        assert record_usage(user.id, "gpt-4o") == 6  # noqa: PLR2004
+
+    def test_ignores_anonymous_requests(self):
+        assert record_usage(None, "gpt-4o") == 0
+        assert not DailyUsage.objects.exists()
+
+
+class TestReconcileUsage:
+    def test_stores_counters(self, user):
+        for _ in range(3):
+            record_usage(user.id, "gpt-4o")
+
+        assert reconcile_usage() == 1
+        assert DailyUsage.objects.get(user=user).count == 3  # noqa: PLR2004
+
+        # Nothing changed since
+        assert reconcile_usage() == 0
+
+    def test_keeps_higher_stored_count(self, user):
+        usage = DailyUsage.objects.create(
+            user=user,
+            model_name="gpt-4o",
+            date=timezone.localdate(),
+            count=5,
+        )
+        cache.set(get_usage_key(user.id, "gpt-4o", usage.date), 2)
+
+        assert reconcile_usage() == 0
+        usage.refresh_from_db()
+        assert usage.count == 5  # noqa: PLR2004
+
+
+def test_model_used_quota(user):
+    model = LLMModel.objects.create(name="gpt-4o", display_name="GPT-4o")
+    record_usage(user.id, "gpt-4o")
+
+    assert model.get_used_quota(user) == 1
@@ -0,0 +1,130 @@
+import asyncio
+
+import pytest
+from django.core.cache import cache
+from django.urls import reverse
+from rest_framework.authtoken.models import Token
+
+from ai_text_game.llm_caller.caches import scene_set_cache
+from ai_text_game.llm_caller.fake_llms import scenes_json
+from ai_text_game.llm_caller.models import APIKey
+from ai_text_game.llm_caller.models import LLMConfig
+from ai_text_game.llm_caller.models import LLMModel
+
+pytestmark = pytest.mark.django_db
+
+
+async def read_stream(response):
+    return b"".join([chunk async for chunk in response.streaming_content])
+
+
+@pytest.fixture(autouse=True)
+def _scene_settings(settings):
+    settings.FAKE_LLM_REQUEST = True
+    settings.FAKE_LLM_DELAY = 0
+    settings.SCENE_CACHE_VARIANTS = 2
+    cache.clear()
+    model = LLMModel.objects.create(name="gpt-4o", display_name="GPT-4o")
+    APIKey.objects.create(key="sk-test", name="Key", llm_model=model)
+    LLMConfig.objects.create(
+        purpose="scene_generation",
+        model=model,
+        system_prompt="{genre} {details_prompt}",
+        is_active=True,
+    )
+
+
+class TestSceneCache:
+    def test_served_from_cache_once_all_variants_exist(self, auth_client):
+        url = reverse("generate-scenes")
+        for _ in range(3):
+            response = auth_client.post(url, {"genre": "Mystery"}, format="json")
+            assert response.status_code == 200  # noqa: PLR2004
+            assert response.json() == scenes_json
+
+        assert scene_set_cache.stats.get_hit_rate() == {
+            "hits": 1,
+            "misses": 2,
+            "hit_rate": 1 / 3,
+        }
+
+    def test_details_are_part_of_key(self):
+        key = scene_set_cache.make_key("Mystery", "", "v1")
+        assert key == scene_set_cache.make_key(" mystery ", "", "v1")
+        assert key != scene_set_cache.make_key("Mystery", "In Paris", "v1")
+        assert key != scene_set_cache.make_key("Mystery", "", "v2")
+
+    def test_stream_replays_cached_scenes(self, auth_client, settings):
+        settings.SCENE_CACHE_VARIANTS = 1
+        key = scene_set_cache.make_key(
+            "Mystery",
+            "",
+            LLMConfig.get_active_config("scene_generation").prompt_version,
+        )
+        scene_set_cache.add(key, scenes_json)
+
+        response = auth_client.get(
+            reverse("generate-scenes-stream"),
+            {"genre": "Mystery"},
+        )
+        assert response["Content-Type"] == "text/event-stream"
+        body = asyncio.run(read_stream(response)).decode()
+        assert [line for line in body.split("\n") if line.startswith("event:")] == [
+            "event: start",
+            "event: scene",
+            "event: complete",
+        ]
+        assert scene_set_cache.stats.get(["hits"]) == {"hits": 1}
+
+    def test_stats_require_staff(self, auth_client):
+        response = auth_client.get(reverse("cache-stats"))
+        assert response.status_code == 403  # noqa: PLR2004
+
+
+class TestAsyncSceneGeneration:
+    def test_generate(self, client, user):
+        client.force_login(user)
+        response = client.post(
+            reverse("generate-scenes-async"),
+            {"genre": "Mystery"},
+            content_type="application/json",
+        )
+        assert response.status_code == 200  # noqa: PLR2004
+        assert response.json() == scenes_json
+
+    def test_token_authentication(self, client, user):
+        token = Token.objects.create(user=user)
+        response = client.post(
+            reverse("generate-scenes-async"),
+            {"genre": "Mystery"},
+            content_type="application/json",
+            headers={"Authorization": f"Token {token.key}"},
+        )
+        assert response.status_code == 200  # noqa: PLR2004
+
+    def test_requires_authentication(self, client):
+        response = client.post(
+            reverse("generate-scenes-async"),
+            {"genre": "Mystery"},
+            content_type="application/json",
+        )
+        assert response.status_code == 403  # noqa: PLR2004
+
+    def test_requires_genre(self, client, user):
+        client.force_login(user)
+        response = client.post(
+            reverse("generate-scenes-async"),
+            {},
+            content_type="application/json",
+        )
+        assert response.status_code == 400  # noqa: PLR2004
+
+    def test_requires_object_body(self, client, user):
+        client.force_login(user)
+        for body in [[], "Mystery"]:
+            response = client.post(
+                reverse("generate-scenes-async"),
+                body,
+                content_type="application/json",
+            )
+            assert response.status_code == 400  # noqa: PLR2004
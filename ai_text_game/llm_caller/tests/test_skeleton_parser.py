@@ -0,0 +1,33 @@
+import json
+
+from ai_text_game.llm_caller.fake_llms import skeleton_json
+from ai_text_game.llm_caller.skeleton_parser import MilestoneStreamParser
+
+
+def feed_in_chunks(text, size):
+    parser = MilestoneStreamParser()
+    completed = [parser.feed(text[i : i + size]) for i in range(0, len(text), size)]
+    return parser, completed
+
+
+class TestMilestoneStreamParser:
+    def test_emits_each_milestone_once(self):
+        parser, completed = feed_in_chunks(json.dumps(skeleton_json, indent=2), 7)
+        milestones = [m for chunk in completed for m in chunk]
+        assert milestones == skeleton_json["milestones"]
+        assert parser.data == skeleton_json
+
+    def test_milestone_emitted_when_closed(self):
+        parser = MilestoneStreamParser()
+        assert parser.feed('{"story_background": "A town", "milestones": [') == []
+        assert parser.data == {"story_background": "A town"}
+        assert parser.feed('{"milestone_id": "M1", "title": "}"') == []
+        assert parser.feed('}, {"milestone_id": "M2"') == [
+            {"milestone_id": "M1", "title": "}"},
+        ]
+
+    def test_ignores_markdown_fence(self):
+        text = '```json\n{"story_background": "A \\"quiet\\" town"}\n```'
+        parser, _ = feed_in_chunks(text, 3)
+        assert parser.data == {"story_background": 'A "quiet" town'}
+        assert parser.milestones == []
@@ -0,0 +1,107 @@
+import uuid
+
+import pytest
+
+from ai_text_game.llm_caller.fake_llms import scenes_json
+from ai_text_game.llm_caller.fake_llms import skeleton_json
+from ai_text_game.llm_caller.models import APIKey
+from ai_text_game.llm_caller.models import GameScenario
+from ai_text_game.llm_caller.models import GameStory
+from ai_text_game.llm_caller.models import LLMConfig
+from ai_text_game.llm_caller.models import LLMModel
+from ai_text_game.llm_caller.models import PooledSkeleton
+from ai_text_game.llm_caller.tasks import refill_skeleton_pool
+
+pytestmark = pytest.mark.django_db
+
+
+@pytest.fixture(autouse=True)
+def _pool_settings(settings):
+    settings.FAKE_LLM_REQUEST = True
+    settings.FAKE_LLM_DELAY = 0
+    settings.CELERY_TASK_ALWAYS_EAGER = True
+    settings.SKELETON_POOL_SIZE = 1
+
+
+@pytest.fixture
+def configs():
+    model = LLMModel.objects.create(name="gpt-4o", display_name="GPT-4o")
+    APIKey.objects.create(key="sk-test", name="Key", llm_model=model)
+    for purpose in ["scene_generation", "story_skeleton_generation"]:
+        LLMConfig.objects.create(
+            purpose=purpose,
+            model=model,
+            system_prompt="{genre}" if purpose == "scene_generation" else "{theme}",
+            is_active=True,
+        )
+
+
+def make_scene_set(prompt_version, genre="Mystery"):
+    scene_set = uuid.uuid4()
+    for scene in scenes_json["scenes"]:
+        PooledSkeleton.objects.create(
+            scene_set=scene_set,
+            genre=genre,
+            cefr_level=scene["level"],
+            scene_text=scene["text"],
+            prompt_version=prompt_version,
+            raw_data=skeleton_json,
+        )
+
+
+def test_refill(configs):
+    GameScenario.objects.create(name="Mystery")
+
+    refill_skeleton_pool.delay()
+    refill_skeleton_pool.delay()
+
+    entries = PooledSkeleton.objects.filter(genre="Mystery")
+    assert {e.cefr_level for e in entries} == {"A1", "A2", "B1", "B2", "C1", "C2"}
+    assert {e.prompt_version for e in entries} == {PooledSkeleton.get_prompt_version()}
+    assert entries[0].raw_data == skeleton_json
+
+
+def test_refill_demo_pool(configs):
+    GameScenario.objects.create(name="Mystery")
+    LLMConfig.objects.create(
+        purpose="scene_generation_demo",
+        model=LLMModel.objects.get(),
+        system_prompt="Demo {genre}",
+        is_active=True,
+    )
+
+    refill_skeleton_pool.delay()
+
+    prompt_versions = {
+        PooledSkeleton.get_prompt_version(),
+        PooledSkeleton.get_prompt_version(is_demo=True),
+    }
+    assert len(prompt_versions) == 2  # noqa: PLR2004
+    assert (
+        set(PooledSkeleton.objects.values_list("prompt_version", flat=True))
+        == prompt_versions
+    )
+
+
+def test_take_scene_set_once(configs):
+    make_scene_set("v1")
+    assert PooledSkeleton.take_scene_set("Mystery", "v1") == scenes_json["scenes"]
+    assert PooledSkeleton.take_scene_set("Mystery", "v1") is None
+    assert PooledSkeleton.take_scene_set("Sci-Fi", "v1") is None
+
+
+def test_claim(user):
+    make_scene_set("v1")
+    story = GameStory.objects.create(
+        genre="Mystery",
+        cefr_level="B1",
+        scene_text="A test scene in B1",
+        created_by=user,
+    )
+
+    assert PooledSkeleton.claim(story, "v2") is None
+    skeleton = PooledSkeleton.claim(story, "v1")
+    assert skeleton.status == "COMPLETED"
+    assert skeleton.raw_data == skeleton_json
+    assert PooledSkeleton.claim(story, "v1") is None
+    assert PooledSkeleton.objects.count() == len(scenes_json["scenes"]) - 1
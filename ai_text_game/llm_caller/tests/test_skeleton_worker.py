@@ -0,0 +1,61 @@
+import asyncio
+
+import pytest
+from channels.layers import get_channel_layer
+
+from ai_text_game.llm_caller.fake_llms import skeleton_json
+from ai_text_game.llm_caller.models import APIKey
+from ai_text_game.llm_caller.models import GameStory
+from ai_text_game.llm_caller.models import LLMConfig
+from ai_text_game.llm_caller.models import LLMModel
+from ai_text_game.llm_caller.models import StorySkeleton
+from ai_text_game.llm_caller.skeleton_worker import generate_story_skeleton_async
+
+pytestmark = pytest.mark.django_db(transaction=True)
+
+
+@pytest.fixture(autouse=True)
+def _fake_llm(settings):
+    settings.FAKE_LLM_REQUEST = True
+    settings.FAKE_LLM_DELAY = 0
+    settings.CHANNEL_LAYERS = {
+        "default": {"BACKEND": "channels.layers.InMemoryChannelLayer"},
+    }
+
+
+def test_generate_story_skeleton_async(user):
+    model = LLMModel.objects.create(name="gpt-4o", display_name="GPT-4o")
+    APIKey.objects.create(key="sk-test", name="Key", llm_model=model)
+    LLMConfig.objects.create(
+        purpose="story_skeleton_generation",
+        model=model,
+        system_prompt="{theme}",
+        is_active=True,
+    )
+    stories = [
+        GameStory.objects.create(genre="Mystery", created_by=user) for _ in range(3)
+    ]
+
+    async def run():
+        channel_layer = get_channel_layer()
+        channel_name = await channel_layer.new_channel()
+        await channel_layer.group_add(f"game_{stories[0].id}", channel_name)
+        await asyncio.gather(
+            *[
+                generate_story_skeleton_async(story.id, {"theme": "Mystery"})
+                for story in stories
+            ],
+        )
+        return [
+            (await channel_layer.receive(channel_name))["type"]
+            for _ in range(len(skeleton_json["milestones"]) + 1)
+        ]
+
+    event_types = asyncio.run(run())
+
+    assert event_types[-1] == "skeleton_generation_completed"
+    assert set(event_types[:-1]) == {"skeleton_generation_progress"}
+    for story in stories:
+        skeleton = StorySkeleton.objects.get(story=story)
+        assert skeleton.status == "COMPLETED"
+        assert skeleton.raw_data == skeleton_json
@@ -0,0 +1,146 @@
+import asyncio
+
+import pytest
+
+from ai_text_game.llm_caller.speculation import SpeculativeContinuations
+from ai_text_game.llm_caller.speculation import get_speculative_state
+from ai_text_game.llm_caller.speculation import reserve_speculation_budget
+
+from .test_story_graph import make_state
+from .test_story_graph import make_story_graph
+
+
+@pytest.fixture(autouse=True)
+def _speculation_settings(settings):
+    settings.FAKE_LLM_DELAY = 0
+    settings.STORY_SPECULATIVE_TOP_K = 0
+    settings.STORY_SPECULATIVE_DAILY_LIMITS = {"*": 100}
+
+
+def make_generated_state(**kwargs):
+    return make_state(
+        current_decision_point="M1.D1",
+        story_progress=[],
+        chosen_decisions=[],
+        story_text="Joe is missing.",
+        **kwargs,
+    )
+
+
+class TestSpeculativeState:
+    def test_next_decision_point(self):
+        state = get_speculative_state(make_generated_state(), "M1.D1.O2", "COMPLETED")
+        assert state["current_decision_point"] == "M2.D1"
+        assert state["chosen_decisions"] == ["M1.D1.O2"]
+        assert state["story_progress"] == [
+            {"content": "Joe is missing.", "summary": ""},
+        ]
+
+    def test_ending_needs_completed_skeleton(self):
+        state = make_generated_state()
+        state["current_decision_point"] = "M2.D1"
+        assert get_speculative_state(state, "M2.D1.O1", "IN_PROGRESS") is None
+        assert (
+            get_speculative_state(state, "M2.D1.O1", "COMPLETED")[
+                "current_decision_point"
+            ]
+            == ""
+        )
+
+
+def test_daily_limit(settings):
+    settings.STORY_SPECULATIVE_DAILY_LIMITS = {"limited-model": 1}
+    assert reserve_speculation_budget("limited-model")
+    assert not reserve_speculation_budget("limited-model")
+    assert not reserve_speculation_budget("unknown-model")
+
+
+class TestSpeculativeContinuations:
+    def test_take_matching_path(self):
+        state = make_generated_state()
+        options = [{"option_id": "M1.D1.O1"}, {"option_id": "M1.D1.O2"}]
+
+        async def run():
+            speculation = SpeculativeContinuations(make_story_graph())
+            speculation.start(state, options, "COMPLETED")
+            assert len(speculation.tasks) == 2  # noqa: PLR2004
+            next_state = get_speculative_state(state, "M1.D1.O2", "COMPLETED")
+            del next_state["story_text"]
+            result = await speculation.take(next_state)
+            assert speculation.tasks == {}
+            return result
+
+        result = asyncio.run(run())
+        assert result["story_text"] == "This is a continuation of the story"
+        assert result["chosen_decisions"] == ["M1.D1.O2"]
+
+    def test_take_other_path(self):
+        state = make_generated_state()
+
+        async def run():
+            speculation = SpeculativeContinuations(make_story_graph())
+            speculation.start(state, [{"option_id": "M1.D1.O1"}], "COMPLETED")
+            next_state = get_speculative_state(state, "M1.D1.O2", "COMPLETED")
+            return await speculation.take(next_state)
+
+        assert asyncio.run(run()) is None
+
+    def test_top_k(self, settings):
+        settings.STORY_SPECULATIVE_TOP_K = 1
+        state = make_generated_state()
+        options = [{"option_id": "M1.D1.O1"}, {"option_id": "M1.D1.O2"}]
+
+        async def run():
+            speculation = SpeculativeContinuations(make_story_graph())
+            speculation.start(state, options, "COMPLETED")
+            paths = list(speculation.tasks)
+            speculation.cancel()
+            return paths
+
+        assert asyncio.run(run()) == [("M1.D1.O1",)]
+
+    def test_take_cancelled_generation(self):
+        state = make_generated_state()
+
+        async def run():
+            speculation = SpeculativeContinuations(make_story_graph())
+            speculation.start(state, [{"option_id": "M1.D1.O1"}], "COMPLETED")
+            next_state = get_speculative_state(state, "M1.D1.O1", "COMPLETED")
+            speculation.tasks[("M1.D1.O1",)].cancel()
+            return await speculation.take(next_state)
+
+        assert asyncio.run(run()) is None
+
+    def test_take_propagates_cancellation_of_caller(self, settings):
+        settings.FAKE_LLM_DELAY = 1
+        state = make_generated_state()
+
+        async def run():
+            speculation = SpeculativeContinuations(make_story_graph())
+            speculation.start(state, [{"option_id": "M1.D1.O1"}], "COMPLETED")
+            next_state = get_speculative_state(state, "M1.D1.O1", "COMPLETED")
+            take = asyncio.create_task(speculation.take(next_state))
+            await asyncio.sleep(0.01)
+            # e.g. the player disconnected
+            take.cancel()
+            with pytest.raises(asyncio.CancelledError):
+                await take
+
+        asyncio.run(run())
+
+    def test_cancel_retrieves_errors_of_finished_generations(self):
+        async def fail():
+            msg = "LLM error"
+            raise ValueError(msg)
+
+        async def run():
+            speculation = SpeculativeContinuations(make_story_graph())
+            task = asyncio.create_task(fail())
+            speculation.tasks[("M1.D1.O1",)] = task
+            await asyncio.sleep(0)
+            speculation.cancel()
+            await asyncio.sleep(0)
+            return task
+
+        task = asyncio.run(run())
+        assert task._log_traceback is False  # noqa: SLF001
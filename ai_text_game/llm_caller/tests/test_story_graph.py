@@ -0,0 +1,189 @@
+import asyncio
+import copy
+
+from langchain_core.prompts import ChatPromptTemplate
+
+from ai_text_game.llm_caller.fake_llms import get_fake_llm_model
+from ai_text_game.llm_caller.fake_llms import skeleton_json
+from ai_text_game.llm_caller.story_graph import ProgressContext
+from ai_text_game.llm_caller.story_graph import SkeletonIndex
+from ai_text_game.llm_caller.story_graph import StoryGraph
+from ai_text_game.llm_caller.story_graph import format_progress_with_decisions
+
+
+def make_state(**kwargs):
+    state = {
+        "story_skeleton": skeleton_json,
+        "current_decision_point": "M2.D1",
+        "story_progress": [
+            {"content": "Joe is missing.", "summary": ""},
+        ],
+        "chosen_decisions": ["M1.D1.O1"],
+        "cefr_level": "B1",
+        "status": "IN_PROGRESS",
+    }
+    state.update(kwargs)
+    return state
+
+
+def make_story_graph():
+    prompt = ChatPromptTemplate.from_template("{progress}")
+    return StoryGraph(
+        {
+            name: prompt | get_fake_llm_model(name)
+            for name in ["continuation", "ending"]
+        },
+    )
+
+
+class TestSkeletonIndex:
+    def test_lookups(self):
+        index = SkeletonIndex.for_skeleton(skeleton_json)
+        assert index.decision_points == ["M1.D1", "M2.D1"]
+        assert index.option_by_id["M2.D1.O2"]["option_name"] == (
+            "No, inform the sheriff."
+        )
+        assert index.decision_point_id_by_option_id["M1.D1.O1"] == "M1.D1"
+        assert [o["option_id"] for o in index.get_options("M1.D1")] == [
+            "M1.D1.O1",
+            "M1.D1.O2",
+        ]
+        assert index.get_options("M9.D1") == []
+
+    def test_next_decision_point(self):
+        index = SkeletonIndex.for_skeleton(skeleton_json)
+        assert index.get_next_decision_point("M1.D1") == "M2.D1"
+        assert index.get_next_decision_point("M2.D1") == ""
+
+    def test_index_is_cached_per_skeleton(self):
+        assert SkeletonIndex.for_skeleton(skeleton_json) is SkeletonIndex.for_skeleton(
+            skeleton_json,
+        )
+
+    def test_index_is_rebuilt_when_milestones_are_added(self):
+        skeleton = copy.deepcopy(skeleton_json)
+        skeleton["milestones"] = skeleton["milestones"][:1]
+        index = SkeletonIndex.for_skeleton(skeleton)
+        assert index.get_next_decision_point("M1.D1") == ""
+
+        skeleton["milestones"].append(copy.deepcopy(skeleton_json["milestones"][1]))
+        index = SkeletonIndex.for_skeleton(skeleton)
+        assert index.get_next_decision_point("M1.D1") == "M2.D1"
+
+    def test_partial_skeleton(self):
+        skeleton = {
+            "story_background": "",
+            "milestones": [{"milestone_id": "M1", "decision_points": [{}]}],
+        }
+        index = SkeletonIndex.for_skeleton(skeleton)
+        assert index.decision_points == []
+
+
+class TestProgressContext:
+    def test_format(self):
+        assert format_progress_with_decisions(make_state()) == (
+            "Joe is missing.\n\n[Choice made: Yes, head to the docks.]\n"
+        )
+        assert format_progress_with_decisions(make_state(story_progress=[])) == ""
+
+    def test_incremental_update(self):
+        progress_context = ProgressContext()
+        progress_context.update(make_state())
+
+        state = make_state(
+            story_progress=[
+                {"content": "Joe is missing.", "summary": "Joe went missing."},
+                {"content": "A meeting is held.", "summary": ""},
+            ],
+        )
+        assert progress_context.update(state) == format_progress_with_decisions(state)
+        assert progress_context.update(state).startswith("Joe went missing.")
+
+    def test_appends_new_entries(self):
+        progress_context = ProgressContext()
+        state = make_state(
+            story_progress=[
+                {"content": "Joe is missing.", "summary": "Joe went missing."},
+            ],
+        )
+        text = progress_context.update(state)
+
+        state["story_progress"].append({"content": "A meeting is held."})
+        assert (
+            progress_context.update(state)
+            == f"{text}A meeting is held.\n"
+            == format_progress_with_decisions(state)
+        )
+
+    def test_rebuilds_changed_entries(self):
+        progress_context = ProgressContext()
+        state = make_state(
+            story_progress=[
+                {"content": "Joe is missing.", "summary": ""},
+                {"content": "A meeting is held.", "summary": ""},
+            ],
+        )
+        progress_context.update(state)
+
+        # A summary of an earlier entry arrives later
+        state["story_progress"][0]["summary"] = "Joe went missing."
+        assert progress_context.update(state) == format_progress_with_decisions(state)
+
+        # The decision of the last entry is made, then reverted
+        state["chosen_decisions"] = ["M1.D1.O1", "M2.D1.O2"]
+        assert progress_context.update(state) == format_progress_with_decisions(state)
+        state["chosen_decisions"] = ["M1.D1.O1"]
+        assert progress_context.update(state) == format_progress_with_decisions(state)
+
+
+class TestStoryGraph:
+    def test_generate_story_delta(self, settings):
+        settings.FAKE_LLM_DELAY = 0
+        story_graph = make_story_graph()
+
+        async def run():
+            return await story_graph.graph.ainvoke(
+                make_state(),
+                {"configurable": {"thread_id": "1"}},
+            )
+
+        state = asyncio.run(run())
+        assert state["story_text"] == "This is a continuation of the story"
+        assert state["status"] == "IN_PROGRESS"
+        assert "1" in story_graph.progress_contexts
+
+    def test_generate_story_ending(self, settings):
+        settings.FAKE_LLM_DELAY = 0
+        story_graph = make_story_graph()
+
+        async def run():
+            return await story_graph.graph.ainvoke(
+                make_state(current_decision_point=""),
+                {"configurable": {"thread_id": "1"}},
+            )
+
+        state = asyncio.run(run())
+        assert state["story_text"] == "This is the ending of the story."
+        assert state["status"] == "COMPLETED"
+
+    def test_run_turn_matches_graph(self, settings):
+        settings.FAKE_LLM_DELAY = 0
+        story_graph = make_story_graph()
+        chunks = []
+
+        async def on_text(chunk):
+            chunks.append(chunk)
+
+        async def run(state):
+            config = {"configurable": {"thread_id": "1"}}
+            return (
+                await story_graph.arun_turn(state, config, on_text=on_text),
+                await story_graph.graph.ainvoke(state, config),
+            )
+
+        for state in [make_state(), make_state(current_decision_point="")]:
+            chunks.clear()
+            direct_state, graph_state = asyncio.run(run(state))
+            assert direct_state == graph_state
+            assert "".join(chunks) == direct_state["story_text"]
+            assert len(chunks) > 1
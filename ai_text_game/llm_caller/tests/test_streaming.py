@@ -0,0 +1,42 @@
+import asyncio
+
+from ai_text_game.llm_caller.streaming import StreamBuffer
+
+
+def run_stream(chunks, delay=0, **kwargs):
+    frames = []
+
+    async def send_content(content):
+        frames.append(content)
+
+    async def run():
+        async with StreamBuffer(send_content, **kwargs) as buffer:
+            for chunk in chunks:
+                await buffer.add(chunk)
+                await asyncio.sleep(delay)
+
+    asyncio.run(run())
+    return frames
+
+
+class TestStreamBuffer:
+    def test_flush_on_size(self):
+        frames = run_stream(["ab", "cd", "ef", "g"], flush_chars=4, flush_interval_ms=0)
+        assert frames == ["abcd", "efg"]
+
+    def test_flush_every_chunk(self):
+        frames = run_stream(["ab", "", "cd"], flush_chars=0, flush_interval_ms=0)
+        assert frames == ["ab", "cd"]
+
+    def test_flush_on_interval(self):
+        frames = run_stream(
+            ["ab", "cd"],
+            delay=0.05,
+            flush_chars=100,
+            flush_interval_ms=10,
+        )
+        assert frames == ["ab", "cd"]
+
+    def test_flush_at_end(self):
+        frames = run_stream(["ab", "cd"], flush_chars=100, flush_interval_ms=1000)
+        assert frames == ["abcd"]
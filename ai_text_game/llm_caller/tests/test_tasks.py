@@ -0,0 +1,84 @@
+import pytest
+
+from ai_text_game.llm_caller.fake_llms import skeleton_json
+from ai_text_game.llm_caller.models import APIKey
+from ai_text_game.llm_caller.models import GameStory
+from ai_text_game.llm_caller.models import LLMConfig
+from ai_text_game.llm_caller.models import LLMModel
+from ai_text_game.llm_caller.models import StoryProgress
+from ai_text_game.llm_caller.models import StorySkeleton
+from ai_text_game.llm_caller.tasks import generate_story_skeleton
+from ai_text_game.llm_caller.tasks import summarize_story_progress
+
+pytestmark = pytest.mark.django_db
+
+
+@pytest.fixture(autouse=True)
+def _fake_llm(settings):
+    settings.FAKE_LLM_REQUEST = True
+    settings.FAKE_LLM_DELAY = 0
+    settings.CELERY_TASK_ALWAYS_EAGER = True
+
+
+@pytest.fixture
+def llm_model():
+    model = LLMModel.objects.create(name="gpt-4o", display_name="GPT-4o")
+    APIKey.objects.create(key="sk-test", name="Key", llm_model=model)
+    return model
+
+
+@pytest.fixture
+def story(user):
+    story = GameStory.objects.create(
+        genre="Mystery",
+        title="A Mystery Story",
+        created_by=user,
+        status="IN_PROGRESS",
+    )
+    StorySkeleton.objects.create(
+        story=story,
+        raw_data=skeleton_json,
+        status="COMPLETED",
+    )
+    return story
+
+
+def test_summarize_story_progress(story, llm_model):
+    LLMConfig.objects.create(
+        purpose="story_summary",
+        model=llm_model,
+        system_prompt="{story_segment} {player_decision} {cefr_level}",
+        is_active=True,
+    )
+    progress = StoryProgress.objects.create(
+        story=story,
+        content="Joe is missing.",
+        decision_point_id="M1.D1",
+        chosen_option_id="M1.D1.O1",
+        chosen_option_text="Yes, head to the docks.",
+    )
+
+    summarize_story_progress.delay(progress.id)
+
+    progress.refresh_from_db()
+    assert progress.summary == "This is a summary of the story."
+
+
+def test_generate_story_skeleton(user, llm_model, settings):
+    settings.CHANNEL_LAYERS = {
+        "default": {"BACKEND": "channels.layers.InMemoryChannelLayer"},
+    }
+    LLMConfig.objects.create(
+        purpose="story_skeleton_generation",
+        model=llm_model,
+        system_prompt="{theme}",
+        is_active=True,
+    )
+    story = GameStory.objects.create(genre="Mystery", created_by=user)
+
+    generate_story_skeleton.delay(story.id, {"theme": "Mystery"})
+
+    skeleton = StorySkeleton.objects.get(story=story)
+    assert skeleton.status == "COMPLETED"
+    assert skeleton.raw_data == skeleton_json
+    assert skeleton.background == skeleton_json["story_background"]
@@ -0,0 +1,47 @@
+import pytest
+
+from ai_text_game.llm_caller.models import APIKey
+from ai_text_game.llm_caller.utils import clear_llm_model_pool
+from ai_text_game.llm_caller.utils import get_llm_model
+
+pytestmark = pytest.mark.django_db
+
+
+@pytest.fixture(autouse=True)
+def _empty_llm_model_pool():
+    clear_llm_model_pool()
+    yield
+    clear_llm_model_pool()
+
+
+def make_config(**kwargs):
+    config = {
+        "llm_type": "openai",
+        "model_name": "gpt-4o-mini",
+        "url": "",
+        "temperature": 0.7,
+        "key": APIKey(key="sk-test", name="Test Key", llm_type="openai"),
+    }
+    config.update(kwargs)
+    return config
+
+
+class TestLLMModelPool:
+    def test_reuses_client_for_same_config(self):
+        assert get_llm_model(make_config()) is get_llm_model(make_config())
+
+    def test_different_temperature_creates_new_client(self):
+        llm = get_llm_model(make_config())
+        assert get_llm_model(make_config(temperature=0.1)) is not llm
+
+    def test_pool_is_bounded(self, settings):
+        settings.LLM_MODEL_POOL_SIZE = 2
+        first = get_llm_model(make_config(temperature=0.1))
+        get_llm_model(make_config(temperature=0.2))
+        get_llm_model(make_config(temperature=0.3))
+        assert get_llm_model(make_config(temperature=0.1)) is not first
+
+    def test_api_key_change_evicts_pool(self):
+        llm = get_llm_model(make_config())
+        APIKey.objects.create(key="sk-other", name="Other Key", llm_type="openai")
+        assert get_llm_model(make_config()) is not llm
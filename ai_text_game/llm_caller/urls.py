@@ -3,10 +3,13 @@ from django.urls import path
 from rest_framework.routers import DefaultRouter
 
 from .views import ActiveModelsView
+from .views import AsyncGameSceneGeneratorView
+from .views import CacheStatsView
 from .views import GameScenarioViewSet
 from .views import GameSceneGeneratorStreamView
 from .views import GameSceneGeneratorView
 from .views import GameStoryViewSet
+from .views import MetricsView
 
 router = DefaultRouter()
 router.register(r"game-scenarios", GameScenarioViewSet, basename="game-scenario")
@@ -16,9 +19,16 @@ urlpatterns = [
     path("", include(router.urls)),
     path("llm-models/", ActiveModelsView.as_view(), name="active-models"),
     path("generate-scenes/", GameSceneGeneratorView.as_view(), name="generate-scenes"),
+    path(
+        "generate-scenes-async/",
+        AsyncGameSceneGeneratorView.as_view(),
+        name="generate-scenes-async",
+    ),
     path(
         "generate-scenes-stream/",
         GameSceneGeneratorStreamView.as_view(),
         name="generate-scenes-stream",
     ),
+    path("cache-stats/", CacheStatsView.as_view(), name="cache-stats"),
+    path("metrics/", MetricsView.as_view(), name="metrics"),
 ]
@@ -1,20 +1,31 @@
 import re
+import threading
+from collections import OrderedDict
 from datetime import timedelta
 from io import BytesIO
 from pathlib import Path
 
 import pandas as pd
+from asgiref.sync import sync_to_async
 from django.conf import settings
 from django.http import HttpResponse
 from django.utils import timezone
 from langchain_anthropic import ChatAnthropic
 from langchain_core.messages import AIMessage
+from langchain_core.runnables import Runnable
+from langchain_core.runnables import RunnableLambda
 from langchain_deepseek import ChatDeepSeek
 from langchain_groq import ChatGroq
 from langchain_openai import ChatOpenAI
 from openpyxl.cell.cell import ILLEGAL_CHARACTERS_RE
 
+from .call_logs import LLMCallLogHandler
 from .fake_llms import get_fake_llm_model
+from .key_scheduler import RateLimitCallbackHandler
+from .key_scheduler import key_scheduler
+from .metrics import database_sync_to_async
+from .prompt_caching import PromptCacheCallbackHandler
+from .prompt_caching import join_text_blocks
 
 
 def get_today_date_range():
@@ -41,6 +52,12 @@ def read_prompt_template(template_filename):
         raise FileNotFoundError(msg) from e
 
 
+# Process-wide pool of LLM clients, so that the underlying HTTP connection pools
+# (and their keep-alive TLS connections) are reused across requests.
+_llm_model_pool: OrderedDict = OrderedDict()
+_llm_model_pool_lock = threading.Lock()
+
+
 def get_llm_model(config, fake=False, name=None):  # noqa: FBT002
     if fake:
         return get_fake_llm_model(name)
@@ -54,12 +71,72 @@ def get_llm_model(config, fake=False, name=None):  # noqa: FBT002
     # OpenAI reasoning models only support temperature of 1
     temperature = 1 if is_fixed_temperature else config.get("temperature", 0.7)
 
+    pool_key = (llm_type, model_name, key.key, url, temperature)
+    with _llm_model_pool_lock:
+        llm = _llm_model_pool.get(pool_key)
+        if llm is not None:
+            _llm_model_pool.move_to_end(pool_key)
+            return llm
+
+    llm = create_llm_model(llm_type, model_name, key, url, temperature)
+    # Cool the key down when the provider rate limits it, and log the calls
+    llm = llm.with_config(
+        callbacks=[
+            RateLimitCallbackHandler(key.id),
+            PromptCacheCallbackHandler(model_name),
+            LLMCallLogHandler(model_name, key.id),
+        ],
+    )
+    if llm_type != "anthropic":
+        # Only Anthropic takes the cache_control markers of the prompts
+        llm = RunnableLambda(join_text_blocks) | llm
+
+    with _llm_model_pool_lock:
+        # Another thread may have created the same client in the meantime
+        llm = _llm_model_pool.setdefault(pool_key, llm)
+        _llm_model_pool.move_to_end(pool_key)
+        while len(_llm_model_pool) > settings.LLM_MODEL_POOL_SIZE:
+            _llm_model_pool.popitem(last=False)
+    return llm
+
+
+def get_keyed_llm_model(config, get_keys, fake=False, name=None):  # noqa: FBT002
+    """Get an LLM that picks the API key of every call among get_keys().
+
+    For long-lived chains (e.g. the shared story graph), so that their calls
+    are spread over the API keys like one-off calls (see KeyScheduler).
+    """
+    if fake:
+        return get_fake_llm_model(name)
+
+    def get_llm_for_keys(keys: list) -> Runnable:
+        return get_llm_model({**config, "key": key_scheduler.acquire(keys)})
+
+    def get_llm(_input) -> Runnable:
+        return get_llm_for_keys(get_keys())
+
+    async def aget_llm(_input) -> Runnable:
+        # The keys may be queried from the database (on a cache miss), so they
+        # are loaded in the thread of the database calls, which manages their
+        # connections. Picking the key (a cache read) and getting the client
+        # make no queries, so they can run in any thread without leaving
+        # database connections open, and never wait behind slow queries.
+        keys = await database_sync_to_async(get_keys)()
+        return await sync_to_async(get_llm_for_keys, thread_sensitive=False)(keys)
+
+    return RunnableLambda(get_llm, afunc=aget_llm, name=name)
+
+
+def create_llm_model(llm_type, model_name, key, url, temperature):
+    """Create a new LLM client, bypassing the pool."""
     llm = None
     if llm_type == "openai":
         llm = ChatOpenAI(
             model=model_name,
             api_key=key.key,
             temperature=temperature,
+            # Report the (cached) token usage of streamed calls
+            stream_usage=True,
         )
     elif llm_type == "anthropic":
         llm = ChatAnthropic(
@@ -98,6 +175,12 @@ def get_llm_model(config, fake=False, name=None):  # noqa: FBT002
     return llm
 
 
+def clear_llm_model_pool():
+    """Drop all pooled LLM clients (e.g. after an API key or model changes)."""
+    with _llm_model_pool_lock:
+        _llm_model_pool.clear()
+
+
 def think_tag_parser(ai_message: AIMessage | str) -> str:
     """Remove the <think> and </think> tags from the AI message."""
     think_tag_pattern = r"<think>(.*<\/think>\s*)?"
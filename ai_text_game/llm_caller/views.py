@@ -1,34 +1,47 @@
 import json
 
 import openai
+from asgiref.sync import sync_to_async
 from django.conf import settings
+from django.db import transaction
+from django.http import HttpResponse
+from django.http import JsonResponse
 from django.http import StreamingHttpResponse
+from django.middleware.csrf import CsrfViewMiddleware
 from django.utils.decorators import method_decorator
+from django.views import View
 from django.views.decorators.csrf import csrf_exempt
 from langchain_core.output_parsers import JsonOutputParser
-from langchain_core.prompts import ChatPromptTemplate
 from rest_framework import status
 from rest_framework import viewsets
+from rest_framework.authtoken.models import Token
 from rest_framework.decorators import action
 from rest_framework.pagination import PageNumberPagination
+from rest_framework.permissions import IsAdminUser
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.response import Response
 from rest_framework.views import APIView
 
-from .models import APIKey
+from ai_text_game.users.models import UserProfile
+
+from .caches import explanation_cache
+from .caches import scene_set_cache
+from .llm_router import get_config_llm_model
+from .metrics import render_metrics
 from .models import GameScenario
 from .models import GameStory
 from .models import LLMConfig
 from .models import LLMModel
+from .models import PooledSkeleton
 from .models import StoryProgress
 from .models import TextExplanation
 from .negotiation import IgnoreClientContentNegotiation
+from .quotas import record_usage
 from .serializers import GameScenarioSerializer
 from .serializers import GameStorySerializer
 from .serializers import LLMModelSerializer
 from .serializers import StoryProgressSerializer
 from .serializers import TextExplanationSerializer
-from .utils import get_llm_model
 
 
 class StandardResultsSetPagination(PageNumberPagination):
@@ -119,6 +132,25 @@ class GameStoryViewSet(viewsets.ModelViewSet):
         return Response(serializer.data)
 
 
+def get_pooled_scenes(genre, details, *, is_demo=False):
+    """Serve a pre-generated scene set (see PooledSkeleton), if any."""
+    if settings.SKELETON_POOL_SIZE <= 0 or details:
+        return None
+    prompt_version = PooledSkeleton.get_prompt_version(is_demo=is_demo)
+    return PooledSkeleton.take_scene_set(genre, prompt_version)
+
+
+def get_details_prompt(details):
+    return f"\n* Additional details of the story: {details}" if details else ""
+
+
+def create_scene_chain(active_config):
+    """Create the scene generation chain for the (demo or normal) config."""
+    prompt = active_config.get_prompt_template()
+    llm = get_config_llm_model(active_config, name="scene_generation")
+    return prompt | llm | JsonOutputParser()
+
+
 class GameSceneGeneratorView(APIView):
     permission_classes = [IsAuthenticated]
 
@@ -141,49 +173,138 @@ class GameSceneGeneratorView(APIView):
             is_demo=is_demo,
         )
 
-        # Format the details prompt
-        details_prompt = (
-            f"\n* Additional details of the story: {details}" if details else ""
-        )
+        if scenes := get_pooled_scenes(genre, details, is_demo=is_demo):
+            return Response({"scenes": scenes})
 
-        # Format the prompt
-        prompt = active_config.system_prompt.format(
-            genre=genre,
-            details_prompt=details_prompt,
+        cache_key = scene_set_cache.make_key(
+            genre,
+            details or "",
+            active_config.prompt_version,
         )
+        if scenes := scene_set_cache.get(cache_key):
+            return Response(scenes)
 
         try:
-            active_config = LLMConfig.get_active_config(purpose="scene_generation")
-            key = APIKey.get_available_key(model_name=active_config.model.name)
-            prompt = ChatPromptTemplate.from_template(active_config.system_prompt)
-            json_parser = JsonOutputParser()
-
-            llm = get_llm_model(
+            chain = create_scene_chain(active_config)
+            record_usage(request.user.id, active_config.model.name)
+            scenes = chain.invoke(
                 {
-                    "model_name": active_config.model.name,
-                    "llm_type": active_config.model.llm_type,
-                    "url": active_config.model.url,
-                    "temperature": active_config.temperature,
-                    "key": key,
+                    "genre": genre,
+                    "details_prompt": get_details_prompt(details),
                 },
-                fake=settings.FAKE_LLM_REQUEST,
-                name="scene_generation",
             )
-            chain = prompt | llm | json_parser
-            response = chain.invoke(
+        except (openai.OpenAIError, ValueError) as e:
+            return Response(
+                {"error": str(e)},
+                status=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            )
+
+        scene_set_cache.add(cache_key, scenes)
+        return Response(scenes)
+
+
+@method_decorator(csrf_exempt, name="dispatch")
+@method_decorator(transaction.non_atomic_requests, name="dispatch")
+class AsyncGameSceneGeneratorView(View):
+    """Async version of GameSceneGeneratorView.
+
+    The worker is not blocked while the LLM generates, so one ASGI worker can
+    serve many scene generations at once. Accepts the same session (with CSRF)
+    and token authentication as the API views.
+    """
+
+    @staticmethod
+    def get_data(request) -> dict:
+        """Get the JSON (or form) data of the request, or {} if it is not an
+        object."""
+        try:
+            data = json.loads(request.body or b"{}")
+        except ValueError:
+            data = request.POST
+        return data if isinstance(data, dict) else {}
+
+    async def post(self, request):
+        user = await self.authenticate(request)
+        if user is None:
+            return JsonResponse(
+                {"detail": "Authentication credentials were not provided."},
+                status=status.HTTP_403_FORBIDDEN,
+            )
+
+        data = self.get_data(request)
+        genre = data.get("genre")
+        details = data.get("details")
+        if not genre:
+            return JsonResponse(
+                {"error": "Genre is required"},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+
+        is_demo = await UserProfile.objects.filter(
+            user=user,
+            is_demo_account=True,
+        ).aexists()
+        active_config = await sync_to_async(
+            LLMConfig.get_active_config_with_demo_fallback,
+        )(purpose="scene_generation", is_demo=is_demo)
+
+        if scenes := await sync_to_async(get_pooled_scenes)(
+            genre,
+            details,
+            is_demo=is_demo,
+        ):
+            return JsonResponse({"scenes": scenes})
+
+        cache_key = scene_set_cache.make_key(
+            genre,
+            details or "",
+            active_config.prompt_version,
+        )
+        if scenes := await scene_set_cache.aget(cache_key):
+            return JsonResponse(scenes)
+
+        try:
+            chain = await sync_to_async(create_scene_chain)(active_config)
+            await sync_to_async(record_usage)(user.id, active_config.model.name)
+            scenes = await chain.ainvoke(
                 {
                     "genre": genre,
-                    "details_prompt": details_prompt,
+                    "details_prompt": get_details_prompt(details),
                 },
             )
-            scenes = response
         except (openai.OpenAIError, ValueError) as e:
-            return Response(
+            return JsonResponse(
                 {"error": str(e)},
                 status=status.HTTP_500_INTERNAL_SERVER_ERROR,
             )
 
-        return Response(scenes)
+        await scene_set_cache.aadd(cache_key, scenes)
+        return JsonResponse(scenes)
+
+    async def authenticate(self, request):
+        """Authenticate like DRF's SessionAuthentication and TokenAuthentication.
+
+        Returns:
+            The user, or None if the request is not (validly) authenticated
+        """
+        auth = request.headers.get("Authorization", "").split()
+        if len(auth) == 2 and auth[0] == "Token":  # noqa: PLR2004
+            token = (
+                await Token.objects.select_related("user")
+                .filter(key=auth[1], user__is_active=True)
+                .afirst()
+            )
+            return token.user if token else None
+
+        user = await request.auser()
+        if not user.is_authenticated:
+            return None
+        # Session authentication requires a CSRF token, as in DRF
+        csrf_check = CsrfViewMiddleware(lambda request: None)
+        csrf_check.process_request(request)
+        if csrf_check.process_view(request, None, (), {}) is not None:
+            return None
+        return user
 
 
 @method_decorator(csrf_exempt, name="dispatch")
@@ -201,48 +322,45 @@ class GameSceneGeneratorStreamView(APIView):
                 status=status.HTTP_400_BAD_REQUEST,
             )
 
-        # Format the details prompt
-        details_prompt = (
-            f"\n* Additional details of the story: {details}" if details else ""
-        )
-
         # Check if user is demo account
         is_demo = False
         if hasattr(request.user, "userprofile"):
             is_demo = request.user.userprofile.is_demo_account
 
+        if scenes := get_pooled_scenes(genre, details, is_demo=is_demo):
+            return self.scenes_stream_response(
+                self.replay_scenes_stream(genre, {"scenes": scenes}),
+            )
+
         active_config = LLMConfig.get_active_config_with_demo_fallback(
             purpose="scene_generation",
             is_demo=is_demo,
         )
-        key = APIKey.get_available_key(model_name=active_config.model.name)
-        prompt = ChatPromptTemplate.from_template(active_config.system_prompt)
-        json_parser = JsonOutputParser()
 
-        llm = get_llm_model(
-            {
-                "model_name": active_config.model.name,
-                "llm_type": active_config.model.llm_type,
-                "url": active_config.model.url,
-                "temperature": active_config.temperature,
-                "key": key,
-            },
-            fake=settings.FAKE_LLM_REQUEST,
-            name="scene_generation",
+        cache_key = scene_set_cache.make_key(
+            genre,
+            details or "",
+            active_config.prompt_version,
         )
-        # Create the chain
-        chain = prompt | llm | json_parser
+        if scenes := scene_set_cache.get(cache_key):
+            return self.scenes_stream_response(self.replay_scenes_stream(genre, scenes))
+
+        chain = create_scene_chain(active_config)
+        record_usage(request.user.id, active_config.model.name)
+        details_prompt = get_details_prompt(details)
 
-        # Set up the response for SSE
-        response = StreamingHttpResponse(
-            self.generate_scenes_stream(genre, details_prompt, chain),
-            content_type="text/event-stream",
+        return self.scenes_stream_response(
+            self.generate_scenes_stream(genre, details_prompt, chain, cache_key),
         )
+
+    def scenes_stream_response(self, stream):
+        """Set up the response for SSE"""
+        response = StreamingHttpResponse(stream, content_type="text/event-stream")
         response["Cache-Control"] = "no-cache"
         response["X-Accel-Buffering"] = "no"
         return response
 
-    async def generate_scenes_stream(self, genre, details_prompt, chain):
+    async def generate_scenes_stream(self, genre, details_prompt, chain, cache_key):
         try:
             # Send initial event
             yield f"event: start\ndata: Starting scene generation for {genre}\n\n"
@@ -259,8 +377,45 @@ class GameSceneGeneratorStreamView(APIView):
             # Send complete event with all scenes
             yield f"event: complete\ndata: {json.dumps(chunk)}\n\n"
 
+            if chunk.get("scenes"):
+                await scene_set_cache.aadd(cache_key, chunk)
+
         except Exception as e:
             # Send error event
             error_data = {"error": str(e)}
             yield f"event: error\ndata: {json.dumps(error_data)}\n\n"
             raise
+
+    async def replay_scenes_stream(self, genre, scenes):
+        """Send already generated scenes as the events of a generation."""
+        yield f"event: start\ndata: Starting scene generation for {genre}\n\n"
+        yield f"event: scene\ndata: {json.dumps(scenes)}\n\n"
+        yield f"event: complete\ndata: {json.dumps(scenes)}\n\n"
+
+
+class CacheStatsView(APIView):
+    permission_classes = [IsAdminUser]
+
+    def get(self, request):
+        return Response(
+            {
+                "scenes": scene_set_cache.stats.get_hit_rate(),
+                "explanations": explanation_cache.get_stats(),
+            },
+        )
+
+
+class MetricsView(APIView):
+    """Timings of the game WebSocket of all processes, in the Prometheus format.
+
+    Only collected with GAME_METRICS_ENABLED. Scrapers authenticate with the
+    token of a staff user ("Authorization: Token <key>").
+    """
+
+    permission_classes = [IsAdminUser]
+
+    def get(self, request):
+        return HttpResponse(
+            render_metrics(),
+            content_type="text/plain; version=0.0.4; charset=utf-8",
+        )
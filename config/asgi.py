@@ -1,6 +1,7 @@
 import os
 
 from channels.auth import AuthMiddlewareStack
+from channels.routing import ChannelNameRouter
 from channels.routing import ProtocolTypeRouter
 from channels.routing import URLRouter
 from django.core.asgi import get_asgi_application
@@ -9,6 +10,12 @@ os.environ.setdefault("DJANGO_SETTINGS_MODULE", "config.settings.local")
 django_asgi_app = get_asgi_application()
 
 from ai_text_game.llm_caller.routing import websocket_urlpatterns  # noqa: E402
+from ai_text_game.llm_caller.skeleton_worker import (  # noqa: E402
+    SKELETON_GENERATION_CHANNEL,
+)
+from ai_text_game.llm_caller.skeleton_worker import (  # noqa: E402
+    SkeletonGenerationConsumer,
+)
 
 application = ProtocolTypeRouter(
     {
@@ -16,5 +23,10 @@ application = ProtocolTypeRouter(
         "websocket": AuthMiddlewareStack(
             URLRouter(websocket_urlpatterns),
         ),
+        "channel": ChannelNameRouter(
+            {
+                SKELETON_GENERATION_CHANNEL: SkeletonGenerationConsumer.as_asgi(),
+            },
+        ),
     },
 )
@@ -797,3 +797,117 @@ FAKE_LLM_REQUEST = env.bool("FAKE_LLM_REQUEST", default=False)
 # FAKE_LLM_REQUEST = False
 # FAKE_LLM_REQUEST = True
 FAKE_LLM_DELAY = env.int("FAKE_LLM_DELAY", default=0.03)
+
+# Maximum number of LLM clients (and their HTTP connection pools) kept per process
+LLM_MODEL_POOL_SIZE = env.int("LLM_MODEL_POOL_SIZE", default=32)
+
+# How story segments are summarized after each decision:
+# "sync" (before the next segment), "concurrent" (while the next segment is
+# being generated) or "celery" (in a celery worker)
+STORY_SUMMARY_MODE = env.str("STORY_SUMMARY_MODE", default="sync")
+
+# Pre-generate the continuations of the options of a decision point while the
+# player is reading (only for the first STORY_SPECULATIVE_TOP_K options, 0 = all)
+STORY_SPECULATIVE_GENERATION = env.bool("STORY_SPECULATIVE_GENERATION", default=False)
+STORY_SPECULATIVE_TOP_K = env.int("STORY_SPECULATIVE_TOP_K", default=2)
+# Daily number of speculative generations per model name ("*" for any model)
+STORY_SPECULATIVE_DAILY_LIMITS = env.dict(
+    "STORY_SPECULATIVE_DAILY_LIMITS",
+    cast={"value": int},
+    default={"*": 1000},
+)
+
+# Stream story turns from the continuation or ending chain directly, instead of
+# running the story graph (which picks the same chain)
+STORY_DIRECT_STREAMING = env.bool("STORY_DIRECT_STREAMING", default=True)
+
+# Checkpointer of the story graph: "none" (every turn starts from the state
+# rebuilt from the database) or "memory" (the STORY_GRAPH_MAX_CHECKPOINTS latest
+# checkpoints of the STORY_GRAPH_MAX_THREADS latest stories, per process)
+STORY_GRAPH_CHECKPOINTER = env.str("STORY_GRAPH_CHECKPOINTER", default="none")
+STORY_GRAPH_MAX_CHECKPOINTS = env.int("STORY_GRAPH_MAX_CHECKPOINTS", default=1)
+STORY_GRAPH_MAX_THREADS = env.int("STORY_GRAPH_MAX_THREADS", default=1024)
+
+# Streamed LLM output is sent to the WebSocket in frames of at least this many
+# characters, or after this many milliseconds (0 characters = a frame per chunk)
+WEBSOCKET_STREAM_FLUSH_CHARS = env.int("WEBSOCKET_STREAM_FLUSH_CHARS", default=64)
+WEBSOCKET_STREAM_FLUSH_INTERVAL_MS = env.int(
+    "WEBSOCKET_STREAM_FLUSH_INTERVAL_MS",
+    default=50,
+)
+
+# Where story skeletons are generated: "celery" (a celery task per skeleton) or
+# "worker" (an asyncio worker running many generations concurrently, started
+# with `python manage.py runworker skeleton-generation`)
+SKELETON_GENERATION_BACKEND = env.str("SKELETON_GENERATION_BACKEND", default="celery")
+SKELETON_WORKER_CONCURRENCY = env.int("SKELETON_WORKER_CONCURRENCY", default=20)
+
+# Number of pre-generated scene sets (with a skeleton per scene) kept per active
+# scenario, so that stories without details start without waiting for the
+# skeleton (0 = disabled). With demo configs for the scene or skeleton
+# generation, as many sets are also kept for demo accounts.
+SKELETON_POOL_SIZE = env.int("SKELETON_POOL_SIZE", default=0)
+SKELETON_POOL_REFILL_INTERVAL = env.int("SKELETON_POOL_REFILL_INTERVAL", default=600)
+# Seconds after which served but unclaimed scene sets are removed
+SKELETON_POOL_SERVED_TTL = env.int("SKELETON_POOL_SERVED_TTL", default=60 * 60)
+
+# An LLM call fails over to the failover model of its LLM model (if any) when
+# no token arrives within LLM_FIRST_TOKEN_TIMEOUT seconds. With LLM_HEDGING, the
+# failover model is also called once the first token takes longer than the
+# LLM_HEDGE_PERCENTILE of the model's recent first-token latencies (measured
+# after LLM_HEDGE_MIN_SAMPLES calls); the first to stream is used.
+LLM_FIRST_TOKEN_TIMEOUT = env.float("LLM_FIRST_TOKEN_TIMEOUT", default=30)
+LLM_HEDGING = env.bool("LLM_HEDGING", default=False)
+LLM_HEDGE_PERCENTILE = env.float("LLM_HEDGE_PERCENTILE", default=95)
+LLM_HEDGE_MIN_SAMPLES = env.int("LLM_HEDGE_MIN_SAMPLES", default=20)
+
+# Seconds an API key is skipped after a 429 response without a Retry-After header
+API_KEY_COOLDOWN_SECONDS = env.int("API_KEY_COOLDOWN_SECONDS", default=60)
+
+# Seconds between storing the daily LLM usage counters (kept in the cache) to
+# the database
+LLM_USAGE_RECONCILE_INTERVAL = env.int("LLM_USAGE_RECONCILE_INTERVAL", default=300)
+
+# Log the tokens and latency of every LLM call (see LLMCallLog). The logs are
+# written in batches of LLM_CALL_LOG_BATCH_SIZE rows, or every
+# LLM_CALL_LOG_FLUSH_INTERVAL seconds, by a background thread of each process
+LLM_CALL_LOG_ENABLED = env.bool("LLM_CALL_LOG_ENABLED", default=True)
+LLM_CALL_LOG_BATCH_SIZE = env.int("LLM_CALL_LOG_BATCH_SIZE", default=100)
+LLM_CALL_LOG_FLUSH_INTERVAL = env.float("LLM_CALL_LOG_FLUSH_INTERVAL", default=5)
+
+# Time the stages of the game WebSocket handlers (database calls and their wait
+# for a sync thread, LLM calls, WebSocket sends), served in the Prometheus format
+# at /api/metrics/. Each process adds its timings to totals in the cache every
+# GAME_METRICS_FLUSH_INTERVAL seconds, so that any worker serves the totals of
+# all of them (the cache must be shared, e.g. Redis). The endpoint is staff
+# only: scrape it with the token of a staff user, sent as an
+# "Authorization: Token <key>" header (see rest_framework.authtoken).
+GAME_METRICS_ENABLED = env.bool("GAME_METRICS_ENABLED", default=False)
+GAME_METRICS_FLUSH_INTERVAL = env.float("GAME_METRICS_FLUSH_INTERVAL", default=15)
+
+# https://docs.celeryq.dev/en/stable/userguide/configuration.html#beat-schedule
+CELERY_BEAT_SCHEDULE = {
+    "refill-skeleton-pool": {
+        "task": "ai_text_game.llm_caller.tasks.refill_skeleton_pool",
+        "schedule": SKELETON_POOL_REFILL_INTERVAL,
+    },
+    "reconcile-llm-usage": {
+        "task": "ai_text_game.llm_caller.tasks.reconcile_llm_usage",
+        "schedule": LLM_USAGE_RECONCILE_INTERVAL,
+    },
+}
+
+# Number of generated scene sets cached per (genre, details, prompt); requests
+# are served from the cache once they have all been generated (0 = disabled)
+SCENE_CACHE_VARIANTS = env.int("SCENE_CACHE_VARIANTS", default=5)
+SCENE_CACHE_TIMEOUT = env.int("SCENE_CACHE_TIMEOUT", default=60 * 60 * 24)
+
+# Seconds text explanations are shared between users (0 = not cached)
+EXPLANATION_CACHE_TIMEOUT = env.int(
+    "EXPLANATION_CACHE_TIMEOUT",
+    default=60 * 60 * 24 * 7,
+)
+
+# Explanations run concurrently with the story; beyond this number per
+# connection, the oldest running explanations are cancelled
+MAX_EXPLANATIONS_PER_CONNECTION = env.int("MAX_EXPLANATIONS_PER_CONNECTION", default=3)
@@ -1,5 +1,5 @@
 import { ref, onUnmounted } from 'vue'
-import type { TextExplanation, ExplanationStatus, StoryUpdate } from '@/types/game'
+import type { TextExplanation, ExplanationStatus, StoryOption, StoryUpdate } from '@/types/game'
 
 const WS_BASE_URL = import.meta.env.VITE_WS_BASE_URL
 // const WS_BASE_URL = 'ws://localhost:8000/ws'
@@ -15,6 +15,7 @@ export function useGameWebSocket() {
   const onExplanationStatus = ref<((id: number, status: ExplanationStatus) => void) | null>(null)
   const onStoryUpdate = ref<((update: StoryUpdate) => void) | null>(null)
   const onStoryStream = ref<((content: string) => void) | null>(null)
+  const onDecisionPointOptions = ref<((currentDecision: string, options: StoryOption[]) => void) | null>(null)
   const onError = ref<((error: Error) => void) | null>(null)
 
   const pendingExplanationPromise = ref<{
@@ -36,6 +37,14 @@ export function useGameWebSocket() {
         }
         break
 
+      case 'decision_point_options':
+        // The options the segment being generated leads to, sent before it
+        // streams; they can only be chosen once send_decision_point arrives
+        if (onDecisionPointOptions.value) {
+          onDecisionPointOptions.value(data.current_decision, data.options)
+        }
+        break
+
       case 'send_decision_point':
         // This is the final update with options after story generation is complete
         if (onStoryUpdate.value) {
@@ -187,6 +196,7 @@ export function useGameWebSocket() {
     onExplanationStatus,
     onStoryUpdate,
     onStoryStream,
+    onDecisionPointOptions,
     onError,
   }
 }